@@ -0,0 +1,63 @@
+const { Client } = require("pg");
+
+// Channel the scrapers' bulk writer notifies after every committed write
+const CHANNEL = process.env.NOTIFY_CHANNEL || "scraper_changes";
+const RECONNECT_MS = 5000;
+
+// Table named in a notification -> key of the dataset in websocket messages
+const TABLE_KEYS = {
+    amberdata_delta_surfaces: "delta_surfaces",
+    deribit_funding_data: "funding_data",
+    laevitas_25delta_skew: "skew_data",
+    laevitas_weighted_funding: "weighted_funding",
+    binance_ohlcv: "price",
+    fear_greed_index: "fear_greed",
+};
+
+// Calls onChange(key, instrument) for every committed write; instrument is null for global datasets.
+// onReconnect() runs after every (re)connection, since notifications sent while disconnected are lost.
+function start(onChange, onReconnect) {
+    let client;
+
+    const connect = async () => {
+        client = new Client({ connectionString: process.env.DATABASE_URL });
+        client.on("notification", ({ payload }) => {
+            try {
+                const { table, instrument } = JSON.parse(payload);
+                const key = TABLE_KEYS[table];
+                if (key) onChange(key, instrument);
+            } catch (err) {
+                console.error(`Ignoring malformed change notification: ${payload}`);
+            }
+        });
+        client.on("error", (err) => {
+            console.error(`Change feed connection lost: ${err.message}`);
+            reconnect();
+        });
+
+        try {
+            await client.connect();
+            await client.query(`LISTEN ${CHANNEL}`);
+            console.log(`Listening for changes on ${CHANNEL}`);
+            onReconnect();
+        } catch (err) {
+            console.error(`Change feed unavailable: ${err.message}`);
+            reconnect();
+        }
+    };
+
+    let reconnecting = false;
+    const reconnect = () => {
+        if (reconnecting) return;
+        reconnecting = true;
+        client.end().catch(() => {});
+        setTimeout(() => {
+            reconnecting = false;
+            connect();
+        }, RECONNECT_MS);
+    };
+
+    connect();
+}
+
+module.exports = { start, TABLE_KEYS };
@@ -0,0 +1,77 @@
+// Opens many dashboard subscriptions at once and reports latency, DB work and cache stats.
+//
+//   node loadtest.js [clients=300] [instrument=btc]
+//
+// DB work is read from pg_stat_database, so run it against a database nothing else is using.
+const WebSocket = require("ws");
+const { Client } = require("pg");
+const dotenv = require("dotenv");
+
+dotenv.config();
+
+const CLIENTS = Number(process.argv[2] || 300);
+const INSTRUMENT = process.argv[3] || "btc";
+const WS_URL = process.env.LOADTEST_WS_URL || "ws://localhost:5001";
+const STATS_URL = process.env.LOADTEST_STATS_URL || "http://localhost:5000/cache/stats";
+
+async function dbCounters(client) {
+    const { rows } = await client.query(
+        `SELECT xact_commit, tup_returned, tup_fetched FROM pg_stat_database WHERE datname = current_database()`
+    );
+    return rows[0];
+}
+
+function subscribe(width) {
+    return new Promise((resolve, reject) => {
+        const started = Date.now();
+        const ws = new WebSocket(WS_URL);
+        ws.on("open", () => ws.send(JSON.stringify({ action: "subscribe", instrument: INSTRUMENT, width })));
+        ws.once("message", (data) => {
+            resolve({ ws, latency: Date.now() - started, bytes: data.length });
+        });
+        ws.on("error", reject);
+    });
+}
+
+function percentile(values, p) {
+    const sorted = [...values].sort((a, b) => a - b);
+    return sorted[Math.min(sorted.length - 1, Math.floor((p / 100) * sorted.length))];
+}
+
+async function main() {
+    const db = new Client({ connectionString: process.env.DATABASE_URL });
+    await db.connect();
+
+    // Warm the cache with a single subscriber so the run measures the shared path
+    const warm = await subscribe(1000);
+    warm.ws.close();
+
+    const before = await dbCounters(db);
+    const statsBefore = await (await fetch(STATS_URL)).json();
+
+    // A spread of screen widths, as real dashboards would send
+    const results = await Promise.all(
+        Array.from({ length: CLIENTS }, (_, i) => subscribe(800 + (i % 5) * 200))
+    );
+
+    // pg_stat_database is only flushed periodically
+    await new Promise((resolve) => setTimeout(resolve, 1000));
+    const after = await dbCounters(db);
+    const statsAfter = await (await fetch(STATS_URL)).json();
+    results.forEach(({ ws }) => ws.close());
+    await db.end();
+
+    const latencies = results.map((result) => result.latency);
+    console.log(`${CLIENTS} subscribes to ${INSTRUMENT}`);
+    console.log(`first message latency: p50 ${percentile(latencies, 50)} ms, p99 ${percentile(latencies, 99)} ms`);
+    console.log(`first message size: ${Math.round(results.reduce((sum, r) => sum + r.bytes, 0) / CLIENTS)} bytes avg`);
+    console.log(`DB transactions during run: ${after.xact_commit - before.xact_commit}`);
+    console.log(`DB tuples returned during run: ${after.tup_returned - before.tup_returned}`);
+    console.log(`series cache hits/misses: ${statsAfter.series.hits - statsBefore.series.hits}/${statsAfter.series.misses - statsBefore.series.misses}`);
+    console.log(`snapshot cache hits/misses: ${statsAfter.snapshots.hits - statsBefore.snapshots.hits}/${statsAfter.snapshots.misses - statsBefore.snapshots.misses}`);
+}
+
+main().catch((err) => {
+    console.error(err);
+    process.exit(1);
+});
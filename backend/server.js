@@ -3,6 +3,7 @@ const http = require("http");
 const cors = require("cors");
 const dotenv = require("dotenv");
 const wss = require("./websocket");
+const cache = require("./snapshotCache");
 
 dotenv.config();
 
@@ -12,6 +13,9 @@ const server = http.createServer(app);
 app.use(cors());
 app.use(express.json());
 
+// Hit/miss counters and size of the shared subscriber cache
+app.get("/cache/stats", (req, res) => res.json(cache.stats()));
+
 server.on("upgrade", (request, socket, head) => {
   wss.handleUpgrade(request, socket, head, (ws) => {
     wss.emit("connection", ws, request);
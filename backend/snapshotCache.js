@@ -0,0 +1,249 @@
+const { Pool } = require("pg");
+
+const pool = new Pool({
+  connectionString: process.env.DATABASE_URL,
+});
+
+// Scraper-side service that downsamples the initial payload to the client's chart width
+const SCRAPER_HTTP_URL = process.env.SCRAPER_HTTP_URL || "http://localhost:9100";
+// Downsampled snapshots are reused for this long; rows since then come from the ring buffers
+const SNAPSHOT_TTL_MS = Number(process.env.SNAPSHOT_TTL_MS || 60000);
+// Client widths are rounded up to this step so similar screens share a snapshot
+const WIDTH_STEP = 250;
+
+const DAY_MS = 24 * 60 * 60 * 1000;
+const WINDOWS_MS = {
+  delta_surfaces: 7 * DAY_MS,
+  funding_data: 7 * DAY_MS,
+  skew_data: 7 * DAY_MS,
+  weighted_funding: 7 * DAY_MS,
+  price: 7 * DAY_MS,
+  fear_greed: 100 * DAY_MS,
+};
+
+const queries = {
+  delta_surfaces: `SELECT * FROM amberdata_delta_surfaces WHERE instrument = $1 AND time > $2 ORDER BY time ASC`,
+  funding_data: `SELECT * FROM deribit_funding_data WHERE instrument = $1 AND time > $2 ORDER BY time ASC`,
+  skew_data: `SELECT * FROM laevitas_25delta_skew WHERE instrument = $1 AND time > $2 ORDER BY time ASC`,
+  weighted_funding: `SELECT * FROM laevitas_weighted_funding WHERE instrument = $1 AND time > $2 ORDER BY time ASC`,
+  price: `SELECT * FROM binance_ohlcv WHERE instrument = $1 AND time > $2 ORDER BY time ASC`,
+  fear_greed: `SELECT * FROM fear_greed_index WHERE time > $1 ORDER BY time ASC`,
+};
+
+const stats = {
+  series: { hits: 0, misses: 0, loads: 0, refreshes: 0 },
+  snapshots: { hits: 0, misses: 0, errors: 0 },
+};
+
+// Rows in time order with O(1) append and eviction from the front; grows when full
+class RingBuffer {
+    constructor(capacity = 1024) {
+        this.items = new Array(capacity);
+        this.head = 0;
+        this.length = 0;
+    }
+
+    at(index) {
+        return this.items[(this.head + index) % this.items.length];
+    }
+
+    push(row) {
+        if (this.length === this.items.length) {
+            this.items = this.toArray().concat(new Array(this.items.length));
+            this.head = 0;
+        }
+        this.items[(this.head + this.length) % this.items.length] = row;
+        this.length += 1;
+    }
+
+    evictBefore(time) {
+        while (this.length > 0 && this.at(0).time < time) {
+            this.items[this.head] = undefined;
+            this.head = (this.head + 1) % this.items.length;
+            this.length -= 1;
+        }
+    }
+
+    last() {
+        return this.length > 0 ? this.at(this.length - 1) : undefined;
+    }
+
+    // Rows newer than `time` (or at it, if inclusive), found by binary search
+    since(time, inclusive = false) {
+        let low = 0;
+        let high = this.length;
+        while (low < high) {
+            const middle = (low + high) >> 1;
+            const rowTime = this.at(middle).time;
+            if (rowTime > time || (inclusive && rowTime.getTime() === time.getTime())) {
+                high = middle;
+            } else {
+                low = middle + 1;
+            }
+        }
+        const rows = [];
+        for (let index = low; index < this.length; index++) rows.push(this.at(index));
+        return rows;
+    }
+
+    toArray() {
+        const rows = [];
+        for (let index = 0; index < this.length; index++) rows.push(this.at(index));
+        return rows;
+    }
+}
+
+const series = new Map();    // "key:instrument" -> { rows, json, cursor, loading, refreshing }
+const snapshots = new Map(); // "instrument:width" -> { promise, fetchedAt }
+const listeners = [];
+
+function seriesId(key, instrument) {
+    return `${key}:${key == 'fear_greed' ? "*" : instrument}`;
+}
+
+// Rows after `since`; the newest candle is still forming, so it is left for the next query
+async function queryRows(key, instrument, since) {
+    const params = (key == 'fear_greed') ? [since] : [instrument, since];
+    const result = await pool.query(queries[key], params);
+    if (key == 'price')
+        result.rows.pop()
+    return result.rows;
+}
+
+function append(entry, key, rows) {
+    for (const row of rows) entry.rows.push(row);
+    const length = entry.rows.length;
+    entry.rows.evictBefore(new Date(Date.now() - WINDOWS_MS[key]));
+    if (rows.length > 0)
+        entry.cursor = rows[rows.length - 1].time;
+    // Rows aged out of the window have to leave the serialized copy too, even when nothing new arrived
+    if (rows.length > 0 || entry.rows.length < length)
+        entry.json = null;
+}
+
+// Loaded series for (key, instrument); concurrent first requests share a single query
+async function getSeries(key, instrument) {
+    const id = seriesId(key, instrument);
+    let entry = series.get(id);
+    if (entry) {
+        stats.series.hits += 1;
+        await entry.loading;
+        return entry;
+    }
+
+    stats.series.misses += 1;
+    const start = new Date(Date.now() - WINDOWS_MS[key]);
+    entry = { rows: new RingBuffer(), json: null, cursor: start, loading: null, refreshing: null };
+    entry.loading = queryRows(key, instrument, start).then((rows) => {
+        stats.series.loads += 1;
+        append(entry, key, rows);
+    });
+    series.set(id, entry);
+    try {
+        await entry.loading;
+    } catch (err) {
+        series.delete(id);
+        throw err;
+    }
+    return entry;
+}
+
+// Already-loaded series, without touching the hit/miss counters (used by the ingest side)
+function peek(key, instrument) {
+    return series.get(seriesId(key, instrument));
+}
+
+// The whole window as JSON, serialized once per change and shared by every subscriber
+function serialized(entry) {
+    if (entry.json === null) entry.json = JSON.stringify(entry.rows.toArray());
+    return entry.json;
+}
+
+// Pull rows committed since the last refresh into a loaded series; changes arriving mid-query coalesce
+function refresh(key, instrument) {
+    const entry = series.get(seriesId(key, instrument));
+    if (!entry) return; // nobody has asked for this series yet
+    if (entry.refreshing) {
+        entry.refreshing.again = true;
+        return;
+    }
+    const state = { again: true };
+    entry.refreshing = state;
+
+    (async () => {
+        await entry.loading;
+        while (state.again) {
+            state.again = false;
+            const rows = await queryRows(key, instrument, entry.cursor);
+            stats.series.refreshes += 1;
+            append(entry, key, rows);
+            if (rows.length > 0) listeners.forEach((listener) => listener(key, instrument));
+        }
+    })()
+        .catch((err) => console.error(err))
+        .finally(() => { entry.refreshing = null; });
+}
+
+function refreshAll() {
+    for (const id of series.keys()) {
+        const [key, instrument] = id.split(":");
+        refresh(key, instrument == "*" ? null : instrument);
+    }
+}
+
+// listener(key, instrument) runs after new rows were appended to a series
+function onAppend(listener) {
+    listeners.push(listener);
+}
+
+async function fetchSnapshot(instrument, width) {
+    const params = new URLSearchParams({ instrument, width: String(width) });
+    const response = await fetch(`${SCRAPER_HTTP_URL}/snapshot?${params}`);
+    if (!response.ok) {
+        throw new Error(`snapshot service returned HTTP ${response.status}`);
+    }
+    const { last_timestamps, resolution, ...snapshot } = await response.json();
+    const lastTimestamps = {};
+    for (const key in last_timestamps) lastTimestamps[key] = new Date(last_timestamps[key]);
+    return { json: JSON.stringify(snapshot), lastTimestamps, resolution };
+}
+
+// Downsampled initial payload for a chart width, shared by similar screens for SNAPSHOT_TTL_MS
+async function getSnapshot(instrument, width) {
+    const bucket = Math.ceil((width || 1000) / WIDTH_STEP) * WIDTH_STEP;
+    const id = `${instrument}:${bucket}`;
+    const cached = snapshots.get(id);
+    if (cached && Date.now() - cached.fetchedAt < SNAPSHOT_TTL_MS) {
+        stats.snapshots.hits += 1;
+        return cached.promise;
+    }
+
+    stats.snapshots.misses += 1;
+    const entry = { promise: fetchSnapshot(instrument, bucket), fetchedAt: Date.now() };
+    snapshots.set(id, entry);
+    entry.promise.catch(() => {
+        stats.snapshots.errors += 1;
+        if (snapshots.get(id) === entry) snapshots.delete(id);
+    });
+    return entry.promise;
+}
+
+function getStats() {
+    let rows = 0;
+    for (const entry of series.values()) rows += entry.rows.length;
+    return { ...stats, cachedSeries: series.size, cachedRows: rows, cachedSnapshots: snapshots.size };
+}
+
+module.exports = {
+    RingBuffer,
+    WINDOWS_MS,
+    getSeries,
+    getSnapshot,
+    onAppend,
+    peek,
+    refresh,
+    refreshAll,
+    serialized,
+    stats: getStats,
+    datasets: Object.keys(queries),
+};
@@ -1,77 +1,178 @@
 const WebSocket = require("ws");
-const { Pool } = require("pg");
-
-const pool = new Pool({
-  connectionString: process.env.DATABASE_URL,
-});
+const cache = require("./snapshotCache");
+const changefeed = require("./changefeed");
+const wire = require("./wire");
 
 
 const wss = new WebSocket.Server({ port: 5001 });
 
-async function fetchNewData(ws, instrument) {
-    try {
-        const queries = {
-          delta_surfaces: `SELECT * FROM amberdata_delta_surfaces WHERE instrument = $1 AND time > $2 ORDER BY time ASC`,
-          funding_data: `SELECT * FROM deribit_funding_data WHERE instrument = $1 AND time > $2 ORDER BY time ASC`,
-          skew_data: `SELECT * FROM laevitas_25delta_skew WHERE instrument = $1 AND time > $2 ORDER BY time ASC`,
-          weighted_funding: `SELECT * FROM laevitas_weighted_funding WHERE instrument = $1 AND time > $2 ORDER BY time ASC`,
-          price: `SELECT * FROM binance_ohlcv WHERE instrument = $1 AND time > $2 ORDER BY time ASC`,
-          fear_greed: `SELECT * FROM fear_greed_index WHERE time > $1 ORDER BY time ASC`,
-        };
-
-        let newData = {};
-
-        for (const key in queries) {
-            const params = (key == 'fear_greed') ? [ws.lastTimestamps[key]] : [instrument, ws.lastTimestamps[key]]
-            const result = await pool.query(queries[key], params);
-            if (key == 'price')
-                result.rows.pop()
-            newData[key] = result.rows;
-
-            if (result.rows.length > 0) {
-                ws.lastTimestamps[key] = result.rows[result.rows.length - 1].time;
+// Re-check every cached series this often in case a notification was missed
+const SAFETY_POLL_MS = Number(process.env.CHANGEFEED_SAFETY_POLL_MS || 60000);
+const CANDLE_MS = 60 * 1000;
+
+const subscribers = new Map(); // instrument -> Set of sockets
+
+// Aggregate 1m candles into `resolution`-second buckets, keeping only buckets that have closed
+function bucketCandles(rows, resolution, instrument) {
+    const step = resolution * 1000;
+    const buckets = [];
+    for (const row of rows) {
+        const time = Math.floor(row.time.getTime() / step) * step;
+        const current = buckets[buckets.length - 1];
+        if (!current || current.time.getTime() !== time) {
+            buckets.push({ ...row, time: new Date(time), instrument });
+        } else {
+            current.high = Math.max(current.high, row.high);
+            current.low = Math.min(current.low, row.low);
+            current.close = row.close;
+            current.volume += row.volume;
+        }
+    }
+    const closedUntil = rows.length > 0 ? rows[rows.length - 1].time.getTime() + CANDLE_MS : 0;
+    return buckets.filter((bucket) => bucket.time.getTime() + step <= closedUntil);
+}
+
+// Rows of one series the socket hasn't seen yet, and where its next delta starts
+function rowsAfter(entry, key, ws) {
+    const since = ws.lastTimestamps[key];
+    if (key == 'price' && ws.priceResolution) {
+        const rows = bucketCandles(entry.rows.since(since, true), ws.priceResolution, ws.instrument);
+        const next = rows.length > 0 ? new Date(rows[rows.length - 1].time.getTime() + ws.priceResolution * 1000) : since;
+        return { rows, next };
+    }
+    const rows = entry.rows.since(since);
+    return { rows, next: rows.length > 0 ? rows[rows.length - 1].time : since };
+}
+
+// A message encoded lazily, at most once per wire format, however many sockets receive it
+function outgoing(payload) {
+    const encoded = {};
+    return (format) => {
+        if (!(format in encoded)) {
+            encoded[format] = format === wire.FORMAT ? wire.encode(payload) : JSON.stringify(payload);
+        }
+        return encoded[format];
+    };
+}
+
+// Push a series' new rows to its subscribers; sockets at the same position share one serialized message
+function broadcast(key, instrument) {
+    const instruments = key == 'fear_greed' ? [...subscribers.keys()] : [instrument];
+    const entry = cache.peek(key, instrument);
+
+    for (const target of instruments) {
+        const messages = new Map(); // "resolution:since" -> { message, next }
+        for (const ws of subscribers.get(target) || []) {
+            if (ws.readyState !== WebSocket.OPEN) continue;
+            const resolution = key == 'price' ? ws.priceResolution || 0 : 0;
+            const position = `${resolution}:${ws.lastTimestamps[key].getTime()}`;
+            if (!messages.has(position)) {
+                const { rows, next } = rowsAfter(entry, key, ws);
+                const message = rows.length > 0 ? outgoing({ instrument: target, [key]: rows }) : null;
+                messages.set(position, { message, next });
             }
+            const { message, next } = messages.get(position);
+            if (message) ws.send(message(ws.format));
+            ws.lastTimestamps[key] = next;
         }
+    }
+}
 
-        ws.send(
-          JSON.stringify({ instrument, ...newData })
-        );
+// Initial payload: a cached downsampled snapshot plus what arrived since, or the full cached window
+async function sendInitial(ws, instrument, width) {
+    let snapshot = null;
+    try {
+        snapshot = await cache.getSnapshot(instrument, width);
     } catch (err) {
-        console.error(err);
+        console.error(`Snapshot unavailable, sending raw history: ${err.message}`);
     }
+
+    const entries = {};
+    for (const key of cache.datasets) {
+        entries[key] = await cache.getSeries(key, key == 'fear_greed' ? null : instrument);
+    }
+
+    if (snapshot) {
+        ws.priceResolution = snapshot.resolution;
+        ws.lastTimestamps = { ...snapshot.lastTimestamps };
+        if (ws.format === wire.FORMAT) {
+            // Shared by every binary subscriber of this snapshot
+            snapshot.binary = snapshot.binary || wire.encode(JSON.parse(snapshot.json));
+            ws.send(snapshot.binary);
+        } else {
+            ws.send(snapshot.json);
+        }
+        const tail = {};
+        for (const key of cache.datasets) {
+            const { rows, next } = rowsAfter(entries[key], key, ws);
+            tail[key] = rows;
+            ws.lastTimestamps[key] = next;
+        }
+        ws.send(outgoing({ instrument, ...tail })(ws.format));
+        return;
+    }
+
+    ws.priceResolution = undefined;
+    ws.lastTimestamps = {};
+    for (const key of cache.datasets) {
+        const last = entries[key].rows.last();
+        ws.lastTimestamps[key] = last ? last.time : new Date(Date.now() - cache.WINDOWS_MS[key]);
+    }
+    if (ws.format === wire.FORMAT) {
+        const history = { instrument };
+        for (const key of cache.datasets) history[key] = entries[key].rows.toArray();
+        ws.send(wire.encode(history));
+        return;
+    }
+    // Pre-serialized windows are spliced in as-is, so N subscribers cost one JSON.stringify per change
+    const parts = [`"instrument":${JSON.stringify(instrument)}`];
+    for (const key of cache.datasets) {
+        parts.push(`"${key}":${cache.serialized(entries[key])}`);
+    }
+    ws.send(`{${parts.join(",")}}`);
+}
+
+function removeSubscriber(ws) {
+    const set = subscribers.get(ws.instrument);
+    if (!set) return;
+    set.delete(ws);
+    if (set.size === 0) subscribers.delete(ws.instrument);
 }
 
+cache.onAppend(broadcast);
+changefeed.start(cache.refresh, cache.refreshAll);
+setInterval(cache.refreshAll, SAFETY_POLL_MS);
+
 wss.on("connection", (ws) => {
     console.log("Client connected to WebSocket");
 
     ws.on("message", async (message) => {
-        const { action, instrument } = JSON.parse(message);
+        const { action, instrument, width, format } = JSON.parse(message);
 
         if (action === "subscribe") {
             console.log(`Client subscribed to ${instrument}`);
+            removeSubscriber(ws);
+            ws.instrument = instrument;
+            // ✅ Clients that can decode CDW ask for it; everyone else keeps getting JSON
+            ws.format = format === wire.FORMAT ? wire.FORMAT : "json";
+
+            try {
+                // ✅ Served from the shared cache; only the first subscriber of an instrument hits the DB
+                await sendInitial(ws, instrument, width);
+            } catch (err) {
+                console.error(err);
+                return;
+            }
 
-            const day_ms = 24 * 60 * 60 * 1000;
-            ws.lastTimestamps = {
-              delta_surfaces: new Date(Date.now() - 7 * day_ms),
-              skew_data: new Date(Date.now() - 7 * day_ms),
-              funding_data: new Date(Date.now() - 7 * day_ms),
-              weighted_funding: new Date(Date.now() - 7 * day_ms),
-              price: new Date(Date.now() - 7 * day_ms),
-              fear_greed: new Date(Date.now() - 100 * day_ms),
-            };
-
-            // ✅ Fetch initial data immediately
-            await fetchNewData(ws, instrument);
-
-            // ✅ Start periodic updates
-            const interval = setInterval(() => fetchNewData(ws, instrument), 5000);
-
-            // ✅ Handle WebSocket disconnection (clear interval when client disconnects)
-            ws.on("close", () => {
-                clearInterval(interval);
-                console.log(`Client disconnected from ${instrument}`);
-            });
+            // ✅ From now on changes are pushed as the scrapers commit them
+            if (!subscribers.has(instrument)) subscribers.set(instrument, new Set());
+            subscribers.get(instrument).add(ws);
         }
     });
-});
 
+    // ✅ Handle WebSocket disconnection
+    ws.on("close", () => {
+        removeSubscriber(ws);
+        console.log(`Client disconnected from ${ws.instrument}`);
+    });
+});
@@ -0,0 +1,110 @@
+// Columnar binary wire format (CDW) for dashboard messages.
+// The layout is specified, with a reference encoder/decoder, in scrapers/core/wire.py.
+const zlib = require("zlib");
+
+// Name clients use to ask for this encoding on subscribe
+const FORMAT = "cdw1";
+const MAGIC = Buffer.from("CDW");
+const VERSION = 1;
+const CODEC_NONE = 0;
+const CODEC_DEFLATE = 1;
+const TYPE_FLOAT64 = 0;
+const TYPE_STRING = 1;
+const NULL_CODE = 0xffff;
+
+// Payloads smaller than this aren't worth the deflate round trip
+const COMPRESS_MIN_BYTES = 1024;
+
+function string(value) {
+    const data = Buffer.from(String(value), "utf8");
+    const length = Buffer.alloc(2);
+    length.writeUInt16LE(data.length);
+    return [length, data];
+}
+
+function epochMs(value) {
+    return value instanceof Date ? value.getTime() : typeof value === "string" ? Date.parse(value) : Number(value);
+}
+
+function columnType(values) {
+    return values.every((value) => value === null || value === undefined || typeof value === "number")
+        ? TYPE_FLOAT64
+        : TYPE_STRING;
+}
+
+function encodeSeries(name, rows) {
+    const columns = [];
+    for (const row of rows) {
+        for (const column in row) {
+            if (column !== "time" && !columns.includes(column)) columns.push(column);
+        }
+    }
+
+    const parts = [...string(name)];
+    const counts = Buffer.alloc(6);
+    counts.writeUInt32LE(rows.length, 0);
+    counts.writeUInt16LE(columns.length, 4);
+    parts.push(counts);
+
+    if (rows.length > 0) {
+        const times = Buffer.alloc(8 + 4 * (rows.length - 1));
+        let previous = epochMs(rows[0].time);
+        times.writeBigInt64LE(BigInt(previous), 0);
+        for (let i = 1; i < rows.length; i++) {
+            const current = epochMs(rows[i].time);
+            times.writeInt32LE(current - previous, 8 + 4 * (i - 1));
+            previous = current;
+        }
+        parts.push(times);
+    }
+
+    for (const column of columns) {
+        const values = rows.map((row) => row[column]);
+        const type = columnType(values);
+        parts.push(...string(column), Buffer.from([type]));
+        if (type === TYPE_FLOAT64) {
+            const data = Buffer.alloc(8 * rows.length);
+            values.forEach((value, i) => data.writeDoubleLE(value === null || value === undefined ? NaN : value, 8 * i));
+            parts.push(data);
+        } else {
+            const dictionary = new Map();
+            const codes = Buffer.alloc(2 * rows.length);
+            values.forEach((value, i) => {
+                if (value === null || value === undefined) {
+                    codes.writeUInt16LE(NULL_CODE, 2 * i);
+                    return;
+                }
+                const key = String(value);
+                if (!dictionary.has(key)) dictionary.set(key, dictionary.size);
+                codes.writeUInt16LE(dictionary.get(key), 2 * i);
+            });
+            const size = Buffer.alloc(2);
+            size.writeUInt16LE(dictionary.size);
+            parts.push(size);
+            for (const key of dictionary.keys()) parts.push(...string(key));
+            parts.push(codes);
+        }
+    }
+    return parts;
+}
+
+// Encode { instrument, <series>: rows[] } as one CDW frame
+function encode(message) {
+    const series = Object.entries(message).filter(([, value]) => Array.isArray(value));
+    const count = Buffer.alloc(2);
+    count.writeUInt16LE(series.length);
+    let body = Buffer.concat([
+        ...string(message.instrument || ""),
+        count,
+        ...series.flatMap(([name, rows]) => encodeSeries(name, rows)),
+    ]);
+
+    let codec = CODEC_NONE;
+    if (body.length >= COMPRESS_MIN_BYTES) {
+        body = zlib.deflateSync(body);
+        codec = CODEC_DEFLATE;
+    }
+    return Buffer.concat([MAGIC, Buffer.from([VERSION, codec]), body]);
+}
+
+module.exports = { encode, FORMAT, VERSION };
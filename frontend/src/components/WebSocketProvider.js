@@ -1,4 +1,5 @@
 import React, { createContext, useContext, useEffect, useRef, useState } from "react";
+import { WIRE_FORMAT, binarySupported, decode } from "../wire";
 
 const WebSocketContext = createContext(null);
 
@@ -32,17 +33,30 @@ export const WebSocketProvider = ({ instrument, children }) => {
 
         if (!ws.current) {
             ws.current = new WebSocket(`ws://${window.location.hostname}:5001`);
+            ws.current.binaryType = "arraybuffer";
 
             ws.current.onopen = () => {
                 console.log("WebSocket Connected");
-                ws.current.send(JSON.stringify({ action: "subscribe", instrument }));
+                ws.current.send(JSON.stringify({
+                    action: "subscribe", instrument, width: window.innerWidth,
+                    format: binarySupported ? WIRE_FORMAT : "json",
+                }));
             };
 
+            // ✅ Binary frames decode asynchronously; chain them so messages apply in arrival order
+            let received = Promise.resolve();
             ws.current.onmessage = (event) => {
+                received = received
+                    .then(() => (typeof event.data === "string" ? JSON.parse(event.data) : decode(event.data)))
+                    .then(handleMessage)
+                    .catch((err) => console.error(err));
+            };
+
+            const handleMessage = (message) => {
                 const { 
                     instrument: receivedInstrument, price, delta_surfaces, funding_data, 
                     skew_data, weighted_funding, fear_greed 
-                } = JSON.parse(event.data);
+                } = message;
 
                 if (receivedInstrument !== instrument) return;
 
@@ -0,0 +1,86 @@
+// Decoder for the backend's columnar binary wire format (CDW, see scrapers/core/wire.py).
+// Rows come back in the same shape as the JSON messages, with `time` as epoch milliseconds.
+
+export const WIRE_FORMAT = "cdw1";
+
+const CODEC_NONE = 0;
+const CODEC_DEFLATE = 1;
+const TYPE_FLOAT64 = 0;
+const NULL_CODE = 0xffff;
+
+const textDecoder = new TextDecoder();
+
+// Binary frames need DecompressionStream for deflate; older browsers stay on JSON
+export const binarySupported = typeof DecompressionStream !== "undefined";
+
+async function inflate(bytes) {
+    const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream("deflate"));
+    return new Uint8Array(await new Response(stream).arrayBuffer());
+}
+
+export async function decode(buffer) {
+    const header = new Uint8Array(buffer, 0, 5);
+    if (textDecoder.decode(header.subarray(0, 3)) !== "CDW") throw new Error("Not a CDW message");
+    if (header[3] !== 1) throw new Error(`Unsupported CDW version ${header[3]}`);
+
+    let body = new Uint8Array(buffer, 5);
+    if (header[4] === CODEC_DEFLATE) body = await inflate(body);
+    else if (header[4] !== CODEC_NONE) throw new Error(`Unsupported CDW codec ${header[4]}`);
+
+    const view = new DataView(body.buffer, body.byteOffset, body.byteLength);
+    let offset = 0;
+    const string = () => {
+        const length = view.getUint16(offset, true);
+        const value = textDecoder.decode(body.subarray(offset + 2, offset + 2 + length));
+        offset += 2 + length;
+        return value;
+    };
+
+    const message = { instrument: string() };
+    const seriesCount = view.getUint16(offset, true);
+    offset += 2;
+
+    for (let s = 0; s < seriesCount; s++) {
+        const name = string();
+        const count = view.getUint32(offset, true);
+        const columnCount = view.getUint16(offset + 4, true);
+        offset += 6;
+
+        const rows = new Array(count);
+        if (count > 0) {
+            let time = Number(view.getBigInt64(offset, true));
+            offset += 8;
+            rows[0] = { time };
+            for (let i = 1; i < count; i++) {
+                time += view.getInt32(offset, true);
+                offset += 4;
+                rows[i] = { time };
+            }
+        }
+
+        for (let c = 0; c < columnCount; c++) {
+            const column = string();
+            const type = view.getUint8(offset);
+            offset += 1;
+            if (type === TYPE_FLOAT64) {
+                for (let i = 0; i < count; i++) {
+                    const value = view.getFloat64(offset, true);
+                    rows[i][column] = Number.isNaN(value) ? null : value;
+                    offset += 8;
+                }
+            } else {
+                const dictionary = [];
+                const size = view.getUint16(offset, true);
+                offset += 2;
+                for (let d = 0; d < size; d++) dictionary.push(string());
+                for (let i = 0; i < count; i++) {
+                    const code = view.getUint16(offset, true);
+                    rows[i][column] = code === NULL_CODE ? null : dictionary[code];
+                    offset += 2;
+                }
+            }
+        }
+        message[name] = rows;
+    }
+    return message;
+}
@@ -0,0 +1,15 @@
+"""Offline replay harness and end-to-end ingest benchmark for the scrapers.
+
+Every upstream (Binance, Laevitas, Amberdata, alternative.me, the Deribit
+and Binance WebSockets) is replaced by a local stub that replays fixture
+files, so a scraper change can be measured without touching live APIs.
+
+    python -m bench.record bench/fixtures/recorded   # capture live responses (experimental)
+    python -m bench --database-url postgresql://...  # run main.py against the stubs
+
+fixtures.py defines the fixture format, record.py captures it from the
+live upstreams (experimental, see its docstring), stubs.py holds the HTTP and WebSocket stubs (with latency
+and error injection), synthetic.py generates a fixture set in the
+recorded format for running without live access, and __main__.py is the
+benchmark CLI.
+"""
@@ -0,0 +1,383 @@
+"""End-to-end ingest benchmark: main.run() against the stubs and a throwaway database.
+
+    python -m bench --database-url postgresql://postgres@localhost/postgres --scenario all --json
+
+The database URL is an admin connection: each scenario creates a database
+of its own, loads db/schema.sql into it and drops it afterwards. Without
+--fixtures a synthetic fixture set is generated (see synthetic.py).
+
+Scenarios:
+
+    cold    from an empty database until every job has finished its first
+            run and the spool is drained: the catch-up after a first start
+    steady  the same warm-up, then --duration seconds of regular polling
+            (and streaming, with --streams), measured on their own
+
+Reported per scenario: committed rows/s (and per table; analytics' derived
+rows are counted apart), tick latency per source (one call of a job's
+function, per instrument) at p50 and p99, database round trips per tick
+(statements, COPYs and transaction control, attributed to the job that
+issued them; the spool drainer's writes count as background), peak RSS,
+and what the stubs served. "all" runs each scenario in a fresh process,
+so one's peak RSS and warm caches don't leak into the other.
+"""
+import os
+
+# Before anything imports prometheus_client (see core/workers.py): the benchmark runs a single scraper process
+os.environ["SCRAPER_WORKERS"] = "1"
+
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import multiprocessing
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from dataclasses import asdict
+from urllib.parse import urlsplit, urlunsplit
+
+import asyncpg
+
+from bench import stubs
+
+SCENARIOS = ("cold", "steady")
+SCHEMA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "db", "schema.sql")
+# asyncpg Connection methods that each cost one round trip to the server
+ROUND_TRIP_METHODS = ("execute", "executemany", "fetch", "fetchrow", "fetchval", "copy_records_to_table")
+
+# The job a piece of work belongs to; unset (background) for the drainer, warm-up and pool housekeeping
+_job = contextvars.ContextVar("bench_job", default=None)
+# Set while inside a counted call, so a method built on another one isn't counted twice
+_counting = contextvars.ContextVar("bench_counting", default=False)
+
+logger = logging.getLogger(__name__)
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[round(fraction * 100) - 1]
+
+
+def _rss_mb():
+    """Current resident set size from /proc (Linux), or None."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Probe:
+    """Everything measured while main.run() is running, resettable between warm-up and measurement."""
+
+    def __init__(self):
+        self.adaptive = None
+        self.reset()
+
+    def reset(self):
+        self.started = time.perf_counter()
+        self.ticks = defaultdict(list)
+        self.round_trips = Counter()
+        self.rows = Counter()
+        self.window_peak_rss = _rss_mb()
+
+    def install(self):
+        """Patch the scheduler, asyncpg and the bulk writer to report to this probe."""
+        from core.scheduler import AdaptiveScheduler
+        from db import bulk_writer
+
+        probe = self
+        call = AdaptiveScheduler._call
+        init = AdaptiveScheduler.__init__
+
+        async def timed_call(job, label, *args):
+            token = _job.set(job.name)
+            started = time.perf_counter()
+            try:
+                return await call(job, label, *args)
+            finally:
+                probe.ticks[job.name].append(time.perf_counter() - started)
+                _job.reset(token)
+
+        def capture(self, scheduler):
+            init(self, scheduler)
+            probe.adaptive = self
+
+        AdaptiveScheduler._call = staticmethod(timed_call)
+        AdaptiveScheduler.__init__ = capture
+
+        for name in ROUND_TRIP_METHODS:
+            setattr(asyncpg.Connection, name, self._counted(getattr(asyncpg.Connection, name)))
+
+        bulk_writer.add_listener(lambda table, columns, records: probe.rows.update({table: len(records)}))
+
+    def _counted(self, method):
+        probe = self
+
+        async def counted(*args, **kwargs):
+            if _counting.get():
+                return await method(*args, **kwargs)
+            probe.round_trips[_job.get() or "background"] += 1
+            token = _counting.set(True)
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                _counting.reset(token)
+
+        return counted
+
+    def first_runs_done(self):
+        return self.adaptive is not None and bool(self.adaptive.jobs) and all(
+            job.runs for job in self.adaptive.jobs.values()
+        )
+
+    async def sample_rss(self):
+        while True:
+            rss = _rss_mb()
+            if rss is not None:
+                self.window_peak_rss = max(self.window_peak_rss or 0, rss)
+            await asyncio.sleep(0.25)
+
+    def report(self):
+        from core import analytics
+
+        elapsed = time.perf_counter() - self.started
+        # Ingested rows; what analytics derives from them is reported on its own
+        total_rows = sum(rows for table, rows in self.rows.items() if table != analytics.TABLE)
+        total_ticks = sum(len(ticks) for ticks in self.ticks.values())
+        jobs = {}
+        for name in sorted(set(self.ticks) | {job for job in self.round_trips if job != "background"}):
+            ticks = sorted(self.ticks[name])
+            jobs[name] = {
+                "ticks": len(ticks),
+                "p50_ms": round(_percentile(ticks, 0.5) * 1000, 1) if ticks else None,
+                "p99_ms": round(_percentile(ticks, 0.99) * 1000, 1) if ticks else None,
+                "db_round_trips": self.round_trips[name],
+                "db_round_trips_per_tick": round(self.round_trips[name] / len(ticks), 2) if ticks else None,
+            }
+        return {
+            "seconds": round(elapsed, 2),
+            "rows": total_rows,
+            "rows_per_s": round(total_rows / elapsed, 1) if elapsed else None,
+            "derived_rows": self.rows[analytics.TABLE],
+            "rows_by_table": {table: rows for table, rows in self.rows.items() if table != analytics.TABLE},
+            "ticks": total_ticks,
+            "db_round_trips": sum(self.round_trips.values()),
+            "db_round_trips_background": self.round_trips["background"],
+            "db_round_trips_per_tick": round(sum(self.round_trips.values()) / total_ticks, 2) if total_ticks else None,
+            "jobs": jobs,
+            "peak_rss_mb": round(self.window_peak_rss, 1) if self.window_peak_rss else None,
+            # ru_maxrss is in KB on Linux and covers the whole process, warm-up included
+            "process_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+
+def _database_url(url, name):
+    parts = urlsplit(url)
+    return urlunsplit(parts._replace(path=f"/{name}"))
+
+
+def _schema():
+    """schema.sql without its CREATE DATABASE block and \\c, which only make sense in psql."""
+    with open(SCHEMA) as f:
+        lines = f.read().splitlines()
+    connect = next((index for index, line in enumerate(lines) if line.startswith("\\c")), -1)
+    return "\n".join(lines[connect + 1:])
+
+
+async def _create_database(admin_url, name):
+    conn = await asyncpg.connect(admin_url)
+    try:
+        await conn.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+        await conn.execute(f'CREATE DATABASE "{name}"')
+    finally:
+        await conn.close()
+    conn = await asyncpg.connect(_database_url(admin_url, name))
+    try:
+        await conn.execute(_schema())
+    finally:
+        await conn.close()
+
+
+async def _drop_database(admin_url, name):
+    conn = await asyncpg.connect(admin_url)
+    try:
+        await conn.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+    finally:
+        await conn.close()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _wait_until(condition, timeout):
+    """Poll condition until it holds; False if timeout passed first."""
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() >= deadline:
+            return False
+        await asyncio.sleep(0.1)
+    return True
+
+
+async def _measure(scenario, args, urls):
+    # Read at import, so only now that the environment points at the stubs and the throwaway database
+    import main
+    from clients import http_client
+    from db import spool
+
+    probe = Probe()
+    probe.install()
+    http_client._client = stubs.redirect_client(urls["http"])
+
+    def caught_up():
+        return probe.first_runs_done() and not spool.backlog()["rows"]
+
+    sampler = asyncio.create_task(probe.sample_rss())
+    scraper = asyncio.create_task(main.run())
+    try:
+        completed = await _wait_until(lambda: caught_up() or scraper.done(), args.warmup)
+        if scraper.done():
+            scraper.result()  # main.run() only returns by raising
+        if scenario == "cold":
+            result = probe.report()
+            result["completed"] = completed and caught_up()
+        else:
+            probe.reset()
+            await asyncio.sleep(args.duration)
+            result = probe.report()
+            result["warmed_up"] = completed
+    finally:
+        scraper.cancel()
+        sampler.cancel()
+        await asyncio.gather(scraper, sampler, return_exceptions=True)
+    return result
+
+
+def _run_scenario(scenario, args):
+    name = f"bench_{os.getpid()}_{scenario}"
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        fixtures_dir = args.fixtures
+        if fixtures_dir is None:
+            fixtures_dir = os.path.join(workdir, "fixtures")
+            # In a child process: importing the parsers here would read their settings before they point at the stubs
+            subprocess.run([sys.executable, "-m", "bench.synthetic", fixtures_dir], check=True,
+                           stdout=subprocess.DEVNULL)
+
+        faults = stubs.Faults(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, error_rate=args.error_rate,
+                              error_status=args.error_status, retry_after=args.retry_after,
+                              ws_drop_seconds=args.ws_drop_seconds)
+        # The stubs get a process of their own, so their CPU and memory aren't counted against the scrapers
+        context = multiprocessing.get_context("spawn")
+        conn, child_conn = context.Pipe()
+        server = context.Process(target=stubs.serve, args=(fixtures_dir, asdict(faults), child_conn), daemon=True)
+        server.start()
+        urls = conn.recv()
+
+        asyncio.run(_create_database(args.database_url, name))
+        os.environ.update({
+            "DATABASE_URL": _database_url(args.database_url, name),
+            "SPOOL_DIR": os.path.join(workdir, "spool"),
+            "SPOOL_ENABLED": "0" if args.no_spool else "1",
+            "SCRAPER_HTTP_PORT": str(_free_port()),
+            "DERIBIT_WS_URL": urls["deribit"],
+            "BINANCE_WS_URL": f"{urls['binance_stream']}/stream",
+            "DERIBIT_STREAM": "1" if args.streams else "0",
+            "BINANCE_STREAM": "1" if args.streams else "0",
+            # Warm-up would only open connections to the stub
+            "HTTP_WARMUP": "0",
+        })
+        try:
+            result = asyncio.run(_measure(scenario, args, urls))
+        finally:
+            conn.send("stop")
+            stub_stats = conn.recv() if conn.poll(10) else {}
+            server.join(10)
+            asyncio.run(_drop_database(args.database_url, name))
+
+    result.update(scenario=scenario, fixtures=args.fixtures or "synthetic", faults=asdict(faults),
+                  streams=args.streams, spool=not args.no_spool, stubs=stub_stats)
+    return result
+
+
+def _run_isolated(args):
+    """Run each scenario in a child process of its own and collect their reports."""
+    results = []
+    for scenario in SCENARIOS:
+        with tempfile.NamedTemporaryFile(suffix=".json") as output:
+            command = [sys.executable, "-m", "bench", *sys.argv[1:], "--scenario", scenario,
+                       "--output", output.name, "--quiet"]
+            subprocess.run(command, check=True)
+            with open(output.name) as f:
+                results.extend(json.load(f))
+    return results
+
+
+def _print_table(results):
+    for result in results:
+        print(f"\n{result['scenario']}: {result['rows']} rows in {result['seconds']}s = {result['rows_per_s']} rows/s, "
+              f"{result['db_round_trips_per_tick']} DB round trips/tick "
+              f"({result['db_round_trips_background']} background), peak RSS {result['peak_rss_mb']} MB")
+        print(f"  {'job':<24} {'ticks':>6} {'p50 ms':>9} {'p99 ms':>9} {'DB/tick':>8}")
+        for name, job in result["jobs"].items():
+            print(f"  {name:<24} {job['ticks']:>6} {job['p50_ms']!s:>9} {job['p99_ms']!s:>9} "
+                  f"{job['db_round_trips_per_tick']!s:>8}")
+        print(f"  rows by table: {result['rows_by_table']} (+{result['derived_rows']} derived)")
+        print(f"  stubs: {result['stubs']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"),
+                        required="BENCH_DATABASE_URL" not in os.environ,
+                        help="admin connection; a database is created and dropped per scenario (BENCH_DATABASE_URL)")
+    parser.add_argument("--scenario", choices=(*SCENARIOS, "all"), default="all")
+    parser.add_argument("--duration", type=float, default=120, help="seconds measured in the steady scenario")
+    parser.add_argument("--warmup", type=float, default=600, help="cap on the catch-up, in seconds")
+    parser.add_argument("--fixtures", help="fixture set to replay (default: a synthetic one)")
+    parser.add_argument("--streams", action="store_true", help="run with the Deribit and Binance streams enabled")
+    parser.add_argument("--no-spool", action="store_true", help="write to the database inline instead of spooling")
+    parser.add_argument("--latency-ms", type=float, default=0, help="added to every stubbed response")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="up to this much more, at random")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=int, help="Retry-After seconds sent with injected errors")
+    parser.add_argument("--ws-drop-seconds", type=float, default=0, help="drop WebSocket connections this often")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON instead of a table")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--log-level", default="ERROR", help="level of the scrapers' own logs, to stderr")
+    parser.add_argument("--quiet", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, stream=sys.stderr)
+
+    if args.scenario == "all":
+        results = _run_isolated(args)
+    else:
+        results = [_run_scenario(args.scenario, args)]
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.quiet:
+        return
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        _print_table(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Fixture files: recorded upstream exchanges that the stubs replay.
+
+A fixture set is a directory of JSON-lines files:
+
+    http.jsonl            one HTTP exchange per line: method, host, path, query,
+                          sent (the JSON request body, if any), status, headers,
+                          body (decoded text) and recorded_at
+    deribit.jsonl         JSON-RPC results (method, params, result) and
+                          subscription notifications (channel, data, offset)
+    binance_stream.jsonl  combined-stream kline frames (frame, offset)
+
+recorded_at is epoch seconds and offset is seconds since the first frame
+of its recording. Replayed payloads are moved forward by however many
+whole minutes ago they were recorded (see shift()), so the parsers see
+data that is as fresh as it was at capture time, candles stay aligned to
+the minute, and a steady-state run keeps producing new rows.
+"""
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, UTC
+
+import httpx
+
+HTTP = "http.jsonl"
+DERIBIT = "deribit.jsonl"
+BINANCE_STREAM = "binance_stream.jsonl"
+
+# Keys whose values are epoch timestamps in the upstream payloads (Binance frames use t, T and E)
+TIME_KEYS = frozenset({"date", "d", "timestamp", "t", "T", "E"})
+# Epoch milliseconds and epoch seconds, told apart by magnitude
+_MS_RANGE = (10**12, 10**13)
+_S_RANGE = (10**9, 10**11)
+# Response headers that describe the original transfer rather than the payload
+_TRANSFER_HEADERS = frozenset({
+    "content-encoding", "content-length", "transfer-encoding", "connection", "date", "set-cookie",
+    "keep-alive", "alt-svc", "strict-transport-security",
+})
+
+
+@dataclass
+class FixtureSet:
+    http: list = field(default_factory=list)
+    deribit_results: list = field(default_factory=list)
+    deribit_notifications: list = field(default_factory=list)
+    binance_frames: list = field(default_factory=list)
+
+
+def _read(directory, name):
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load(directory):
+    """Read a fixture set; missing files are empty."""
+    deribit = _read(directory, DERIBIT)
+    return FixtureSet(
+        http=_read(directory, HTTP),
+        deribit_results=[entry for entry in deribit if "method" in entry],
+        deribit_notifications=sorted((entry for entry in deribit if "channel" in entry), key=lambda e: e["offset"]),
+        binance_frames=sorted(_read(directory, BINANCE_STREAM), key=lambda entry: entry["offset"]),
+    )
+
+
+class Writer:
+    """Appends entries to the files of a fixture set."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.counts = {}
+
+    def write(self, name, entry):
+        with open(os.path.join(self.directory, name), "a") as f:
+            f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+
+def offset_ms(recorded_at, now=None):
+    """Whole minutes since recorded_at, in milliseconds."""
+    elapsed = (time.time() if now is None else now) - recorded_at
+    return max(0, int(elapsed // 60)) * 60_000
+
+
+def _shift_value(value, offset):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        if not value.isdigit():
+            return value
+        return str(_shift_value(int(value), offset))
+    if isinstance(value, int):
+        if _MS_RANGE[0] <= value < _MS_RANGE[1]:
+            return value + offset
+        if _S_RANGE[0] <= value < _S_RANGE[1]:
+            return value + offset // 1000
+    return value
+
+
+def shift(payload, offset):
+    """Move every timestamp in a decoded payload forward by offset milliseconds.
+
+    Timestamps are the values of TIME_KEYS, and the open and close times
+    (positions 0 and 6) of Binance kline rows.
+    """
+    if not offset:
+        return payload
+    if isinstance(payload, dict):
+        return {
+            key: _shift_value(value, offset) if key in TIME_KEYS and not isinstance(value, (dict, list))
+            else shift(value, offset)
+            for key, value in payload.items()
+        }
+    if isinstance(payload, list):
+        if len(payload) >= 7 and isinstance(payload[0], int) and _MS_RANGE[0] <= payload[0] < _MS_RANGE[1]:
+            row = list(payload)
+            row[0], row[6] = _shift_value(row[0], offset), _shift_value(row[6], offset)
+            return row
+        return [shift(item, offset) for item in payload]
+    return payload
+
+
+def time_params(query, sent=None):
+    """Request parameters that are points in time, in epoch ms: numeric ms values and YYYY-MM-DD dates.
+
+    Looks at the query string and at the GraphQL variables of a JSON body.
+    """
+    candidates = dict(query)
+    if isinstance(sent, dict) and isinstance(sent.get("variables"), dict):
+        candidates.update(sent["variables"])
+    times = {}
+    for name, value in candidates.items():
+        if isinstance(value, (int, str)) and str(value).isdigit() and _MS_RANGE[0] <= int(value) < _MS_RANGE[1]:
+            times[name] = int(value)
+        elif isinstance(value, str) and len(value) == 10:
+            try:
+                times[name] = int(datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=UTC).timestamp() * 1000)
+            except ValueError:
+                pass
+    return times
+
+
+def http_entry(request, response, body, recorded_at=None):
+    """The fixture line for one exchange; body is the decoded response body."""
+    try:
+        sent = json.loads(request.content) if request.content else None
+    except ValueError:
+        sent = None
+    return {
+        "method": request.method,
+        "host": request.url.netloc.decode("ascii"),
+        "path": request.url.path,
+        "query": dict(request.url.params),
+        "sent": sent,
+        "status": response.status_code,
+        "headers": {name: value for name, value in response.headers.items() if name.lower() not in _TRANSFER_HEADERS},
+        "body": body.decode("utf-8", errors="replace"),
+        "recorded_at": time.time() if recorded_at is None else recorded_at,
+    }
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """Passes requests to the real transport and writes every exchange to a fixture set."""
+
+    def __init__(self, writer, transport):
+        self.writer = writer
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        response = await self.transport.handle_async_request(request)
+        try:
+            # Decoded, so the body is replayed without its original Content-Encoding
+            body = await response.aread()
+        finally:
+            await response.aclose()
+        self.writer.write(HTTP, http_entry(request, response, body))
+        headers = [(name, value) for name, value in response.headers.items() if name.lower() not in _TRANSFER_HEADERS]
+        return httpx.Response(response.status_code, headers=headers, content=body, request=request,
+                              extensions=response.extensions)
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,151 @@
+"""Capture a fixture set from the live upstreams.
+
+Every parser runs once per instrument as on a cold start (nothing stored,
+so each fetches its default catch-up window), Binance's backfill pages
+for that window are fetched as well, and the Deribit tickers and the
+Binance kline stream are recorded for --ws-seconds. Parsed rows go to a
+throwaway spool, so no database is needed.
+
+Experimental: this path has not been run against the live upstreams yet,
+so the captured payloads may not match what stubs.py and fixtures.shift()
+expect. Check a fresh capture with a cold run before relying on it; the
+benchmark defaults to the synthetic fixtures.
+
+    python -m bench.record bench/fixtures/recorded --ws-seconds 180
+"""
+import os
+
+# Before anything imports prometheus_client (see core/workers.py)
+os.environ.setdefault("SCRAPER_WORKERS", "1")
+
+import argparse
+import asyncio
+import json
+import logging
+import tempfile
+import time
+from datetime import datetime, timedelta, UTC
+
+import httpx
+import websockets
+
+from bench import fixtures
+from clients import deribit_ws, http_client
+from core import config, log
+from db import spool, watermarks
+from parsers import alternative, amberdata, binance, binance_backfill, binance_stream, deribit, laevitas, \
+    laevitas_funding
+
+logger = logging.getLogger(__name__)
+
+
+def _recording_client(writer):
+    limits = httpx.Limits(
+        max_connections=http_client.MAX_CONNECTIONS,
+        max_keepalive_connections=http_client.MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=http_client.KEEPALIVE_EXPIRY,
+    )
+    transport = httpx.AsyncHTTPTransport(http2=http_client.HTTP2_ENABLED, limits=limits)
+    return httpx.AsyncClient(
+        transport=fixtures.RecordingTransport(writer, transport),
+        timeout=httpx.Timeout(http_client.TIMEOUT, connect=http_client.CONNECT_TIMEOUT),
+        follow_redirects=True,
+    )
+
+
+async def _record_backfill(instrument):
+    table = binance.INTERVAL_TABLES["1m"]
+    start = binance_backfill._align(watermarks.default_start(table), 60)
+    end = binance_backfill._align(datetime.now(UTC), 60) - timedelta(minutes=1)
+    semaphore = asyncio.Semaphore(binance_backfill.CONCURRENCY)
+    await asyncio.gather(*(
+        binance_backfill._fetch_page(instrument, "1m", page_start, page_end, semaphore)
+        for page_start, page_end in binance_backfill._pages([(start, end)], "1m")
+    ))
+
+
+async def _record_deribit(writer, instruments, seconds):
+    client = deribit_ws.get_client()
+    call = client.call
+
+    async def recording_call(method, params=None):
+        result = await call(method, params)
+        writer.write(fixtures.DERIBIT, {"method": method, "params": params, "result": result,
+                                        "recorded_at": time.time()})
+        return result
+
+    client.call = recording_call
+    await asyncio.gather(*(deribit.fetch_data(instrument) for instrument in instruments))
+
+    started = time.monotonic()
+
+    def on_notification(channel, data):
+        writer.write(fixtures.DERIBIT, {"channel": channel, "data": data, "offset": time.monotonic() - started,
+                                        "recorded_at": time.time()})
+
+    channels = [deribit.TICKER_CHANNEL.format(deribit.instrument_name(instrument)) for instrument in instruments]
+    await client.subscribe(channels, on_notification)
+    await asyncio.sleep(seconds)
+    await deribit_ws.close_client()
+
+
+async def _record_binance_stream(writer, instruments, seconds):
+    url = binance_stream.KlineStream(instruments).url
+    started = time.monotonic()
+    async with websockets.connect(url) as ws:
+        try:
+            async with asyncio.timeout(seconds):
+                async for message in ws:
+                    writer.write(fixtures.BINANCE_STREAM, {"frame": json.loads(message),
+                                                           "offset": time.monotonic() - started,
+                                                           "recorded_at": time.time()})
+        except TimeoutError:
+            pass
+
+
+async def record(directory, ws_seconds):
+    """Record one cold-start pass of every parser into a fixture set; returns the files' entry counts."""
+    writer = fixtures.Writer(directory)
+    http_client._client = _recording_client(writer)
+    # Nothing is stored: every source fetches its default window, as on a first start
+    watermarks._seeded_tables.update(watermarks.INSTRUMENT_TABLES + watermarks.GLOBAL_TABLES)
+
+    with tempfile.TemporaryDirectory(prefix="bench-record-") as spool_dir:
+        spool.DIRECTORY = spool_dir
+        spool.open_spool("record")
+        try:
+            tasks = [
+                *(laevitas.fetch_data(instrument) for instrument in config.instruments_for(laevitas.SOURCE)),
+                *(laevitas_funding.fetch_data(instrument)
+                  for instrument in config.instruments_for(laevitas_funding.SOURCE)),
+                amberdata.fetch_batch(config.instruments_for(amberdata.SOURCE)),
+                alternative.fetch_data(),
+                *(binance.fetch_data(instrument) for instrument in config.instruments_for(binance.SOURCE)),
+                *(_record_backfill(instrument) for instrument in config.instruments_for(binance.SOURCE)),
+                _record_deribit(writer, config.instruments_for(deribit.SOURCE), ws_seconds),
+                _record_binance_stream(writer, config.instruments_for(binance.SOURCE), ws_seconds),
+            ]
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error(f"Recording failed: {result!r}")
+        finally:
+            spool.close_spool()
+            await http_client.close_client()
+    return writer.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory")
+    parser.add_argument("--ws-seconds", type=int, default=180,
+                        help="seconds of WebSocket traffic to record; whole minutes keep replays minute-aligned")
+    args = parser.parse_args()
+    log.setup()
+    logger.warning("bench.record is experimental and has not been validated against the live upstreams")
+    counts = asyncio.run(record(args.directory, args.ws_seconds))
+    print(f"Wrote {counts} to {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
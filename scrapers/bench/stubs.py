@@ -0,0 +1,335 @@
+"""Local stand-ins for every upstream, replaying a fixture set with injected latency and errors.
+
+HttpStub answers the REST and GraphQL APIs, DeribitStub speaks Deribit's
+JSON-RPC over a WebSocket and BinanceStreamStub replays the combined kline
+stream. The parsers keep their real URLs: redirect_client() builds an
+HTTP client that sends every request to the HttpStub and names the
+upstream host in UPSTREAM_HEADER, so per-host limits, breakers and retry
+budgets behave as they would against the real hosts.
+
+serve() runs all three in a process of its own, so the stubs' CPU time
+and memory don't count against the scrapers being measured.
+"""
+import asyncio
+import json
+import random
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+import websockets
+from aiohttp import web
+
+from bench import fixtures
+
+UPSTREAM_HEADER = "X-Bench-Upstream"
+
+
+@dataclass
+class Faults:
+    """What the stubs do to every response besides replaying it."""
+
+    # Seconds added before every HTTP response and JSON-RPC answer, plus up to jitter more
+    latency: float = 0.0
+    jitter: float = 0.0
+    # Share of HTTP requests and JSON-RPC calls answered with an error instead
+    error_rate: float = 0.0
+    error_status: int = 503
+    retry_after: int = None
+    # Drop every WebSocket connection after this many seconds (0: never), to exercise reconnects
+    ws_drop_seconds: float = 0.0
+
+    async def delay(self):
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def inject(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+async def _drop_after(ws, faults):
+    if faults.ws_drop_seconds:
+        await asyncio.sleep(faults.ws_drop_seconds)
+        await ws.close()
+
+
+class HttpStub:
+    """Serves recorded HTTP exchanges, picking the recording that best matches each request.
+
+    Recordings are grouped by (method, upstream host, path). Among those,
+    the ones with the same query parameters are preferred, then the one
+    whose time parameters (startTime, start, GraphQL startDate, ...) are
+    closest once the replay shift is taken off; ties are served in turn.
+    """
+
+    def __init__(self, fixture_set, faults=Faults()):
+        self.faults = faults
+        self.routes = defaultdict(list)
+        for entry in fixture_set.http:
+            self.routes[(entry["method"], entry["host"], entry["path"])].append(entry)
+        self.turns = Counter()
+        self.stats = Counter()
+        self.runner = None
+        self.url = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application(client_max_size=2**26)
+        app.router.add_route("*", "/{tail:.*}", self._handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        bound_host, bound_port = self.runner.addresses[0][:2]
+        self.url = f"http://{bound_host}:{bound_port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    def _pick(self, key, query, sent):
+        candidates = self.routes[key]
+        requested_times = fixtures.time_params(query, sent)
+
+        def score(entry):
+            recorded_times = fixtures.time_params(entry["query"], entry["sent"])
+            shift = fixtures.offset_ms(entry["recorded_at"])
+            mismatched = sum(
+                1 for name in set(query) | set(entry["query"])
+                if name not in requested_times and query.get(name) != entry["query"].get(name)
+            )
+            distance = sum(
+                abs(recorded_times[name] - (requested - shift)) if name in recorded_times else float("inf")
+                for name, requested in requested_times.items()
+            )
+            return mismatched, distance
+
+        scores = [score(entry) for entry in candidates]
+        best = min(scores)
+        tied = [entry for entry, entry_score in zip(candidates, scores) if entry_score == best]
+        self.turns[key] += 1
+        return tied[self.turns[key] % len(tied)]
+
+    async def _handle(self, request):
+        upstream = request.headers.get(UPSTREAM_HEADER, request.host)
+        key = (request.method, upstream, request.path)
+        await self.faults.delay()
+        if key not in self.routes:
+            self.stats["unmatched"] += 1
+            return web.json_response({"error": f"no fixture for {request.method} {upstream}{request.path}"}, status=404)
+        if self.faults.inject():
+            self.stats["injected_errors"] += 1
+            headers = {"Retry-After": str(self.faults.retry_after)} if self.faults.retry_after is not None else None
+            return web.json_response({"error": "injected by the benchmark"}, status=self.faults.error_status,
+                                     headers=headers)
+
+        body = await request.read()
+        try:
+            sent = json.loads(body) if body else None
+        except ValueError:
+            sent = None
+        query = {name: values[-1] for name, values in parse_qs(request.query_string).items()}
+        entry = self._pick(key, query, sent)
+        payload = entry["body"]
+        try:
+            payload = json.dumps(fixtures.shift(json.loads(payload), fixtures.offset_ms(entry["recorded_at"])))
+        except ValueError:
+            pass  # not JSON; replayed as recorded
+        self.stats["served"] += 1
+        return web.Response(status=entry["status"], body=payload.encode(), headers=entry["headers"])
+
+
+class RedirectTransport(httpx.AsyncBaseTransport):
+    """Sends every request to the stub instead of its upstream, naming the upstream in a header."""
+
+    def __init__(self, stub_url, transport):
+        self.stub = httpx.URL(stub_url)
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        request.headers[UPSTREAM_HEADER] = request.url.netloc.decode("ascii")
+        request.url = request.url.copy_with(scheme=self.stub.scheme, host=self.stub.host, port=self.stub.port)
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def redirect_client(stub_url, transport=None):
+    """An AsyncClient configured like clients.http_client's, but talking to the stub."""
+    from clients import http_client
+
+    limits = httpx.Limits(
+        max_connections=http_client.MAX_CONNECTIONS,
+        max_keepalive_connections=http_client.MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=http_client.KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(
+        transport=RedirectTransport(stub_url, transport or httpx.AsyncHTTPTransport(http2=http_client.HTTP2_ENABLED,
+                                                                                limits=limits)),
+        timeout=httpx.Timeout(http_client.TIMEOUT, connect=http_client.CONNECT_TIMEOUT),
+        follow_redirects=True,
+    )
+
+
+class _WebSocketStub:
+    def __init__(self, faults):
+        self.faults = faults
+        self.stats = Counter()
+        self.server = None
+        self.url = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.server = await websockets.serve(self._serve, host, port, max_size=None)
+        bound_host, bound_port = self.server.sockets[0].getsockname()[:2]
+        self.url = f"ws://{bound_host}:{bound_port}"
+        return self.url
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _serve(self, ws):
+        self.stats["connections"] += 1
+        dropper = asyncio.create_task(_drop_after(ws, self.faults))
+        try:
+            await self._handle(ws)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            dropper.cancel()
+
+    async def _replay(self, ws, frames, render):
+        """Send frames at their recorded offsets, over and over, until the connection closes."""
+        if not frames:
+            return
+        period = frames[-1]["offset"] + 1
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        lap = 0
+        try:
+            while True:
+                for frame in frames:
+                    wait = started + lap * period + frame["offset"] - loop.time()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    await ws.send(render(frame))
+                    self.stats["frames"] += 1
+                lap += 1
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+
+class DeribitStub(_WebSocketStub):
+    """Answers Deribit JSON-RPC calls from recorded results and pushes recorded ticker notifications."""
+
+    def __init__(self, fixture_set, faults=Faults()):
+        super().__init__(faults)
+        self.results = defaultdict(list)
+        for entry in fixture_set.deribit_results:
+            self.results[(entry["method"], (entry["params"] or {}).get("instrument_name"))].append(entry)
+        self.notifications = defaultdict(list)
+        for entry in fixture_set.deribit_notifications:
+            self.notifications[entry["channel"]].append(entry)
+        self.turns = Counter()
+
+    async def _handle(self, ws):
+        # Calls share the socket, so each is answered on its own task: injected latency must not queue them
+        tasks = set()
+        try:
+            async for message in ws:
+                task = asyncio.create_task(self._respond(ws, json.loads(message), tasks))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            for task in list(tasks):
+                task.cancel()
+
+    async def _respond(self, ws, request, tasks):
+        method, params = request.get("method"), request.get("params") or {}
+        reply = await self._answer(method, params)
+        reply.update(jsonrpc="2.0", id=request.get("id"))
+        try:
+            await ws.send(json.dumps(reply))
+        except websockets.exceptions.ConnectionClosed:
+            return
+        if method == "public/subscribe" and "result" in reply:
+            for channel in params.get("channels", ()):
+                # Kept in tasks until the connection closes, like the calls
+                tasks.add(asyncio.create_task(self._replay(ws, self.notifications[channel], self._render)))
+
+    async def _answer(self, method, params):
+        self.stats["calls"] += 1
+        if method in ("public/set_heartbeat", "public/test"):
+            return {"result": "ok"}
+        if method == "public/subscribe":
+            return {"result": params.get("channels", [])}
+        await self.faults.delay()
+        if self.faults.inject():
+            self.stats["injected_errors"] += 1
+            return {"error": {"code": 10028, "message": "too_many_requests"}}
+        key = (method, params.get("instrument_name"))
+        recorded = self.results.get(key)
+        if not recorded:
+            self.stats["unmatched"] += 1
+            return {"error": {"code": -32601, "message": f"no fixture for {method}"}}
+        self.turns[key] += 1
+        entry = recorded[self.turns[key] % len(recorded)]
+        return {"result": fixtures.shift(entry["result"], fixtures.offset_ms(entry["recorded_at"]))}
+
+    @staticmethod
+    def _render(entry):
+        data = fixtures.shift(entry["data"], fixtures.offset_ms(entry["recorded_at"]))
+        return json.dumps({"jsonrpc": "2.0", "method": "subscription",
+                           "params": {"channel": entry["channel"], "data": data}})
+
+
+class BinanceStreamStub(_WebSocketStub):
+    """Replays recorded combined-stream kline frames for the streams named in the connection URL."""
+
+    def __init__(self, fixture_set, faults=Faults()):
+        super().__init__(faults)
+        self.frames = fixture_set.binance_frames
+
+    async def _handle(self, ws):
+        query = parse_qs(urlsplit(ws.request.path).query)
+        streams = set("/".join(query.get("streams", [])).split("/"))
+        frames = [frame for frame in self.frames if frame["frame"].get("stream") in streams]
+        replay = asyncio.create_task(self._replay(ws, frames, self._render))
+        try:
+            await ws.wait_closed()
+        finally:
+            replay.cancel()
+
+    @staticmethod
+    def _render(entry):
+        return json.dumps(fixtures.shift(entry["frame"], fixtures.offset_ms(entry["recorded_at"])))
+
+
+async def _serve(fixtures_dir, faults, conn):
+    fixture_set = fixtures.load(fixtures_dir)
+    stubs = {
+        "http": HttpStub(fixture_set, faults),
+        "deribit": DeribitStub(fixture_set, faults),
+        "binance_stream": BinanceStreamStub(fixture_set, faults),
+    }
+    urls = {name: await stub.start() for name, stub in stubs.items()}
+    conn.send(urls)
+    # Anything sent back (or the parent going away) stops the stubs
+    await asyncio.get_running_loop().run_in_executor(None, _wait_for_stop, conn)
+    conn.send({name: dict(stub.stats) for name, stub in stubs.items()})
+    for stub in stubs.values():
+        await stub.stop()
+
+
+def _wait_for_stop(conn):
+    try:
+        conn.recv()
+    except EOFError:
+        pass
+
+
+def serve(fixtures_dir, faults, conn):
+    """Process entry point: start every stub, send their URLs over conn, and their stats when told to stop."""
+    asyncio.run(_serve(fixtures_dir, Faults(**faults) if isinstance(faults, dict) else faults, conn))
@@ -0,0 +1,223 @@
+"""Generate a fixture set in the recorded format, for running the benchmark without live access.
+
+The payloads have the upstreams' shapes and cover the parsers' default
+catch-up windows (a week, 100 days of the Fear & Greed Index), so a cold
+run backfills as much as it would against the real APIs; the values are
+random walks, not market data.
+
+    python -m bench.synthetic bench/fixtures/synthetic
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta, UTC
+from urllib.parse import urlsplit
+
+from bench import fixtures
+from core import config
+from db import watermarks
+from parsers import alternative, amberdata, binance, binance_backfill, deribit, laevitas, laevitas_funding
+
+# Seconds of WebSocket traffic; a whole number of minutes, so every replay lap stays minute-aligned
+STREAM_SECONDS = 180
+MINUTE_MS = 60_000
+
+
+class _Walk:
+    """A random walk, so consecutive values look like a price series."""
+
+    def __init__(self, rng, start, step):
+        self.rng = rng
+        self.value = start
+        self.step = step
+
+    def __call__(self):
+        self.value = max(self.step, self.value + self.rng.gauss(0, self.step))
+        return round(self.value, 6)
+
+
+def _ms(moment):
+    return int(moment.timestamp() * 1000)
+
+
+def _exchange(method, url, body, query=None, sent=None, recorded_at=None):
+    parts = urlsplit(url)
+    return {
+        "method": method,
+        "host": parts.netloc,
+        "path": parts.path,
+        "query": query or {},
+        "sent": sent,
+        "status": 200,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps(body, separators=(",", ":")),
+        "recorded_at": recorded_at,
+    }
+
+
+def _klines(rng, price, start_ms, count):
+    rows = []
+    for index in range(count):
+        open_time = start_ms + index * MINUTE_MS
+        o = price()
+        c = price()
+        volume = round(rng.uniform(1, 100), 4)
+        rows.append([open_time, str(o), str(max(o, c)), str(min(o, c)), str(c), str(volume), open_time + MINUTE_MS - 1,
+                     str(round(volume * c, 4)), rng.randint(100, 5000), str(volume / 2), str(volume * c / 2), "0"])
+    return rows
+
+
+def _binance(writer, rng, instrument, now):
+    price = _Walk(rng, 50_000 if instrument == "btc" else 3_000, 5)
+    current_ms = _ms(now) // MINUTE_MS * MINUTE_MS
+    table = binance.INTERVAL_TABLES["1m"]
+    start = binance_backfill._align(watermarks.default_start(table), 60)
+    end = datetime.fromtimestamp(current_ms / 1000, UTC) - timedelta(minutes=1)
+    # Backfill pages exactly as binance_backfill requests them for a table with nothing in it
+    for page_start, page_end in binance_backfill._pages([(start, end)], "1m"):
+        count = (page_end - page_start) // MINUTE_MS + 1
+        query = {"symbol": binance.symbol(instrument), "interval": "1m", "startTime": str(page_start),
+                 "endTime": str(page_end), "limit": str(binance_backfill.MAX_CANDLES_PER_REQUEST)}
+        writer.write(fixtures.HTTP, _exchange("GET", binance.BASE_URL, _klines(rng, price, page_start, count),
+                                              query=query, recorded_at=now.timestamp()))
+    # The regular poll: the latest candles, the last one still open
+    query = {"symbol": binance.symbol(instrument), "interval": "1m", "limit": "1000"}
+    latest = _klines(rng, price, current_ms - 999 * MINUTE_MS, 1000)
+    writer.write(fixtures.HTTP, _exchange("GET", binance.BASE_URL, latest, query=query, recorded_at=now.timestamp()))
+
+
+def _laevitas(writer, rng, instrument, now):
+    start = watermarks.default_start(laevitas.TABLE)
+    walks = {days: _Walk(rng, rng.uniform(-5, 5), 0.1) for days in laevitas.PERIODS}
+    points = []
+    moment = start
+    while moment <= now:
+        points.append({"date": _ms(moment), **{str(days): walk() for days, walk in walks.items()}})
+        moment += laevitas.CADENCE
+    url = f"{laevitas.BASE_URL}/{config.symbol(laevitas.SOURCE, instrument)}/25d/"
+    query = {"start": start.strftime('%Y-%m-%d'), "end": now.strftime('%Y-%m-%d')}
+    writer.write(fixtures.HTTP, _exchange("GET", url, points, query=query, recorded_at=now.timestamp()))
+
+
+def _laevitas_funding(writer, rng, instrument, now):
+    start = watermarks.default_start(laevitas_funding.TABLE)
+    price = _Walk(rng, 50_000 if instrument == "btc" else 3_000, 5)
+    funding = _Walk(rng, 10, 0.5)
+    points = []
+    moment = start
+    while moment <= now:
+        points.append({"d": _ms(moment), "p": price(), "a": funding()})
+        moment += laevitas_funding.CADENCE
+    url = f"{laevitas_funding.BASE_URL}/{config.symbol(laevitas_funding.SOURCE, instrument)}/"
+    query = {"start": start.strftime('%Y-%m-%d'), "end": now.strftime('%Y-%m-%d'), "class_attribute": "all_apr"}
+    writer.write(fixtures.HTTP, _exchange("GET", url, points, query=query, recorded_at=now.timestamp()))
+
+
+def _amberdata(writer, rng, instruments, now):
+    walk = _Walk(rng, 1, 0.01)
+    keys = [column.key for column in amberdata.SPEC.columns if (column.key or "").startswith("delta")]
+    for window in amberdata.windows(watermarks.default_start(amberdata.TABLE), now):
+        start_date, end_date = (day.strftime('%Y-%m-%d') for day in window)
+        hours = [datetime.combine(window[0], datetime.min.time(), UTC) + timedelta(hours=hour)
+                 for hour in range(24 * ((window[1] - window[0]).days + 1))]
+        data = {
+            f"i{index}": [
+                {
+                    "date": _ms(hour), "exchange": "deribit", "currency": config.symbol(amberdata.SOURCE, instrument),
+                    "daysToExpiration": 30,
+                    **{key: walk() for key in keys},
+                    "__typename": "DeltaSurfacesConstantWings",
+                }
+                for hour in hours if hour <= now
+            ]
+            for index, instrument in enumerate(instruments)
+        }
+        writer.write(fixtures.HTTP, _exchange("POST", amberdata.BASE_URL, {"data": data},
+                                              sent=amberdata.build_payload(instruments, start_date, end_date),
+                                              recorded_at=now.timestamp()))
+
+
+def _alternative(writer, rng, now):
+    today = datetime.combine(now.date(), datetime.min.time(), UTC)
+    entries = []
+    for days in range(100):
+        value = rng.randint(5, 95)
+        entries.append({"value": str(value), "value_classification": "Greed" if value > 50 else "Fear",
+                        "timestamp": str(int((today - timedelta(days=days)).timestamp()))})
+    url = alternative.API_URL.format(100)
+    writer.write(fixtures.HTTP, _exchange("GET", url, {"name": "Fear and Greed Index", "data": entries},
+                                          query={"limit": "100"}, recorded_at=now.timestamp()))
+
+
+def _deribit(writer, rng, instrument, now):
+    name = deribit.instrument_name(instrument)
+    price = _Walk(rng, 50_000 if instrument == "btc" else 3_000, 5)
+    funding = _Walk(rng, 0.0001, 0.00001)
+    current_ms = _ms(now) // MINUTE_MS * MINUTE_MS
+    chart = [{"timestamp": current_ms - minutes * MINUTE_MS, "index_price": price(), "interest_8h": funding()}
+             for minutes in range(1439, -1, -1)]
+    writer.write(fixtures.DERIBIT, {"method": "public/get_funding_chart_data",
+                                    "params": {"instrument_name": name, "length": "24h"},
+                                    "result": {"current_interest": funding(), "interest_8h": funding(), "data": chart},
+                                    "recorded_at": now.timestamp()})
+    channel = deribit.TICKER_CHANNEL.format(name)
+    for offset in range(STREAM_SECONDS):
+        captured = now.timestamp() - STREAM_SECONDS + offset
+        writer.write(fixtures.DERIBIT, {"channel": channel, "offset": offset, "recorded_at": captured,
+                                        "data": {"timestamp": int(captured * 1000), "instrument_name": name,
+                                                 "index_price": price(), "funding_8h": funding()}})
+
+
+def _binance_stream(writer, rng, instrument, now):
+    symbol = binance.symbol(instrument)
+    price = _Walk(rng, 50_000 if instrument == "btc" else 3_000, 5)
+    candle = None
+    for offset in range(STREAM_SECONDS):
+        captured_ms = int((now.timestamp() - STREAM_SECONDS + offset) * 1000)
+        open_time = captured_ms // MINUTE_MS * MINUTE_MS
+        close = price()
+        if candle is None or candle["t"] != open_time:
+            candle = {"t": open_time, "T": open_time + MINUTE_MS - 1, "s": symbol, "i": "1m",
+                      "o": str(close), "h": str(close), "l": str(close), "v": 0.0}
+        candle.update(c=str(close), h=str(max(float(candle["h"]), close)), l=str(min(float(candle["l"]), close)),
+                      v=round(candle["v"] + rng.uniform(0, 2), 4))
+        # The last update of every minute closes its candle
+        closed = (captured_ms + 1000) // MINUTE_MS * MINUTE_MS != open_time
+        kline = {**candle, "v": str(candle["v"]), "x": closed}
+        frame = {"stream": f"{symbol.lower()}@kline_1m",
+                 "data": {"e": "kline", "E": captured_ms, "s": symbol, "k": kline}}
+        writer.write(fixtures.BINANCE_STREAM, {"frame": frame, "offset": offset, "recorded_at": captured_ms / 1000})
+
+
+def synthesize(directory, now=None, seed=0):
+    """Write a synthetic fixture set for every configured instrument to directory; returns the files' entry counts."""
+    now = now or datetime.now(UTC)
+    rng = random.Random(seed)
+    writer = fixtures.Writer(directory)
+    for instrument in config.instruments_for(binance.SOURCE):
+        _binance(writer, rng, instrument, now)
+        _binance_stream(writer, rng, instrument, now)
+    for instrument in config.instruments_for(laevitas.SOURCE):
+        _laevitas(writer, rng, instrument, now)
+    for instrument in config.instruments_for(laevitas_funding.SOURCE):
+        _laevitas_funding(writer, rng, instrument, now)
+    for instrument in config.instruments_for(deribit.SOURCE):
+        _deribit(writer, rng, instrument, now)
+    _amberdata(writer, rng, config.instruments_for(amberdata.SOURCE), now)
+    _alternative(writer, rng, now)
+    return writer.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    started = time.perf_counter()
+    counts = synthesize(args.directory, seed=args.seed)
+    print(f"Wrote {counts} to {args.directory} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
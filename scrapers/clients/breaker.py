@@ -0,0 +1,129 @@
+"""Per-host circuit breakers and retry budgets for upstream requests.
+
+A host's breaker opens after BREAKER_FAILURES consecutive failed requests
+(network errors, deadlines, 418/429, 5xx). While it is open, requests to
+that host fail immediately instead of waiting on a dead endpoint. Once the
+cooldown has passed, one probe request goes through (half-open). If the
+probe succeeds the breaker closes. If it fails the breaker reopens with
+twice the cooldown, up to BREAKER_MAX_COOLDOWN.
+
+Retries are paid for from a per-host token bucket. Every request adds
+RETRY_BUDGET_RATIO tokens and every retry spends one, so retries stay a
+bounded share of the traffic to a host however badly it is doing.
+"""
+import logging
+import os
+import time
+from dataclasses import dataclass
+
+from core import metrics
+
+FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+COOLDOWN = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "30"))
+MAX_COOLDOWN = float(os.getenv("BREAKER_MAX_COOLDOWN_SECONDS", "600"))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MAX = float(os.getenv("RETRY_BUDGET_MAX", "10"))
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Breaker:
+    host: str
+    state: str = CLOSED
+    failures: int = 0
+    cooldown: float = COOLDOWN
+    open_until: float = 0.0
+    # Whether the half-open probe is in flight
+    probing: bool = False
+    trips: int = 0
+    retry_tokens: float = RETRY_BUDGET_MAX
+    retries: int = 0
+    retries_denied: int = 0
+
+    def allow(self, now=None):
+        """Whether a request may go out now; in half-open state only the single probe may."""
+        if self.state == CLOSED:
+            self.retry_tokens = min(RETRY_BUDGET_MAX, self.retry_tokens + RETRY_BUDGET_RATIO)
+            return True
+        if self.state == OPEN and (now or time.time()) >= self.open_until:
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def is_open(self, now=None):
+        """Whether requests are being refused (and the cooldown hasn't passed yet)."""
+        return self.state != CLOSED and ((now or time.time()) < self.open_until or self.probing)
+
+    def success(self):
+        if self.state != CLOSED:
+            logger.info(f"Circuit for {self.host} closed again")
+        self.failures = 0
+        self.cooldown = COOLDOWN
+        self.probing = False
+        self._set_state(CLOSED)
+
+    def failure(self, now=None):
+        self.failures += 1
+        if self.state == HALF_OPEN:
+            self.cooldown = min(self.cooldown * 2, MAX_COOLDOWN)
+            self._open(now)
+        elif self.state == CLOSED and self.failures >= FAILURES:
+            self._open(now)
+
+    def abandon(self):
+        """A request ended without an outcome (cancelled); free the probe slot it may have held."""
+        self.probing = False
+
+    def retry(self):
+        """Spend a retry token; False when the budget is exhausted or the circuit has opened."""
+        if self.state != CLOSED or self.retry_tokens < 1:
+            self.retries_denied += 1
+            metrics.record_retry(self.host, "denied")
+            return False
+        self.retry_tokens -= 1
+        self.retries += 1
+        metrics.record_retry(self.host, "retried")
+        return True
+
+    def _open(self, now):
+        self.open_until = (now or time.time()) + self.cooldown
+        self.probing = False
+        self.trips += 1
+        self._set_state(OPEN)
+        logger.warning(f"Circuit for {self.host} opened after {self.failures} failures; "
+                       f"failing fast for {self.cooldown:.0f}s")
+
+    def _set_state(self, state):
+        self.state = state
+        metrics.record_circuit_state(self.host, state)
+
+    def status(self):
+        return {
+            "host": self.host,
+            "state": self.state,
+            "failures_in_row": self.failures,
+            "open_until": self.open_until if self.state != CLOSED else None,
+            "trips": self.trips,
+            "retry_tokens": round(self.retry_tokens, 2),
+            "retries": self.retries,
+            "retries_denied": self.retries_denied,
+        }
+
+
+_breakers = {}
+
+
+def get(host):
+    if host not in _breakers:
+        _breakers[host] = Breaker(host)
+    return _breakers[host]
+
+
+def status():
+    """Every known host's breaker and retry budget."""
+    return [breaker.status() for breaker in sorted(_breakers.values(), key=lambda breaker: breaker.host)]
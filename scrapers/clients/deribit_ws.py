@@ -0,0 +1,198 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+
+import websockets
+
+WS_URL = os.getenv("DERIBIT_WS_URL", "wss://www.deribit.com/ws/api/v2")
+HEADERS = {
+    "Origin": "https://www.deribit.com",
+    "Cache-Control": "no-cache",
+    "Accept-Language": "en-US,en;q=0.9,ru;q=0.8,hy;q=0.7",
+    "Pragma": "no-cache",
+    "Accept-Encoding": "gzip, deflate, br, zstd",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36"
+}
+REQUEST_TIMEOUT = float(os.getenv("DERIBIT_REQUEST_TIMEOUT", "15"))
+HEARTBEAT_INTERVAL = int(os.getenv("DERIBIT_HEARTBEAT_INTERVAL", "30"))  # seconds, Deribit minimum is 10
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+
+logger = logging.getLogger(__name__)
+
+
+class DeribitError(Exception):
+    """JSON-RPC error returned by Deribit."""
+
+    def __init__(self, error):
+        super().__init__(f"{error.get('code')}: {error.get('message')}")
+        self.code = error.get("code")
+
+
+class DeribitClient:
+    """Long-lived Deribit JSON-RPC session shared by every instrument.
+
+    Requests are multiplexed over one socket and matched to their responses
+    by id. The session reconnects with exponential backoff, answers Deribit's
+    heartbeat test requests and restores channel subscriptions after reconnecting.
+    """
+
+    def __init__(self, url=WS_URL, headers=None):
+        self.url = url
+        self.headers = headers or HEADERS
+        self._ids = itertools.count(1)
+        self._pending = {}  # request id -> future awaiting the response
+        self._subscriptions = {}  # channel -> callback(channel, data)
+        self._ws = None
+        self._connected = asyncio.Event()
+        self._task = None
+        self._heartbeats = set()  # in-flight heartbeat answers, kept referenced until they finish
+        self._closing = False
+
+    def start(self):
+        """Start the background connection loop (idempotent)."""
+        if self._task is None or self._task.done():
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        self._closing = True
+        if self._ws is not None:
+            await self._ws.close()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._heartbeats):
+            task.cancel()
+
+    async def call(self, method, params=None):
+        """Send a JSON-RPC request and wait for its result."""
+        self.start()
+        await asyncio.wait_for(self._connected.wait(), REQUEST_TIMEOUT)
+        return await self._send(method, params)
+
+    async def subscribe(self, channels, callback):
+        """Subscribe to public channels; callback(channel, data) runs for every notification."""
+        for channel in channels:
+            self._subscriptions[channel] = callback
+        self.start()
+        if self._connected.is_set():
+            await self._send("public/subscribe", {"channels": list(channels)})
+
+    async def _send(self, method, params):
+        if self._ws is None:
+            raise ConnectionError("Deribit WebSocket is not connected")
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            await self._ws.send(json.dumps({
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "method": method,
+                "params": params or {},
+            }))
+            return await asyncio.wait_for(future, REQUEST_TIMEOUT)
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def _run(self):
+        delay = RECONNECT_MIN_DELAY
+        while not self._closing:
+            try:
+                async with websockets.connect(self.url, additional_headers=self.headers) as ws:
+                    self._ws = ws
+                    reader = asyncio.create_task(self._read(ws))
+                    try:
+                        await self._on_connect()
+                        delay = RECONNECT_MIN_DELAY
+                        await reader
+                    finally:
+                        reader.cancel()
+            except (websockets.exceptions.WebSocketException, OSError, ValueError, asyncio.TimeoutError, DeribitError) as e:
+                logger.error(f"Deribit WebSocket error: {e}")
+            finally:
+                self._connected.clear()
+                self._ws = None
+                self._fail_pending(ConnectionError("Deribit WebSocket disconnected"))
+
+            if self._closing:
+                break
+            # Full jitter keeps both instruments' callers from reconnecting in lockstep
+            await asyncio.sleep(random.uniform(0, delay))
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    async def _on_connect(self):
+        logger.info("Connected to Deribit WebSocket")
+        await self._send("public/set_heartbeat", {"interval": HEARTBEAT_INTERVAL})
+        if self._subscriptions:
+            await self._send("public/subscribe", {"channels": list(self._subscriptions)})
+        self._connected.set()
+
+    async def _read(self, ws):
+        async for message in ws:
+            self._dispatch(json.loads(message))
+
+    def _dispatch(self, message):
+        if "id" in message:
+            future = self._pending.get(message["id"])
+            if future is None or future.done():
+                return
+            if "error" in message:
+                future.set_exception(DeribitError(message["error"]))
+            else:
+                future.set_result(message.get("result"))
+            return
+
+        method = message.get("method")
+        params = message.get("params", {})
+        if method == "heartbeat" and params.get("type") == "test_request":
+            task = asyncio.create_task(self._answer_heartbeat())
+            self._heartbeats.add(task)
+            task.add_done_callback(self._heartbeats.discard)
+        elif method == "subscription":
+            channel = params.get("channel")
+            callback = self._subscriptions.get(channel)
+            if callback is not None:
+                # Callbacks run in the reader task; one bad notification must not end the session
+                try:
+                    callback(channel, params.get("data"))
+                except Exception as e:
+                    logger.error(f"Deribit subscription callback for {channel} failed: {e!r}")
+
+    async def _answer_heartbeat(self):
+        try:
+            await self._send("public/test", {})
+        except (websockets.exceptions.WebSocketException, asyncio.TimeoutError, ConnectionError) as e:
+            logger.warning(f"Failed to answer Deribit heartbeat: {e}")
+
+    def _fail_pending(self, error):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+
+
+_client = None
+
+
+def get_client():
+    """Return the process-wide Deribit session, creating it on first use."""
+    global _client
+    if _client is None:
+        _client = DeribitClient()
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
@@ -0,0 +1,77 @@
+"""Conditional GETs for endpoints that are polled far more often than they change.
+
+Per URL (query string included) the cache remembers the ETag,
+Last-Modified and a hash of the last body that was stored successfully.
+get() sends those validators upstream and returns None when the payload
+is known to be unchanged: either a 304, or a 200 whose body hashes the
+same. Parsers call remember() only after their write succeeded, so a
+failed store is refetched and parsed again on the next run.
+"""
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from clients import http_client
+from core import metrics
+
+MAX_ENTRIES = int(os.getenv("HTTP_CACHE_MAX_ENTRIES", "512"))
+ENABLED = os.getenv("HTTP_CACHE_ENABLED", "1") == "1"
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Entry:
+    etag: str | None
+    last_modified: str | None
+    digest: bytes
+    size: int
+
+
+_entries = OrderedDict()  # url -> _Entry, least recently used first
+
+
+def _digest(content):
+    return hashlib.blake2b(content, digest_size=16).digest()
+
+
+async def get(url, source, instrument=None, headers=None):
+    """GET url, or return None when the payload is the one stored last time."""
+    entry = _entries.get(url) if ENABLED else None
+    headers = dict(headers or {})
+    if entry is not None:
+        _entries.move_to_end(url)
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+
+    response = await http_client.get(url, headers=headers)
+    if entry is None:
+        return response
+    if response.status_code == 304:
+        metrics.record_bytes_saved(source, instrument, "not_modified", entry.size)
+        logger.debug(f"{url} not modified", extra={"source": source, "instrument": instrument})
+        return None
+    if response.status_code == 200 and _digest(response.content) == entry.digest:
+        metrics.record_bytes_saved(source, instrument, "unchanged", entry.size)
+        logger.debug(f"{url} unchanged", extra={"source": source, "instrument": instrument})
+        return None
+    return response
+
+
+def remember(url, response):
+    """Record a response whose rows have been stored, so identical payloads are skipped."""
+    if not ENABLED or response.status_code != 200:
+        return
+    _entries[url] = _Entry(
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified"),
+        digest=_digest(response.content),
+        size=len(response.content),
+    )
+    _entries.move_to_end(url)
+    while len(_entries) > MAX_ENTRIES:
+        _entries.popitem(last=False)
@@ -0,0 +1,212 @@
+import asyncio
+import importlib.util
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+import httpx
+
+from clients import breaker
+from core import metrics
+
+TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", "4"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "1") == "1" and importlib.util.find_spec("h2") is not None
+# Bound on a whole request() call, retries included (TIMEOUT only bounds each network operation)
+DEADLINE = float(os.getenv("HTTP_DEADLINE", "60"))
+RETRY_ATTEMPTS = max(1, int(os.getenv("HTTP_RETRY_ATTEMPTS", "3")))
+RETRY_BASE_DELAY = float(os.getenv("HTTP_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("HTTP_RETRY_MAX_DELAY", "8"))
+
+# Re-exported so parsers don't need to import httpx just to catch network errors
+HTTPError = httpx.HTTPError
+# Misuse of a streamed body (read twice, read after close); not an HTTPError
+StreamError = httpx.StreamError
+
+
+class CircuitOpenError(httpx.HTTPError):
+    """The request was not sent: the host's circuit breaker is open."""
+
+
+_client = None
+_host_semaphores = {}
+_host_failures = {}  # host -> consecutive failed requests (network errors, 418/429, 5xx)
+_host_retry_after = {}  # host -> epoch seconds before which the host asked us not to come back
+
+
+def host_of(url):
+    return urlsplit(url).netloc
+
+
+def get_client():
+    """Return the process-wide async HTTP client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        # httpx decodes gzip/deflate natively, and br/zstd when brotli/zstandard are installed
+        _client = httpx.AsyncClient(
+            http2=HTTP2_ENABLED,
+            timeout=httpx.Timeout(TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            follow_redirects=True,
+        )
+    return _client
+
+
+async def close_client():
+    """Close the shared client and drop its pooled connections."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _host_semaphore(url):
+    """Limit the number of in-flight requests per upstream host."""
+    host = host_of(url)
+    if host not in _host_semaphores:
+        _host_semaphores[host] = asyncio.Semaphore(PER_HOST_LIMIT)
+    return _host_semaphores[host]
+
+
+def host_status(host):
+    """Return (consecutive failures, retry-after epoch seconds or None) for an upstream host."""
+    return _host_failures.get(host, 0), _host_retry_after.get(host)
+
+
+def circuit_open(host):
+    """Epoch seconds the host's circuit stays open until, or None when requests may go out."""
+    host_breaker = breaker.get(host)
+    return host_breaker.open_until if host_breaker.is_open() else None
+
+
+def allow_retry(url):
+    """Spend one of the host's retry tokens; False when its budget is exhausted or its circuit is open."""
+    return breaker.get(host_of(url)).retry()
+
+
+def _failed(response):
+    return response is None or response.status_code >= 500 or response.status_code in (418, 429)
+
+
+def _record_outcome(host, response=None):
+    if not _failed(response):
+        _host_failures.pop(host, None)
+        _host_retry_after.pop(host, None)
+        breaker.get(host).success()
+        return
+
+    _host_failures[host] = _host_failures.get(host, 0) + 1
+    breaker.get(host).failure()
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after is not None and retry_after.isdigit():
+        _host_retry_after[host] = time.time() + int(retry_after)
+
+
+def _admit(host):
+    if not breaker.get(host).allow():
+        metrics.record_short_circuit(host)
+        raise CircuitOpenError(f"Circuit for {host} is open; not sending the request")
+
+
+def _retry_delay(attempt, response):
+    """Full-jitter exponential backoff, or the host's Retry-After when it asks for longer; None to give up."""
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after is not None and retry_after.isdigit():
+        if int(retry_after) > RETRY_MAX_DELAY:
+            return None
+        delay = max(delay, int(retry_after))
+    return delay
+
+
+async def _attempt(method, url, host, deadline, **kwargs):
+    """One request; returns (response, error) with the outcome recorded against the host.
+
+    A deadline that expires while the request is in flight counts as a
+    failure of the host; one that expires while waiting for a slot doesn't.
+    """
+    _admit(host)
+    in_flight = False
+    try:
+        async with _host_semaphore(url):
+            in_flight = True
+            response = await get_client().request(method, url, **kwargs)
+    except HTTPError as e:
+        _record_outcome(host)
+        return None, e
+    except BaseException:
+        if in_flight and deadline.expired():
+            _record_outcome(host)
+        else:
+            # Also frees a half-open probe slot when the deadline ran out in the queue
+            breaker.get(host).abandon()
+        raise
+    _record_outcome(host, response)
+    return response, None
+
+
+async def request(method, url, **kwargs):
+    """Send a request through the shared client without blocking the event loop.
+
+    Network errors, 418/429 and 5xx are retried up to RETRY_ATTEMPTS times
+    with jittered exponential backoff, as long as the host's retry budget
+    has tokens and its circuit stays closed (every upstream call here is a
+    read, POSTs included). The last failed response is returned, or the
+    last error raised. The whole call is bounded by DEADLINE seconds.
+    """
+    host = host_of(url)
+    try:
+        async with asyncio.timeout(DEADLINE) as deadline:
+            for attempt in range(RETRY_ATTEMPTS):
+                response, error = await _attempt(method, url, host, deadline, **kwargs)
+                if not _failed(response) or attempt == RETRY_ATTEMPTS - 1:
+                    break
+                delay = _retry_delay(attempt, response)
+                if delay is None or not breaker.get(host).retry():
+                    break
+                await asyncio.sleep(delay)
+    except TimeoutError:
+        # Already recorded by _attempt when it interrupted a request; time spent backing off is not the host's fault
+        raise httpx.TimeoutException(f"{method} {url} did not complete within {DEADLINE:g}s")
+    if error is not None:
+        raise error
+    return response
+
+
+async def get(url, **kwargs):
+    return await request("GET", url, **kwargs)
+
+
+async def post(url, **kwargs):
+    return await request("POST", url, **kwargs)
+
+
+@asynccontextmanager
+async def stream(method, url, **kwargs):
+    """Like request(), but hand back the response before its body is read (use aiter_bytes()).
+
+    Streams are not retried, since the caller may already have consumed part of the body.
+    """
+    host = host_of(url)
+    _admit(host)
+    async with _host_semaphore(url):
+        try:
+            async with get_client().stream(method, url, **kwargs) as response:
+                _record_outcome(host, response)
+                yield response
+        except HTTPError:
+            _record_outcome(host)
+            raise
+        except BaseException:
+            breaker.get(host).abandon()
+            raise
@@ -0,0 +1,150 @@
+"""Cross-source frames: every series of an instrument on one common time grid.
+
+Each source table is read with one query that returns its columns as arrays
+(array_agg), including the last row before the range so the first grid
+points have a value. Values are then carried forward onto the grid with an
+as-of join: np.searchsorted finds, for every grid point, the newest row at
+or before it, and rows older than the source's MAX_AGE count as missing
+rather than being carried forward indefinitely.
+
+Frames are cached per (instrument, step, start, end, keys). Ranges that
+ended more than SETTLED_AFTER before they were read don't change and stay
+cached until evicted; ranges reaching into the present expire after
+CACHE_TTL seconds.
+"""
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, UTC
+
+import numpy as np
+
+from core import snapshots
+from db.db_connection import acquire
+
+CACHE_MAX_ENTRIES = int(os.getenv("ALIGN_CACHE_MAX_ENTRIES", "64"))
+CACHE_TTL = float(os.getenv("ALIGN_CACHE_TTL_SECONDS", "30"))
+SETTLED_AFTER = 3600
+MAX_POINTS = int(os.getenv("ALIGN_MAX_POINTS", "200000"))
+
+
+@dataclass(frozen=True)
+class Source:
+    table: str
+    columns: tuple
+    # Seconds a row's values are carried forward; about twice the source's cadence
+    max_age: float
+    per_instrument: bool = True
+
+
+# Keyed like the backend's message keys (see core/snapshots.py)
+MAX_AGE = {
+    "price": 5 * 60,
+    "funding_data": 15 * 60,
+    "weighted_funding": 30 * 60,
+    "skew_data": 30 * 60,
+    "delta_surfaces": 3 * 3600,
+    "fear_greed": 2 * 86400,
+}
+SOURCES = {
+    "price": Source(snapshots.OHLCV_TABLE, snapshots.OHLCV_COLUMNS, MAX_AGE["price"]),
+    **{
+        key: Source(table, tuple(columns), MAX_AGE[key], key not in snapshots.GLOBAL_SERIES)
+        for key, (table, columns) in snapshots.LINE_SERIES.items()
+    },
+}
+
+
+@dataclass
+class Frame:
+    # Grid times in epoch seconds
+    times: np.ndarray
+    # "<key>.<column>" -> float64 values on the grid, NaN where the source had nothing recent enough
+    columns: dict
+
+
+def asof(times, values, grid, max_age):
+    """Rows of values (sorted by times) as of every grid point; NaN before the first row or past max_age."""
+    result = np.full((len(grid), values.shape[1]), np.nan)
+    if not len(times):
+        return result
+    index = np.searchsorted(times, grid, side="right") - 1
+    known = index >= 0
+    known[known] = grid[known] - times[index[known]] <= max_age
+    result[known] = values[index[known]]
+    return result
+
+
+def _query(source):
+    aggregates = ", ".join(
+        ["array_agg(EXTRACT(EPOCH FROM time)::float8 ORDER BY time)"]
+        + [f"array_agg({column}::float8 ORDER BY time)" for column in source.columns]
+    )
+    column_list = ", ".join(("time",) + source.columns)
+    instrument_filter = "instrument = $3 AND " if source.per_instrument else ""
+    # The newest row at or before the start, plus every row in the range
+    return (
+        f"SELECT {aggregates} FROM ("
+        f"(SELECT {column_list} FROM {source.table} WHERE {instrument_filter}time <= $1 ORDER BY time DESC LIMIT 1) "
+        f"UNION ALL "
+        f"(SELECT {column_list} FROM {source.table} WHERE {instrument_filter}time > $1 AND time <= $2)"
+        f") rows;"
+    )
+
+
+async def _fetch(conn, source, instrument, start, end):
+    args = (start, end, instrument) if source.per_instrument else (start, end)
+    row = await conn.fetchrow(_query(source), *args)
+    if row[0] is None:
+        return np.empty(0), np.empty((0, len(source.columns)))
+    times = np.array(row[0], dtype=np.float64)
+    values = np.column_stack([np.array(column, dtype=np.float64) for column in row[1:]])
+    return times, values
+
+
+async def build(instrument, start, end, step, keys=None):
+    """Align the given sources (all by default) for one instrument over [start, end] every step seconds."""
+    keys = tuple(keys or SOURCES)
+    start = int(start // step * step)
+    end = int(end // step * step)
+    # Checked before the grid is allocated: the range and step come straight from /aligned
+    points = (end - start) // step + 1
+    if points > MAX_POINTS:
+        raise ValueError(f"{points} grid points requested; at most {MAX_POINTS} per frame")
+    grid = np.arange(start, end + step, step, dtype=np.float64)
+
+    start_time = datetime.fromtimestamp(start, UTC)
+    end_time = datetime.fromtimestamp(end, UTC)
+    columns = {}
+    async with acquire() as conn:
+        for key in keys:
+            source = SOURCES[key]
+            times, values = await _fetch(conn, source, instrument, start_time, end_time)
+            aligned = asof(times, values, grid, source.max_age)
+            for i, column in enumerate(source.columns):
+                columns[f"{key}.{column}"] = aligned[:, i]
+    return Frame(grid, columns)
+
+
+_cache = OrderedDict()  # (instrument, step, start, end, keys) -> (read at, Frame), least recently used first
+
+
+async def frame(instrument, start, end, step, keys=None):
+    """build(), served from the cache when the same frame was built recently (or covers a settled range)."""
+    keys = tuple(sorted(keys or SOURCES))
+    key = (instrument, step, int(start // step * step), int(end // step * step), keys)
+    now = time.time()
+    cached = _cache.get(key)
+    if cached is not None:
+        read_at, result = cached
+        if key[3] <= read_at - SETTLED_AFTER or now - read_at < CACHE_TTL:
+            _cache.move_to_end(key)
+            return result
+
+    result = await build(instrument, start, end, step, keys)
+    _cache[key] = (now, result)
+    _cache.move_to_end(key)
+    while len(_cache) > CACHE_MAX_ENTRIES:
+        _cache.popitem(last=False)
+    return result
@@ -0,0 +1,107 @@
+"""As-of alignment cost: the vectorized join against a per-grid-point bisect loop.
+
+Run from scrapers/:
+
+    python -m core.alignment_benchmark [--days 30] [--step 60]
+
+Generates every alignment source at its own cadence (with gaps, shaped like
+the lists asyncpg decodes from array_agg), aligns them all onto one grid
+both ways, checks the frames match and reports the time of each. The
+database round trips are not included; that is one indexed range scan per
+table.
+"""
+import argparse
+import bisect
+import math
+import random
+import time
+
+import numpy as np
+
+from core import alignment
+
+START = 1_700_000_000
+# Seconds between rows of each source
+CADENCE = {
+    "price": 60,
+    "funding_data": 60,
+    "weighted_funding": 300,
+    "skew_data": 300,
+    "delta_surfaces": 3600,
+    "fear_greed": 86400,
+}
+GAP_SHARE = 0.01
+
+
+def _source_lists(key, days):
+    """Columnar lists as fetched: times, then one list per column (None for NULLs)."""
+    source = alignment.SOURCES[key]
+    times, t = [], START - CADENCE[key]
+    while t < START + days * 86400:
+        times.append(float(t))
+        t += CADENCE[key] * (random.randint(2, 12) if random.random() < GAP_SHARE else 1)
+    columns = [[None if random.random() < 0.001 else random.uniform(-1, 1) for _ in times] for _ in source.columns]
+    return [times, *columns]
+
+
+def _vectorized(fetched, grid):
+    frame = {}
+    for key, lists in fetched.items():
+        source = alignment.SOURCES[key]
+        times = np.array(lists[0], dtype=np.float64)
+        values = np.column_stack([np.array(column, dtype=np.float64) for column in lists[1:]])
+        aligned = alignment.asof(times, values, grid, source.max_age)
+        for i, column in enumerate(source.columns):
+            frame[f"{key}.{column}"] = aligned[:, i]
+    return frame
+
+
+def _loop(fetched, grid):
+    frame = {}
+    for key, lists in fetched.items():
+        source = alignment.SOURCES[key]
+        times = lists[0]
+        for i, column in enumerate(source.columns):
+            values = lists[1 + i]
+            out = []
+            for t in grid.tolist():
+                index = bisect.bisect_right(times, t) - 1
+                value = values[index] if index >= 0 and t - times[index] <= source.max_age else None
+                out.append(math.nan if value is None else value)
+            frame[f"{key}.{column}"] = out
+    return frame
+
+
+def _timed(func, *args, repeats=3):
+    best = math.inf
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - started)
+    return result, best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=float, default=30)
+    parser.add_argument("--step", type=int, default=60, help="Grid step in seconds")
+    args = parser.parse_args()
+    random.seed(0)
+
+    fetched = {key: _source_lists(key, args.days) for key in alignment.SOURCES}
+    grid = np.arange(START, START + args.days * 86400, args.step, dtype=np.float64)
+    rows = sum(len(lists[0]) for lists in fetched.values())
+    columns = sum(len(source.columns) for source in alignment.SOURCES.values())
+
+    expected, loop_ms = _timed(_loop, fetched, grid, repeats=1)
+    frame, vectorized_ms = _timed(_vectorized, fetched, grid)
+    for name, values in expected.items():
+        np.testing.assert_array_equal(frame[name], np.array(values))
+
+    print(f"{len(alignment.SOURCES)} sources, {rows} rows, {columns} columns onto {len(grid)} grid points")
+    print(f"{'bisect loop':<14}{loop_ms:>10.1f} ms")
+    print(f"{'vectorized':<14}{vectorized_ms:>10.1f} ms  ({loop_ms / vectorized_ms:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
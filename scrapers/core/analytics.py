@@ -0,0 +1,350 @@
+"""Derived metrics computed incrementally as rows are ingested.
+
+bulk_writer hands every committed batch to observe(). Each SERIES entry turns
+one column of a source table into derived values per instrument, with O(1)
+work per row: time-windowed mean/variance (Welford with removal), EMAs over
+irregular samples, and rolling min/max on monotonic deques. Results are
+buffered and written to the derived_metrics hypertable every FLUSH_SECONDS.
+On startup rebuild() replays each series' warm-up span from the database,
+so windows are full again after a restart without recomputing history.
+
+Rows have to arrive in time order per series: older rows (gap backfills)
+are ignored rather than rewinding the windows. Tables whose latest row is
+revised in place (Binance's open candle) are committed one row late, once
+a newer row shows the previous one is final.
+"""
+import asyncio
+import copy
+import logging
+import math
+import os
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta, UTC
+from operator import itemgetter
+
+from db import bulk_writer
+from db.db_connection import acquire
+
+ENABLED = os.getenv("ANALYTICS_ENABLED", "1") == "1"
+FLUSH_SECONDS = float(os.getenv("ANALYTICS_FLUSH_SECONDS", "5"))
+
+TABLE = "derived_metrics"
+COLUMNS = ("time", "instrument", "metric", "value")
+CONFLICT_COLUMNS = ("time", "instrument", "metric")
+
+HOUR = 3600
+DAY = 24 * HOUR
+YEAR = 365 * DAY
+# Sliding-window sums drift; recompute them exactly after this many updates per window length
+RESYNC_FACTOR = 4
+
+logger = logging.getLogger(__name__)
+
+
+class RollingStats:
+    """Count, mean and sample variance over the last `window` seconds."""
+
+    def __init__(self, window):
+        self.window = window
+        self.items = deque()
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self._updates = 0
+
+    def add(self, t, x):
+        self.items.append((t, x))
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+        cutoff = t - self.window
+        while self.items[0][0] <= cutoff:
+            self._remove(self.items.popleft()[1])
+
+        self._updates += 1
+        if self._updates >= RESYNC_FACTOR * max(self.n, 64):
+            self._resync()
+
+    def _remove(self, x):
+        self.n -= 1
+        if self.n == 0:
+            self.mean = self.m2 = 0.0
+            return
+        delta = x - self.mean
+        self.mean -= delta / self.n
+        self.m2 -= delta * (x - self.mean)
+
+    def _resync(self):
+        values = [x for _, x in self.items]
+        self.mean = math.fsum(values) / self.n
+        self.m2 = math.fsum((x - self.mean) ** 2 for x in values)
+        self._updates = 0
+
+    def variance(self):
+        return max(self.m2, 0.0) / (self.n - 1) if self.n > 1 else None
+
+
+class RollingExtreme:
+    """Maximum (or minimum) over the last `window` seconds."""
+
+    def __init__(self, window, lowest=False):
+        self.window = window
+        self.lowest = lowest
+        self.items = deque()  # (time, value), values monotonic from the front
+
+    def add(self, t, x):
+        items = self.items
+        if self.lowest:
+            while items and items[-1][1] >= x:
+                items.pop()
+        else:
+            while items and items[-1][1] <= x:
+                items.pop()
+        items.append((t, x))
+        cutoff = t - self.window
+        while items[0][0] <= cutoff:
+            items.popleft()
+        return items[0][1]
+
+
+class Value:
+    """The series value itself, after the series' scale."""
+
+    warmup = 0
+
+    def __init__(self, name):
+        self.name = name
+
+    def update(self, t, x):
+        return x
+
+
+class Ema:
+    """Exponential moving average for irregular samples; a sample's weight halves every `halflife` seconds."""
+
+    def __init__(self, name, halflife):
+        self.name = name
+        self.halflife = halflife
+        # Older samples weigh under 2**-5 of the average
+        self.warmup = 5 * halflife
+        self.value = None
+        self.time = None
+
+    def update(self, t, x):
+        if self.value is None:
+            self.value = x
+        else:
+            self.value += (1 - 2 ** (-(t - self.time) / self.halflife)) * (x - self.value)
+        self.time = t
+        return self.value
+
+
+class ZScore:
+    """How many standard deviations the latest value is from the window's mean."""
+
+    def __init__(self, name, window):
+        self.name = name
+        self.warmup = window
+        self.stats = RollingStats(window)
+
+    def update(self, t, x):
+        self.stats.add(t, x)
+        variance = self.stats.variance()
+        if not variance:
+            return None
+        return (x - self.stats.mean) / math.sqrt(variance)
+
+
+class RealizedVol:
+    """Annualized standard deviation of log returns over the window, for samples nominally `period` seconds apart.
+
+    Each return is scaled to one period by the time it actually spans, so a
+    return across a gap in the data counts as the several periods it covers
+    instead of inflating the volatility.
+    """
+
+    def __init__(self, name, window, period):
+        self.name = name
+        self.warmup = window
+        self.period = period
+        self.stats = RollingStats(window)
+        self.previous = None
+
+    def update(self, t, x):
+        if x <= 0:
+            return None
+        previous, self.previous = self.previous, (t, x)
+        if previous is None:
+            return None
+        previous_time, previous_value = previous
+        self.stats.add(t, math.log(x / previous_value) * math.sqrt(self.period / (t - previous_time)))
+        variance = self.stats.variance()
+        if variance is None:
+            return None
+        return math.sqrt(variance * YEAR / self.period)
+
+
+class Extreme:
+    """Highest (or lowest) value over the window."""
+
+    def __init__(self, name, window, lowest=False):
+        self.name = name
+        self.warmup = window
+        self.extreme = RollingExtreme(window, lowest)
+
+    def update(self, t, x):
+        return self.extreme.add(t, x)
+
+
+@dataclass(frozen=True)
+class Series:
+    source: str
+    table: str
+    column: str
+    # Templates; every instrument gets its own copy
+    metrics: tuple
+    scale: float = 1.0
+    # The source rewrites its latest row until it is final
+    revisable: bool = False
+
+    @property
+    def warmup(self):
+        return max(metric.warmup for metric in self.metrics)
+
+
+SERIES = (
+    # interest_8h is the 8-hour rate; three periods a day annualize it
+    Series("deribit", "deribit_funding_data", "interest_8h", (
+        Value("funding_apr"),
+        Ema("funding_apr_ema_8h", 8 * HOUR),
+    ), scale=3 * 365),
+    Series("laevitas_funding", "laevitas_weighted_funding", "weighted_funding", (
+        Ema("weighted_funding_ema_8h", 8 * HOUR),
+        ZScore("weighted_funding_zscore_7d", 7 * DAY),
+    )),
+    Series("laevitas", "laevitas_25delta_skew", "period_30", (
+        Ema("skew_30d_ema_1d", DAY),
+        ZScore("skew_30d_zscore_7d", 7 * DAY),
+    )),
+    Series("binance", "binance_ohlcv", "close", (
+        RealizedVol("realized_vol_1h", HOUR, 60),
+        RealizedVol("realized_vol_1d", DAY, 60),
+        Extreme("close_high_1d", DAY),
+        Extreme("close_low_1d", DAY, lowest=True),
+    ), revisable=True),
+)
+_BY_TABLE = {}
+for _series in SERIES:
+    _BY_TABLE.setdefault(_series.table, []).append(_series)
+
+
+class _State:
+    """One instrument's metrics for one series."""
+
+    def __init__(self, series, instrument):
+        self.series = series
+        self.instrument = instrument
+        self.metrics = copy.deepcopy(series.metrics)
+        self.last = None  # time of the last committed row
+        self.pending = None  # (time, value) of a row that may still be revised
+
+    def feed(self, when, x, out):
+        t = when.timestamp()
+        if self.last is not None and t <= self.last:
+            return
+        if not self.series.revisable:
+            self._commit(when, t, x, out)
+            return
+        if self.pending is not None:
+            if t < self.pending[1]:
+                return
+            if t > self.pending[1]:
+                self._commit(*self.pending, out)
+        self.pending = (when, t, x)
+
+    def _commit(self, when, t, x, out):
+        self.last = t
+        x *= self.series.scale
+        for metric in self.metrics:
+            value = metric.update(t, x)
+            if out is not None and value is not None and math.isfinite(value):
+                out.append((when, self.instrument, metric.name, value))
+
+
+_states = {}  # (table, column, instrument) -> _State
+_buffer = []  # derived records not written yet
+
+
+def _feed(series, columns, records, out):
+    try:
+        time_index = columns.index("time")
+        instrument_index = columns.index("instrument")
+        value_index = columns.index(series.column)
+    except ValueError:
+        return
+    for record in sorted(records, key=itemgetter(time_index)):
+        x = record[value_index]
+        if x is None:
+            continue
+        instrument = record[instrument_index]
+        key = (series.table, series.column, instrument)
+        state = _states.get(key)
+        if state is None:
+            state = _states[key] = _State(series, instrument)
+        state.feed(record[time_index], x, out)
+
+
+def observe(table, columns, records):
+    """bulk_writer listener: update the table's series with a newly committed batch."""
+    for series in _BY_TABLE.get(table, ()):
+        _feed(series, columns, records, _buffer)
+
+
+async def rebuild(instruments_for):
+    """Replay each series' warm-up span from the database without emitting anything."""
+    now = datetime.now(UTC)
+    async with acquire() as conn:
+        for series in SERIES:
+            instruments = instruments_for(series.source)
+            if not instruments:
+                continue
+            rows = await conn.fetch(
+                f"SELECT time, instrument, {series.column} FROM {series.table} "
+                f"WHERE instrument = ANY($1) AND time > $2 ORDER BY time;",
+                instruments, now - timedelta(seconds=series.warmup),
+            )
+            columns = ("time", "instrument", series.column)
+            _feed(series, columns, [tuple(row) for row in rows], None)
+            logger.info(f"Rebuilt {series.table}.{series.column} analytics from {len(rows)} rows")
+
+
+async def flush():
+    """Write the buffered derived values."""
+    global _buffer
+    if not _buffer:
+        return
+    records, _buffer = _buffer, []
+    try:
+        await bulk_writer.write_records(TABLE, COLUMNS, records,
+                                        conflict_columns=CONFLICT_COLUMNS, update_columns=("value",))
+    except Exception as e:
+        logger.error(f"Failed to store {len(records)} derived metrics: {e}")
+
+
+async def _flush_periodically():
+    while True:
+        await asyncio.sleep(FLUSH_SECONDS)
+        await flush()
+
+
+async def start(instruments_for):
+    """Warm the windows up, start listening to writes and return the flush task."""
+    try:
+        await rebuild(instruments_for)
+    except Exception as e:
+        logger.error(f"Failed to rebuild analytics state, starting with empty windows: {e}")
+    bulk_writer.add_listener(observe)
+    return asyncio.create_task(_flush_periodically())
@@ -0,0 +1,178 @@
+"""Incremental analytics against a batch NumPy recomputation over the same rows.
+
+Run from scrapers/:
+
+    python -m core.analytics_benchmark [--days 10]
+
+Feeds synthetic rows for every analytics series (irregular spacing, gaps,
+and for revisable tables every row written twice, provisional then final)
+through analytics.observe(), recomputes each metric from scratch with NumPy
+over the whole history, and checks both agree before reporting the
+incremental cost per row.
+"""
+import argparse
+import math
+import random
+import time
+from datetime import datetime, UTC
+
+import numpy as np
+
+from core import analytics
+
+INSTRUMENT = "btc"
+START = 1_700_000_000
+# Typical spacing of each source's rows
+PERIODS = {
+    "deribit_funding_data": 60,
+    "laevitas_weighted_funding": 300,
+    "laevitas_25delta_skew": 300,
+    "binance_ohlcv": 60,
+}
+GAP_SHARE = 0.02
+RTOL = 1e-6
+ATOL = 1e-9
+
+
+def _times(table, days):
+    """Row times in seconds: the table's period with occasional missing stretches."""
+    period = PERIODS[table]
+    times, t = [], START
+    while t < START + days * analytics.DAY:
+        times.append(t)
+        t += period * (random.randint(2, 30) if random.random() < GAP_SHARE else 1)
+    return np.array(times, dtype=np.float64)
+
+
+def _values(series, count):
+    if series.column == "close":
+        return 35000 * np.exp(np.cumsum(np.random.normal(0, 0.001, count)))
+    return np.cumsum(np.random.normal(0, 0.01, count))
+
+
+def _window_starts(times, window):
+    """Index of the first sample inside (t - window, t] for every t."""
+    return np.searchsorted(times, times - window, side="right")
+
+
+def _rolling_stats(times, values, window):
+    """Count, mean and sample variance over each trailing window, from centred prefix sums."""
+    centred = values - values.mean()
+    sums = np.concatenate(([0.0], np.cumsum(centred)))
+    squares = np.concatenate(([0.0], np.cumsum(centred ** 2)))
+    starts = _window_starts(times, window)
+    ends = np.arange(1, len(values) + 1)
+    counts = ends - starts
+    total = sums[ends] - sums[starts]
+    mean = total / counts
+    with np.errstate(invalid="ignore", divide="ignore"):
+        variance = (squares[ends] - squares[starts] - total * mean) / (counts - 1)
+    return counts, mean + values.mean(), variance
+
+
+def _batch(metric, times, values):
+    """(value per row, rows that have one) recomputed over the whole history."""
+    everything = np.ones(len(values), dtype=bool)
+    if isinstance(metric, analytics.Value):
+        return values, everything
+    if isinstance(metric, analytics.Ema):
+        # Closed form of the recursion: sample j weighs (1 - 2**(-dt_j/h)) * 2**(-(t - t_j)/h)
+        scaled = (times - times[0]) / metric.halflife
+        weights = np.empty(len(values))
+        weights[0] = 1.0
+        weights[1:] = 1 - 2 ** -np.diff(scaled)
+        cumulative = np.cumsum(weights * values * 2 ** scaled)
+        return cumulative * 2 ** -scaled, everything
+    if isinstance(metric, analytics.ZScore):
+        counts, mean, variance = _rolling_stats(times, values, metric.warmup)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            scores = (values - mean) / np.sqrt(variance)
+        return scores, (counts > 1) & (variance > 0)
+    if isinstance(metric, analytics.RealizedVol):
+        returns = np.log(values[1:] / values[:-1]) * np.sqrt(metric.period / np.diff(times))
+        counts, _, variance = _rolling_stats(times[1:], returns, metric.warmup)
+        vol = np.concatenate(([np.nan], np.sqrt(variance * analytics.YEAR / metric.period)))
+        return vol, np.concatenate(([False], counts > 1))
+    if isinstance(metric, analytics.Extreme):
+        starts = _window_starts(times, metric.warmup)
+        pick = np.min if metric.extreme.lowest else np.max
+        return np.array([pick(values[start:end + 1]) for end, start in enumerate(starts)]), everything
+    raise TypeError(f"No batch recomputation for {type(metric).__name__}")
+
+
+def _run(series, times, values):
+    """Feed the rows through the incremental path; returns {metric: {time: value}} and seconds spent."""
+    columns = ("time", "instrument", series.column)
+    whens = [datetime.fromtimestamp(t, UTC) for t in times.tolist()]
+    if series.revisable:
+        # A provisional version of each row first, then the final one
+        batches = [[(when, INSTRUMENT, value * 1.0001), (when, INSTRUMENT, value)]
+                   for when, value in zip(whens, values.tolist())]
+    else:
+        batches = [[(when, INSTRUMENT, value)] for when, value in zip(whens, values.tolist())]
+
+    analytics._states.clear()
+    analytics._buffer.clear()
+    started = time.perf_counter()
+    for batch in batches:
+        for record in batch:
+            analytics.observe(series.table, columns, [record])
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for when, _, name, value in analytics._buffer:
+        results.setdefault(name, {})[when.timestamp()] = value
+    analytics._buffer.clear()
+    return results, elapsed
+
+
+def compare(series, times, values):
+    """Check the incremental values of every metric in series against the batch recomputation.
+
+    Returns [(metric name, values checked, max relative error)] and the
+    seconds the incremental path took; raises AssertionError on a mismatch.
+    """
+    results, elapsed = _run(series, times, values)
+    # The last row of a revisable table is still provisional, so it has no derived values yet
+    committed = len(times) - 1 if series.revisable else len(times)
+    scaled = values * series.scale
+
+    report = []
+    for metric in series.metrics:
+        expected, defined = _batch(metric, times, scaled)
+        incremental = results.get(metric.name, {})
+        checked, worst = 0, 0.0
+        for i in range(committed):
+            t = times[i]
+            if not defined[i]:
+                assert t not in incremental, (metric.name, i)
+                continue
+            actual = incremental[t]
+            assert math.isclose(actual, expected[i], rel_tol=RTOL, abs_tol=ATOL), (
+                metric.name, i, actual, expected[i])
+            worst = max(worst, abs(actual - expected[i]) / max(abs(expected[i]), ATOL))
+            checked += 1
+        assert len(incremental) == checked, metric.name
+        report.append((metric.name, checked, worst))
+    return report, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=float, default=10, help="Days of synthetic history per series")
+    args = parser.parse_args()
+    random.seed(0)
+    np.random.seed(0)
+
+    print(f"{'metric':<30}{'rows':>9}{'checked':>9}{'max rel err':>14}{'us/row':>9}")
+    for series in analytics.SERIES:
+        times = _times(series.table, args.days)
+        values = _values(series, len(times))
+        report, elapsed = compare(series, times, values)
+        committed = len(times) - 1 if series.revisable else len(times)
+        per_row = elapsed / committed * 1e6 / len(series.metrics)
+        for name, checked, worst in report:
+            print(f"{name:<30}{len(times):>9}{checked:>9}{worst:>14.2e}{per_row:>9.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Instrument universe shared by every scraper.
+
+The registry is read from config/instruments.json (or INSTRUMENTS_CONFIG).
+Each instrument maps to one symbol per source, derived from the source's
+template unless overridden, and may restrict which sources it is scraped from:
+
+    "sol": {"sources": ["binance", "deribit"], "symbols": {"deribit": "SOL_USDC-PERPETUAL"}}
+
+INSTRUMENTS=btc,eth,sol limits (or extends) the universe without editing the file.
+"""
+import json
+import os
+from dataclasses import dataclass, field
+
+CONFIG_PATH = os.getenv(
+    "INSTRUMENTS_CONFIG",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "instruments.json"),
+)
+
+
+@dataclass
+class Instrument:
+    name: str
+    symbols: dict = field(default_factory=dict)
+    sources: frozenset = None  # None means every source
+
+    def scraped_from(self, source):
+        return self.sources is None or source in self.sources
+
+
+_templates = {}
+_instruments = {}
+
+
+def load(path=CONFIG_PATH):
+    """(Re)load the instrument registry."""
+    with open(path) as f:
+        config = json.load(f)
+
+    _templates.clear()
+    _templates.update(config.get("symbol_templates", {}))
+
+    entries = config.get("instruments", {})
+    names = os.getenv("INSTRUMENTS")
+    names = [name.strip().lower() for name in names.split(",") if name.strip()] if names else list(entries)
+
+    _instruments.clear()
+    for name in names:
+        entry = entries.get(name, {})
+        sources = entry.get("sources")
+        _instruments[name] = Instrument(
+            name=name,
+            symbols=entry.get("symbols", {}),
+            sources=frozenset(sources) if sources is not None else None,
+        )
+    return list(_instruments.values())
+
+
+def _ensure_loaded():
+    if not _instruments:
+        load()
+
+
+def instruments():
+    """Names of every configured instrument."""
+    _ensure_loaded()
+    return list(_instruments)
+
+
+def instruments_for(source):
+    """Names of the instruments scraped from a source."""
+    _ensure_loaded()
+    return [name for name, instrument in _instruments.items() if instrument.scraped_from(source)]
+
+
+def symbol(source, instrument):
+    """Upstream symbol for an instrument, e.g. symbol("binance", "btc") -> "BTCUSDT"."""
+    _ensure_loaded()
+    entry = _instruments.get(instrument)
+    if entry is not None and source in entry.symbols:
+        return entry.symbols[source]
+    template = _templates.get(source, "{base}")
+    return template.format(base=instrument.lower(), BASE=instrument.upper())
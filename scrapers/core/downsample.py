@@ -0,0 +1,89 @@
+"""Vectorised downsampling for the dashboard's initial payloads.
+
+Candles are re-bucketed to a coarser resolution; line series are thinned
+with Largest-Triangle-Three-Buckets (LTTB) to about one point per pixel.
+"""
+import warnings
+
+import numpy as np
+
+# Candle resolutions offered to the dashboard, in seconds
+RESOLUTIONS = (60, 300, 900, 1800, 3600, 4 * 3600, 86400)
+
+
+def choose_resolution(span_seconds, width, base=RESOLUTIONS[0]):
+    """Finest resolution (not finer than base) that fits span_seconds into width candles."""
+    for resolution in RESOLUTIONS:
+        if resolution >= base and span_seconds / resolution <= width:
+            return resolution
+    return RESOLUTIONS[-1]
+
+
+def bucket_ohlcv(times, open_, high, low, close, volume, resolution):
+    """Aggregate candles sorted by time into buckets of `resolution` seconds.
+
+    Returns (bucket_start, open, high, low, close, volume) arrays: open/close are
+    the first/last candle's, high/low the extremes and volume the sum. NaNs
+    (missing values) are ignored in high, low and volume.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    if times.size == 0:
+        empty = np.empty(0)
+        return empty, empty, empty, empty, empty, empty
+
+    buckets = np.floor(times / resolution) * resolution
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], times.size] - 1
+    return (
+        buckets[starts],
+        np.asarray(open_, dtype=np.float64)[starts],
+        np.fmax.reduceat(np.asarray(high, dtype=np.float64), starts),
+        np.fmin.reduceat(np.asarray(low, dtype=np.float64), starts),
+        np.asarray(close, dtype=np.float64)[ends],
+        np.add.reduceat(np.nan_to_num(np.asarray(volume, dtype=np.float64)), starts),
+    )
+
+
+def lttb_indices(x, y, threshold):
+    """Indices of the points LTTB keeps out of (x, y), first and last always included.
+
+    y may be 2-D (points x series) for charts that draw several series from
+    the same rows: every series is scaled to its own range and the triangle
+    areas are summed, so one set of rows preserves the shape of all of them.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if y.ndim == 1:
+        y = y[:, None]
+    n = x.size
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    with warnings.catch_warnings():
+        # All-NaN columns (series without data) are expected and contribute nothing
+        warnings.simplefilter("ignore", RuntimeWarning)
+        span = np.nanmax(y, axis=0) - np.nanmin(y, axis=0)
+        y = (y - np.nanmin(y, axis=0)) / np.where(span > 0, span, 1)
+
+        every = (n - 2) / (threshold - 2)
+        edges = (np.arange(threshold - 1) * every).astype(np.int64) + 1
+        edges[-1] = n - 1
+
+        selected = np.empty(threshold, dtype=np.int64)
+        selected[0] = 0
+        a = 0
+        for i in range(threshold - 2):
+            start, end = edges[i], edges[i + 1]
+            if i + 2 < edges.size:
+                next_x = x[end:edges[i + 2]].mean()
+                next_y = np.nanmean(y[end:edges[i + 2]], axis=0)
+            else:
+                next_x, next_y = x[n - 1], y[n - 1]
+            areas = np.abs(
+                (x[a] - next_x) * (y[start:end] - y[a])
+                - (x[a] - x[start:end])[:, None] * (next_y - y[a])
+            )
+            a = start + int(np.argmax(np.nansum(areas, axis=1)))
+            selected[i + 1] = a
+        selected[-1] = n - 1
+    return selected
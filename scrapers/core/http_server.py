@@ -0,0 +1,128 @@
+import logging
+import os
+import time
+from datetime import datetime, UTC
+
+from aiohttp import web
+
+from clients import breaker
+from core import alignment, config, metrics, snapshots
+
+HOST = os.getenv("SCRAPER_HTTP_HOST", "0.0.0.0")
+PORT = int(os.getenv("SCRAPER_HTTP_PORT", "9100"))
+# Bounds on the client-supplied chart width (points per series in a snapshot)
+MIN_WIDTH = 100
+MAX_WIDTH = 5000
+# Defaults for /aligned: the last day on a one-minute grid
+ALIGNED_RANGE_SECONDS = 86400
+ALIGNED_STEP_SECONDS = 60
+
+logger = logging.getLogger(__name__)
+
+
+async def handle_metrics(request):
+    body, content_type = metrics.render()
+    return web.Response(body=body, headers={"Content-Type": content_type})
+
+
+async def handle_plan(request):
+    # In process-pool mode the supervisor merges its workers' plans
+    planner = request.app.get("supervisor") or request.app.get("scheduler")
+    return web.json_response(planner.plan() if planner is not None else [])
+
+
+async def handle_health(request):
+    supervisor = request.app.get("supervisor")
+    report = supervisor.health() if supervisor is not None else {"healthy": True, "workers": []}
+    return web.json_response(report, status=200 if report["healthy"] else 503)
+
+
+async def handle_breakers(request):
+    # In process-pool mode the supervisor merges what its workers report
+    supervisor = request.app.get("supervisor")
+    return web.json_response(supervisor.breakers() if supervisor is not None else breaker.status())
+
+
+async def handle_snapshot(request):
+    instrument = request.query.get("instrument", "").lower()
+    if instrument not in config.instruments():
+        raise web.HTTPBadRequest(text=f"Unknown instrument: {instrument!r}")
+    try:
+        width = int(request.query.get("width", snapshots.DEFAULT_WIDTH))
+    except ValueError:
+        raise web.HTTPBadRequest(text="width must be an integer")
+    width = min(max(width, MIN_WIDTH), MAX_WIDTH)
+
+    with metrics.phase("snapshot", instrument, "build"):
+        snapshot = await snapshots.build(instrument, width)
+    return web.json_response(snapshot)
+
+
+def _epoch(value, name):
+    """Query parameter as epoch seconds; accepts a number or an ISO 8601 timestamp (UTC unless it has an offset)."""
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            raise web.HTTPBadRequest(text=f"{name} must be epoch seconds or an ISO 8601 timestamp")
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=UTC)
+        seconds = parsed.timestamp()
+    try:
+        datetime.fromtimestamp(seconds, UTC)
+    except (OverflowError, OSError, ValueError):
+        raise web.HTTPBadRequest(text=f"{name} is not a representable time")
+    return seconds
+
+
+async def handle_aligned(request):
+    instrument = request.query.get("instrument", "").lower()
+    if instrument not in config.instruments():
+        raise web.HTTPBadRequest(text=f"Unknown instrument: {instrument!r}")
+    end = _epoch(request.query["end"], "end") if "end" in request.query else time.time()
+    start = _epoch(request.query["start"], "start") if "start" in request.query else end - ALIGNED_RANGE_SECONDS
+    try:
+        step = int(request.query.get("step", ALIGNED_STEP_SECONDS))
+    except ValueError:
+        raise web.HTTPBadRequest(text="step must be an integer number of seconds")
+    keys = [key for key in request.query.get("series", "").split(",") if key] or None
+    unknown = set(keys or ()) - set(alignment.SOURCES)
+    if step <= 0 or start > end or unknown:
+        raise web.HTTPBadRequest(text=f"Need 0 < step, start <= end and series among {', '.join(alignment.SOURCES)}")
+
+    with metrics.phase("aligned", instrument, "build"):
+        try:
+            frame = await alignment.frame(instrument, start, end, step, keys)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+    return web.json_response({
+        "instrument": instrument,
+        "step": step,
+        "time": frame.times.tolist(),
+        # NaN isn't valid JSON; missing values are sent as null
+        "columns": {name: [None if v != v else v for v in values.tolist()] for name, values in frame.columns.items()},
+    })
+
+
+def create_app(adaptive=None, supervisor=None):
+    app = web.Application()
+    app["scheduler"] = adaptive
+    app["supervisor"] = supervisor
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/plan", handle_plan)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/breakers", handle_breakers)
+    app.router.add_get("/snapshot", handle_snapshot)
+    app.router.add_get("/aligned", handle_aligned)
+    return app
+
+
+async def start(adaptive=None, supervisor=None, host=HOST, port=PORT):
+    """Serve /metrics, /plan, /health, /breakers, /snapshot and /aligned from the scraper process; returns the runner to clean up."""
+    runner = web.AppRunner(create_app(adaptive, supervisor))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Scraper HTTP server listening on {host}:{port}")
+    return runner
@@ -0,0 +1,163 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# Set in process-pool mode (see core/workers.py); every process then writes its samples there
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Instrument-less sources (fear & greed) report an empty instrument label
+PHASE_SECONDS = Histogram(
+    "scraper_phase_seconds",
+    "Duration of each scraper phase (fetch, decode, parse, store).",
+    ["source", "instrument", "phase"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+BYTES_DOWNLOADED = Counter(
+    "scraper_bytes_downloaded",
+    "Decoded response bytes received from upstream APIs.",
+    ["source", "instrument"],
+)
+ROWS = Counter(
+    "scraper_rows",
+    "Rows handled by the scrapers, by outcome (parsed, accepted by the writer, skipped, filtered).",
+    ["source", "instrument", "outcome"],
+)
+ROWS_COMMITTED = Counter(
+    "scraper_rows_committed",
+    "Rows the database reported inserting or updating, per table; spooled rows count once drained.",
+    ["table"],
+)
+BYTES_SAVED = Counter(
+    "scraper_bytes_saved",
+    "Response bytes not downloaded (not_modified) or not parsed (unchanged) thanks to the response cache.",
+    ["source", "instrument", "reason"],
+)
+SPOOL_BACKLOG_ROWS = Gauge(
+    "scraper_spool_backlog_rows",
+    "Rows written to the local spool that the database has not committed yet.",
+    multiprocess_mode="livesum",
+)
+SPOOL_BACKLOG_BYTES = Gauge(
+    "scraper_spool_backlog_bytes",
+    "Spool bytes the database has not committed yet.",
+    multiprocess_mode="livesum",
+)
+CIRCUIT_STATE = Gauge(
+    "scraper_circuit_state",
+    "Upstream circuit breaker state per host (0 closed, 1 half-open, 2 open).",
+    ["host"],
+    # Across workers, the worst state any of them sees
+    multiprocess_mode="livemax",
+)
+RETRIES = Counter(
+    "scraper_http_retries",
+    "Upstream request retries, by outcome (retried, denied by the retry budget or an open circuit).",
+    ["host", "outcome"],
+)
+SHORT_CIRCUITED = Counter(
+    "scraper_http_short_circuited",
+    "Requests refused without being sent because the host's circuit was open.",
+    ["host"],
+)
+FIRST_INGEST_SECONDS = Gauge(
+    "scraper_time_to_first_ingest_seconds",
+    "Seconds from process startup to the first rows the database committed to each table.",
+    ["table"],
+    # A table fed by several workers has ingested once its slowest worker has
+    multiprocess_mode="livemax",
+)
+ERRORS = Counter(
+    "scraper_errors",
+    "Errors raised or handled by the scrapers, by phase.",
+    ["source", "instrument", "phase"],
+)
+
+_started = time.monotonic()
+_ingesting = set()  # tables rows have been committed to since startup
+
+logger = logging.getLogger(__name__)
+
+
+def mark_started():
+    """Reset the clock time-to-first-ingest is measured from (the start of the scraper's setup)."""
+    global _started
+    _started = time.monotonic()
+    _ingesting.clear()
+
+
+@contextmanager
+def phase(source, instrument, name):
+    """Time a phase; exceptions escaping it are counted as errors of that phase."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        record_error(source, instrument, name)
+        raise
+    finally:
+        PHASE_SECONDS.labels(source, instrument or "", name).observe(time.perf_counter() - started)
+
+
+def record_bytes(source, instrument, size):
+    BYTES_DOWNLOADED.labels(source, instrument or "").inc(size)
+
+
+def record_rows(source, instrument, parsed=0, accepted=0, skipped=0, filtered=0):
+    """Count a batch's rows; accepted ones are committed or, while the database is down, spooled."""
+    outcomes = (("parsed", parsed), ("accepted", accepted), ("skipped", skipped), ("filtered", filtered))
+    for outcome, count in outcomes:
+        if count:
+            ROWS.labels(source, instrument or "", outcome).inc(count)
+
+
+def record_committed(table, rows):
+    ROWS_COMMITTED.labels(table).inc(rows)
+    if rows and table not in _ingesting:
+        _ingesting.add(table)
+        elapsed = time.monotonic() - _started
+        FIRST_INGEST_SECONDS.labels(table).set(elapsed)
+        logger.info(f"First rows committed to {table} {elapsed:.1f}s after startup")
+
+
+def record_bytes_saved(source, instrument, reason, size):
+    BYTES_SAVED.labels(source, instrument or "", reason).inc(size)
+
+
+def record_spool_backlog(rows, size):
+    SPOOL_BACKLOG_ROWS.set(rows)
+    SPOOL_BACKLOG_BYTES.set(size)
+
+
+def record_circuit_state(host, state):
+    CIRCUIT_STATE.labels(host).set(("closed", "half_open", "open").index(state))
+
+
+def record_retry(host, outcome):
+    RETRIES.labels(host, outcome).inc()
+
+
+def record_short_circuit(host):
+    SHORT_CIRCUITED.labels(host).inc()
+
+
+def record_error(source, instrument, phase_name):
+    ERRORS.labels(source, instrument or "", phase_name).inc()
+
+
+def render():
+    """Current metrics in the Prometheus text exposition format; in process-pool mode, summed over every process."""
+    if MULTIPROC_DIR is None:
+        return generate_latest(), CONTENT_TYPE_LATEST
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=MULTIPROC_DIR)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def process_exited(pid):
+    """Drop a dead worker's live gauges from the aggregate (its counters keep counting)."""
+    if MULTIPROC_DIR is not None:
+        multiprocess.mark_process_dead(pid, MULTIPROC_DIR)
@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import os
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta, UTC
+
+from clients import breaker, http_client
+from core import metrics
+from db import watermarks
+
+JITTER_SECONDS = float(os.getenv("SCHEDULER_JITTER_SECONDS", "5"))
+MAX_BACKOFF = timedelta(seconds=float(os.getenv("SCHEDULER_MAX_BACKOFF_SECONDS", "1800")))
+# Bound on one call of a job's function (per instrument, or the whole batch)
+JOB_DEADLINE = timedelta(seconds=float(os.getenv("SCHEDULER_JOB_DEADLINE_SECONDS", "300")))
+# Per-source bound on instruments fetched at the same time
+SOURCE_CONCURRENCY = int(os.getenv("SOURCE_CONCURRENCY", "4"))
+# Jobs allowed to run their first (catch-up) run at the same time after a restart
+STARTUP_CONCURRENCY = int(os.getenv("SCHEDULER_STARTUP_CONCURRENCY", "2"))
+# First runs are spread over this many seconds in the order jobs were added
+STARTUP_STAGGER_SECONDS = float(os.getenv("SCHEDULER_STARTUP_STAGGER_SECONDS", "2"))
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SourceJob:
+    """One source's job over its instruments and what the scheduler knows about it."""
+
+    name: str
+    func: object
+    args: tuple
+    # Shortest delay between runs, used when new data is already due or overdue
+    poll_interval: timedelta
+    # Expected spacing of upstream data; with a table, the next run waits for watermark + cadence
+    cadence: timedelta = None
+    table: str = None
+    # None for sources without instruments; otherwise func is called per instrument (or once with all if batch)
+    instruments: tuple = None
+    batch: bool = False
+    semaphore: asyncio.Semaphore = None
+    host: str = None
+    deadline: timedelta = JOB_DEADLINE
+    next_run: datetime = None
+    reason: str = "initial"
+    runs: int = 0
+    errors_in_row: int = 0
+    last_error: str = None
+    last_duration: float = None
+
+
+class AdaptiveScheduler:
+    """Runs each job when its source can actually have new data.
+
+    Jobs are one-shot APScheduler date jobs that re-arm themselves after every
+    run. The next run is the later of watermark + cadence and now + poll
+    interval, pushed out exponentially while the job or its upstream host keeps
+    failing (honouring Retry-After), plus a random jitter so jobs don't fire
+    together. Each instrument of a job waits out a jitter of its own before it
+    is fetched, so the instruments of one source don't fire together either. A
+    job whose host's circuit breaker is open is not run at all until the
+    breaker lets a probe through, and every call of a job's function is cut off
+    after its deadline, so one degraded upstream can't hold a source's workers
+    or pile up skipped runs.
+
+    After a restart every job is due, and the first runs are the expensive
+    ones (a source that was down catches up on its whole default window), so
+    first runs are staggered and at most STARTUP_CONCURRENCY of them go at
+    once instead of all hitting the upstreams and the database together.
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.jobs = {}
+        self.startup = asyncio.Semaphore(STARTUP_CONCURRENCY)
+
+    def add(self, name, func, args=(), *, poll_interval, cadence=None, table=None, instruments=None,
+            batch=False, concurrency=SOURCE_CONCURRENCY, url=None, deadline=JOB_DEADLINE):
+        job = SourceJob(
+            name=name,
+            func=func,
+            args=tuple(args),
+            poll_interval=poll_interval,
+            cadence=cadence,
+            table=table,
+            instruments=tuple(instruments) if instruments is not None else None,
+            batch=batch,
+            semaphore=asyncio.Semaphore(concurrency),
+            host=http_client.host_of(url) if url else None,
+            deadline=deadline,
+        )
+        stagger = timedelta(seconds=STARTUP_STAGGER_SECONDS * len(self.jobs))
+        self.jobs[name] = job
+        self._arm(job, datetime.now(UTC) + stagger + self._jitter())
+        return job
+
+    @staticmethod
+    def _jitter():
+        return timedelta(seconds=random.uniform(0, JITTER_SECONDS))
+
+    def _arm(self, job, run_at):
+        job.next_run = run_at
+        self.scheduler.add_job(self._run, "date", run_date=run_at, args=[job], id=job.name,
+                               replace_existing=True, max_instances=1)
+
+    async def _run(self, job):
+        if job.host and http_client.circuit_open(job.host) is not None:
+            # Nothing to gain from calling a host that is refusing our requests anyway
+            self._arm(job, await self._next_run(job))
+            return
+        started = datetime.now(UTC)
+        try:
+            if job.runs:
+                await self._execute(job)
+            else:
+                async with self.startup:
+                    # Time spent queueing for a startup slot isn't part of the run
+                    started = datetime.now(UTC)
+                    await self._execute(job)
+            job.errors_in_row = 0
+        except Exception as e:
+            job.errors_in_row += 1
+            job.last_error = str(e)
+            metrics.record_error(job.name, None, "job")
+            logger.error(f"Job {job.name} failed: {e}")
+        finally:
+            job.runs += 1
+            job.last_duration = (datetime.now(UTC) - started).total_seconds()
+            self._arm(job, await self._next_run(job))
+
+    async def _execute(self, job):
+        if job.instruments is None:
+            await self._call(job, job.name, *job.args)
+        elif job.batch:
+            await self._call(job, job.name, list(job.instruments), *job.args)
+        else:
+            # Fan out through the source's bounded worker pool
+            results = await asyncio.gather(
+                *(self._execute_instrument(job, instrument) for instrument in job.instruments),
+                return_exceptions=True,
+            )
+            errors = [result for result in results if isinstance(result, Exception)]
+            if errors:
+                raise errors[0]
+
+    async def _execute_instrument(self, job, instrument):
+        if len(job.instruments) > 1:
+            # Spread the fan-out; the job's own jitter moves all of its instruments together
+            await asyncio.sleep(self._jitter().total_seconds())
+        async with job.semaphore:
+            await self._call(job, f"{job.name} {instrument}", instrument, *job.args)
+
+    @staticmethod
+    async def _call(job, label, *args):
+        """Call the job's function, cancelling it once the job's deadline has passed."""
+        seconds = job.deadline.total_seconds()
+        deadline = asyncio.timeout(seconds)
+        try:
+            async with deadline:
+                await job.func(*args)
+        except TimeoutError:
+            if deadline.expired():
+                raise TimeoutError(f"{label} did not finish within {seconds:g}s") from None
+            raise
+
+    async def _next_run(self, job):
+        now = datetime.now(UTC)
+        earliest = now + job.poll_interval
+        job.reason = "poll"
+
+        failures, retry_after = http_client.host_status(job.host) if job.host else (0, None)
+        failures = max(failures, job.errors_in_row)
+        if failures:
+            backoff = min(job.poll_interval * 2 ** failures, MAX_BACKOFF)
+            earliest = now + backoff
+            job.reason = f"backoff x{failures}"
+        if retry_after is not None:
+            retry_at = datetime.fromtimestamp(retry_after, UTC)
+            if retry_at > earliest:
+                earliest = retry_at
+                job.reason = "retry-after"
+        open_until = http_client.circuit_open(job.host) if job.host else None
+        if open_until is not None:
+            # Come back when the breaker lets its probe through
+            earliest = max(earliest, datetime.fromtimestamp(open_until, UTC))
+            job.reason = "circuit open"
+
+        if job.cadence is not None and job.table is not None and not failures:
+            try:
+                # The source is due as soon as any of its instruments can have new data
+                expected = min([
+                    await watermarks.latest_timestamp(job.table, instrument)
+                    for instrument in (job.instruments or (None,))
+                ]) + job.cadence
+                if expected > earliest:
+                    earliest = expected
+                    job.reason = "waiting for data"
+            except Exception as e:
+                logger.warning(f"Could not read watermark for {job.name}, polling instead: {e}")
+
+        return earliest + self._jitter()
+
+    def plan(self):
+        """Upcoming runs, soonest first."""
+        return [
+            {
+                "job": job.name,
+                "next_run": job.next_run.isoformat(),
+                "reason": job.reason,
+                "runs": job.runs,
+                "errors_in_row": job.errors_in_row,
+                "last_duration_s": job.last_duration,
+                "circuit": breaker.get(job.host).state if job.host else None,
+            }
+            for job in sorted(self.jobs.values(), key=lambda job: job.next_run)
+        ]
+
+    def log_plan(self):
+        for entry in self.plan():
+            logger.info(f"Next run of {entry['job']} at {entry['next_run']} ({entry['reason']})")
@@ -0,0 +1,99 @@
+"""Downsampled initial payload for a dashboard subscription.
+
+Same keys and row shapes as the backend's incremental messages, but candles
+are re-bucketed and line series thinned to the client's width, so the first
+message carries hundreds of rows per chart instead of ~10k.
+"""
+import math
+from datetime import datetime, UTC
+
+import numpy as np
+
+from core import downsample
+from db import watermarks
+from db.db_connection import acquire
+
+DEFAULT_WIDTH = 1000
+
+OHLCV_TABLE = "binance_ohlcv"
+OHLCV_COLUMNS = ("open", "high", "low", "close", "volume")
+
+# Backend message key -> (table, columns whose shape LTTB preserves)
+LINE_SERIES = {
+    "delta_surfaces": ("amberdata_delta_surfaces", [
+        f"delta_{side}_{delta}_{kind}"
+        for side in ("call", "put") for delta in ("05", "10", "15", "25", "35") for kind in ("ratio", "spread")
+    ]),
+    "funding_data": ("deribit_funding_data", ["index_price", "interest_8h"]),
+    "skew_data": ("laevitas_25delta_skew", [
+        f"period_{days}" for days in (1, 7, 14, 30, 60, 90, 180, 365)
+    ]),
+    "weighted_funding": ("laevitas_weighted_funding", ["price", "weighted_funding"]),
+    "fear_greed": ("fear_greed_index", ["value"]),
+}
+GLOBAL_SERIES = {"fear_greed"}  # not filtered by instrument
+
+
+def _iso(epoch):
+    return datetime.fromtimestamp(epoch, UTC).isoformat()
+
+
+def _clean(value):
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+
+async def _price(conn, instrument, width):
+    start = watermarks.default_start(OHLCV_TABLE)
+    rows = await conn.fetch(
+        f"SELECT EXTRACT(EPOCH FROM time)::float8, {', '.join(OHLCV_COLUMNS)} FROM {OHLCV_TABLE} "
+        f"WHERE instrument = $1 AND time > $2 ORDER BY time ASC;",
+        instrument, start,
+    )
+    now = datetime.now(UTC).timestamp()
+    resolution = downsample.choose_resolution(now - start.timestamp(), width)
+    if not rows:
+        return [], resolution, start.isoformat()
+
+    data = np.array(rows, dtype=np.float64)
+    times, open_, high, low, close, volume = downsample.bucket_ohlcv(*data.T, resolution)
+    # Like the backend's incremental query, never ship the candle that is still forming
+    complete = times + resolution <= now
+    candles = [
+        {"time": _iso(t), "instrument": instrument, "open": _clean(o), "high": _clean(h),
+         "low": _clean(l), "close": _clean(c), "volume": _clean(v)}
+        for t, o, h, l, c, v in zip(*(column[complete].tolist() for column in (times, open_, high, low, close, volume)))
+    ]
+    # The next incremental query starts at the first bucket not sent yet
+    next_start = _iso(times[complete][-1] + resolution) if candles else start.isoformat()
+    return candles, resolution, next_start
+
+
+async def _line(conn, table, columns, instrument, width):
+    start = watermarks.default_start(table)
+    if instrument is None:
+        rows = await conn.fetch(f"SELECT * FROM {table} WHERE time > $1 ORDER BY time ASC;", start)
+    else:
+        rows = await conn.fetch(f"SELECT * FROM {table} WHERE instrument = $1 AND time > $2 ORDER BY time ASC;",
+                                instrument, start)
+    if not rows:
+        return [], start.isoformat()
+
+    times = np.array([row["time"].timestamp() for row in rows])
+    values = np.array([[row[column] for column in columns] for row in rows], dtype=np.float64)
+    keep = downsample.lttb_indices(times, values, width)
+    selected = [dict(rows[i]) | {"time": rows[i]["time"].isoformat()} for i in keep]
+    # LTTB always keeps the last point, so increments continue from the newest stored row
+    return selected, selected[-1]["time"]
+
+
+async def build(instrument, width=DEFAULT_WIDTH):
+    """Initial payload for one instrument, plus where incremental updates should continue."""
+    snapshot = {"instrument": instrument, "last_timestamps": {}}
+    async with acquire() as conn:
+        price, resolution, snapshot["last_timestamps"]["price"] = await _price(conn, instrument, width)
+        snapshot["price"] = price
+        snapshot["resolution"] = resolution
+        for key, (table, columns) in LINE_SERIES.items():
+            series_instrument = None if key in GLOBAL_SERIES else instrument
+            snapshot[key], snapshot["last_timestamps"][key] = await _line(conn, table, columns, series_instrument, width)
+    return snapshot
@@ -0,0 +1,177 @@
+"""Process-pool mode: shard the scraper jobs across worker processes.
+
+With SCRAPER_WORKERS > 1 (default: the CPUs this process may run on) main.py
+becomes a supervisor. Worker i owns every (source, instrument) whose hash
+lands on i and runs the usual adaptive scheduler over them, with its own
+event loop, HTTP client and DB pool, so one slow parser only stalls its own
+shard. Workers report their plan over a pipe every HEALTH_SECONDS; the
+supervisor restarts any that exit, with backoff, and serves the aggregated
+status on /health, /plan and /breakers. Metrics are recorded in
+prometheus_client's multiprocess mode (see core/workers.py), so /metrics on
+SCRAPER_HTTP_PORT serves the sum over the supervisor and every worker. Each
+worker also serves its own HTTP endpoints on SCRAPER_HTTP_PORT + 1 + index.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+import zlib
+from dataclasses import dataclass
+
+from core import config, metrics, workers
+
+WORKERS = workers.COUNT
+HEALTH_SECONDS = float(os.getenv("SUPERVISOR_HEALTH_SECONDS", "10"))
+# A worker that hasn't reported for this many health intervals counts as unhealthy
+STALE_REPORTS = 3
+RESTART_MAX_BACKOFF = float(os.getenv("SUPERVISOR_RESTART_MAX_BACKOFF_SECONDS", "60"))
+STOP_TIMEOUT = float(os.getenv("SUPERVISOR_STOP_TIMEOUT_SECONDS", "20"))
+
+# Workers are started fresh rather than forked, so no event loop, pool or socket is inherited
+_context = multiprocessing.get_context("spawn")
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Shard:
+    """The slice of the job set one process runs; the default shard owns everything."""
+
+    index: int = 0
+    count: int = 1
+
+    def owns(self, *key):
+        # crc32 rather than hash(): it must agree across processes
+        return self.count == 1 or zlib.crc32(":".join(key).encode()) % self.count == self.index
+
+    def instruments(self, source):
+        """The source's instruments that belong to this shard."""
+        return [instrument for instrument in config.instruments_for(source) if self.owns(source, instrument)]
+
+
+@dataclass
+class Worker:
+    index: int
+    process: object = None
+    conn: object = None
+    pid: int = None
+    restarts: int = 0
+    # Exits since the worker last reported; drives the restart backoff
+    crashes: int = 0
+    restart_at: float = None
+    last_seen: float = None
+    plan: list = None
+    breakers: list = None
+
+
+class Supervisor:
+    """Keeps `count` worker processes running target(index, count, conn)."""
+
+    def __init__(self, target, count=WORKERS):
+        self.target = target
+        self.count = count
+        self.workers = [Worker(index) for index in range(count)]
+        self.stopping = False
+
+    def _spawn(self, worker):
+        receiver, sender = _context.Pipe(duplex=False)
+        process = _context.Process(target=self.target, args=(worker.index, self.count, sender),
+                                   name=f"scraper-worker-{worker.index}")
+        process.start()
+        sender.close()  # the child holds the only write end, so its exit shows up as EOF
+        worker.process, worker.conn, worker.pid = process, receiver, process.pid
+        worker.restart_at = None
+        logger.info(f"Started worker {worker.index} (pid {process.pid})", extra={"worker": worker.index})
+
+    def start(self):
+        for worker in self.workers:
+            self._spawn(worker)
+
+    def _drain(self, worker, now):
+        try:
+            while worker.conn.poll():
+                report = worker.conn.recv()
+                worker.plan = report["plan"]
+                worker.breakers = report.get("breakers")
+                worker.last_seen = now
+                worker.crashes = 0
+        except (EOFError, OSError):
+            pass
+
+    def check(self):
+        """Collect reports and restart workers that have exited."""
+        now = time.time()
+        for worker in self.workers:
+            self._drain(worker, now)
+            if self.stopping or worker.process.is_alive():
+                continue
+            if worker.restart_at is None:
+                worker.crashes += 1
+                delay = min(2 ** (worker.crashes - 1), RESTART_MAX_BACKOFF)
+                worker.restart_at = now + delay
+                metrics.record_error("supervisor", None, "worker_exit")
+                metrics.process_exited(worker.pid)
+                logger.error(f"Worker {worker.index} (pid {worker.pid}) exited with code "
+                             f"{worker.process.exitcode}; restarting in {delay:.0f}s",
+                             extra={"worker": worker.index, "exitcode": worker.process.exitcode})
+            elif now >= worker.restart_at:
+                worker.conn.close()
+                worker.restarts += 1
+                self._spawn(worker)
+
+    async def watch(self):
+        while not self.stopping:
+            self.check()
+            await asyncio.sleep(1)
+
+    async def stop(self):
+        """SIGTERM every worker, give them STOP_TIMEOUT to clean up, then kill the rest."""
+        self.stopping = True
+        running = [worker.process for worker in self.workers if worker.process.is_alive()]
+        for process in running:
+            process.terminate()
+        deadline = time.monotonic() + STOP_TIMEOUT
+        while any(process.is_alive() for process in running) and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        for process in running:
+            if process.is_alive():
+                logger.warning(f"Worker pid {process.pid} did not stop in time; killing it")
+                process.kill()
+            process.join()
+
+    def health(self):
+        """Aggregated worker status; healthy when every worker is up and reporting."""
+        now = time.time()
+        workers = []
+        for worker in self.workers:
+            alive = worker.process is not None and worker.process.is_alive()
+            fresh = worker.last_seen is not None and now - worker.last_seen <= STALE_REPORTS * HEALTH_SECONDS
+            failing = [entry["job"] for entry in worker.plan or () if entry["errors_in_row"]]
+            workers.append({
+                "worker": worker.index,
+                "pid": worker.pid,
+                "alive": alive,
+                "healthy": alive and fresh,
+                "restarts": worker.restarts,
+                "last_report_s": None if worker.last_seen is None else round(now - worker.last_seen, 1),
+                "jobs": len(worker.plan or ()),
+                "failing_jobs": failing,
+            })
+        return {"healthy": all(worker["healthy"] for worker in workers), "workers": workers}
+
+    def plan(self):
+        """Every worker's upcoming runs, soonest first."""
+        entries = [
+            {**entry, "worker": worker.index}
+            for worker in self.workers for entry in worker.plan or ()
+        ]
+        return sorted(entries, key=lambda entry: entry["next_run"])
+
+    def breakers(self):
+        """Every worker's circuit breakers; each worker keeps its own per host."""
+        entries = [
+            {**entry, "worker": worker.index}
+            for worker in self.workers for entry in worker.breakers or ()
+        ]
+        return sorted(entries, key=lambda entry: (entry["host"], entry["worker"]))
@@ -0,0 +1,190 @@
+"""Reference encoder/decoder for the dashboard's columnar binary wire format (CDW).
+
+A message is {"instrument": str, <series>: [row, ...], ...} where every row
+has a "time". backend/wire.js and frontend/src/wire.js implement the same
+layout; this module is the specification they are checked against.
+
+All integers are little-endian.
+
+    header   magic b"CDW" | u8 version | u8 codec (0 none, 1 deflate, 2 zstd)
+    body     (compressed as a whole when codec != 0)
+             u16 len + utf-8 instrument
+             u16 series count, then per series:
+                 u16 len + utf-8 series name
+                 u32 rows n, u16 columns k
+                 time: i64 first epoch-ms, then (n - 1) x i32 deltas (omitted when n == 0)
+                 per column: u16 len + utf-8 name, u8 type, data
+                     type 0 float64: n x f64, NaN for null
+                     type 1 string:  u16 dictionary size d, d x (u16 len + utf-8), n x u16 codes
+                                     (code 0xFFFF is null)
+"""
+import struct
+import zlib
+from datetime import datetime
+
+import numpy as np
+
+MAGIC = b"CDW"
+VERSION = 1
+
+CODEC_NONE = 0
+CODEC_DEFLATE = 1
+CODEC_ZSTD = 2
+
+TYPE_FLOAT64 = 0
+TYPE_STRING = 1
+
+NULL_CODE = 0xFFFF
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; deflate is always available
+    zstandard = None
+
+
+class WireError(ValueError):
+    pass
+
+
+def _epoch_ms(value):
+    if isinstance(value, datetime):
+        return round(value.timestamp() * 1000)
+    if isinstance(value, str):
+        return round(datetime.fromisoformat(value).timestamp() * 1000)
+    return int(value)
+
+
+def _string(value):
+    data = value.encode()
+    return struct.pack("<H", len(data)) + data
+
+
+def _column_type(values):
+    if all(value is None or (isinstance(value, (int, float)) and not isinstance(value, bool)) for value in values):
+        return TYPE_FLOAT64
+    return TYPE_STRING
+
+
+def _encode_series(name, rows):
+    columns = []
+    for row in rows:
+        for column in row:
+            if column != "time" and column not in columns:
+                columns.append(column)
+
+    parts = [_string(name), struct.pack("<IH", len(rows), len(columns))]
+    if rows:
+        times = np.fromiter((_epoch_ms(row["time"]) for row in rows), dtype=np.int64, count=len(rows))
+        deltas = np.diff(times)
+        if deltas.size and (deltas.min() < -2**31 or deltas.max() >= 2**31):
+            raise WireError(f"Time deltas in {name} do not fit in 32 bits")
+        parts.append(struct.pack("<q", times[0]))
+        parts.append(deltas.astype("<i4").tobytes())
+
+    for column in columns:
+        values = [row.get(column) for row in rows]
+        column_type = _column_type(values)
+        parts.append(_string(column) + struct.pack("<B", column_type))
+        if column_type == TYPE_FLOAT64:
+            parts.append(np.array([np.nan if v is None else v for v in values], dtype="<f8").tobytes())
+        else:
+            dictionary = {}
+            codes = np.array(
+                [NULL_CODE if v is None else dictionary.setdefault(str(v), len(dictionary)) for v in values],
+                dtype="<u2",
+            )
+            if len(dictionary) >= NULL_CODE:
+                raise WireError(f"Too many distinct values in {name}.{column}")
+            parts.append(struct.pack("<H", len(dictionary)))
+            parts.extend(_string(value) for value in dictionary)
+            parts.append(codes.tobytes())
+    return b"".join(parts)
+
+
+def encode(message, codec=CODEC_DEFLATE, level=6):
+    """Encode a dashboard message; list-valued keys are series, "instrument" goes in the header."""
+    series = {key: value for key, value in message.items() if isinstance(value, list)}
+    body = b"".join(
+        [_string(message.get("instrument") or ""), struct.pack("<H", len(series))]
+        + [_encode_series(name, rows) for name, rows in series.items()]
+    )
+    if codec == CODEC_DEFLATE:
+        body = zlib.compress(body, level)
+    elif codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise WireError("zstd codec requested but the zstandard package is not installed")
+        body = zstandard.ZstdCompressor(level=level).compress(body)
+    elif codec != CODEC_NONE:
+        raise WireError(f"Unknown codec {codec}")
+    return MAGIC + struct.pack("<BB", VERSION, codec) + body
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values if len(values) > 1 else values[0]
+
+    def string(self):
+        length = self.unpack("<H")
+        value = bytes(self.data[self.offset:self.offset + length]).decode()
+        self.offset += length
+        return value
+
+    def array(self, dtype, count):
+        values = np.frombuffer(self.data, dtype=dtype, count=count, offset=self.offset)
+        self.offset += values.nbytes
+        return values
+
+
+def decode(data):
+    """Decode a CDW message back into {"instrument": ..., series: [rows with epoch-ms "time"]}."""
+    if bytes(data[:3]) != MAGIC:
+        raise WireError("Not a CDW message")
+    version, codec = struct.unpack_from("<BB", data, 3)
+    if version != VERSION:
+        raise WireError(f"Unsupported CDW version {version}")
+    body = bytes(data[5:])
+    if codec == CODEC_DEFLATE:
+        body = zlib.decompress(body)
+    elif codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise WireError("zstd payload but the zstandard package is not installed")
+        body = zstandard.ZstdDecompressor().decompress(body)
+    elif codec != CODEC_NONE:
+        raise WireError(f"Unknown codec {codec}")
+
+    reader = _Reader(body)
+    message = {"instrument": reader.string()}
+    for _ in range(reader.unpack("<H")):
+        name = reader.string()
+        count, column_count = reader.unpack("<IH")
+        times = np.empty(0, dtype=np.int64)
+        if count:
+            first = reader.unpack("<q")
+            deltas = reader.array("<i4", count - 1)
+            times = first + np.concatenate(([0], np.cumsum(deltas, dtype=np.int64)))
+
+        columns = {}
+        for _ in range(column_count):
+            column = reader.string()
+            column_type = reader.unpack("<B")
+            if column_type == TYPE_FLOAT64:
+                values = reader.array("<f8", count)
+                columns[column] = [None if np.isnan(v) else v for v in values.tolist()]
+            elif column_type == TYPE_STRING:
+                dictionary = [reader.string() for _ in range(reader.unpack("<H"))]
+                codes = reader.array("<u2", count)
+                columns[column] = [None if code == NULL_CODE else dictionary[code] for code in codes.tolist()]
+            else:
+                raise WireError(f"Unknown column type {column_type}")
+
+        message[name] = [
+            {"time": time, **{column: values[i] for column, values in columns.items()}}
+            for i, time in enumerate(times.tolist())
+        ]
+    return message
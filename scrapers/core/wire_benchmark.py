@@ -0,0 +1,101 @@
+"""Payload size and encode/decode time of the CDW wire format against JSON.
+
+Run from scrapers/:
+
+    python -m core.wire_benchmark
+
+Uses synthetic series shaped like a 7-day subscription (1m candles, hourly
+delta surfaces, 5m skew, 100 days of fear & greed). Every codec is checked
+to round-trip before it is timed.
+"""
+import json
+import math
+import random
+import time
+from datetime import datetime, timedelta, UTC
+
+from core import wire
+
+REPEATS = 5
+DELTA_COLUMNS = [
+    f"delta_{side}_{delta}_{kind}"
+    for side in ("call", "put") for delta in ("05", "10", "15", "25", "35") for kind in ("ratio", "spread")
+]
+SKEW_COLUMNS = [f"period_{days}" for days in (1, 7, 14, 30, 60, 90, 180, 365)]
+
+
+def _rows(count, step, columns, instrument="btc"):
+    start = datetime.now(UTC).replace(second=0, microsecond=0) - count * step
+    rows = []
+    level = {column: random.uniform(-1, 1) for column in columns}
+    for i in range(count):
+        row = {"time": (start + i * step).isoformat()}
+        if instrument:
+            row["instrument"] = instrument
+        for column in columns:
+            level[column] += random.gauss(0, 0.01)
+            row[column] = level[column]
+        rows.append(row)
+    return rows
+
+
+def sample_message():
+    price = _rows(7 * 1440, timedelta(minutes=1), ["open", "high", "low", "close", "volume"])
+    fear_greed = _rows(100, timedelta(days=1), [], instrument=None)
+    for row in fear_greed:
+        row["value"] = random.randint(0, 100)
+        row["classification"] = random.choice(["Fear", "Neutral", "Greed"])
+    return {
+        "instrument": "btc",
+        "price": price,
+        "delta_surfaces": _rows(7 * 24, timedelta(hours=1), ["days_to_expiration"] + DELTA_COLUMNS),
+        "skew_data": _rows(7 * 288, timedelta(minutes=5), SKEW_COLUMNS),
+        "funding_data": _rows(7 * 1440, timedelta(minutes=1), ["index_price", "interest_8h"]),
+        "fear_greed": fear_greed,
+    }
+
+
+def _same(original, decoded):
+    for key, rows in original.items():
+        if key == "instrument":
+            assert decoded[key] == rows
+            continue
+        assert len(decoded[key]) == len(rows), key
+        for expected, actual in zip(rows, decoded[key]):
+            assert actual["time"] == wire._epoch_ms(expected["time"]), key
+            for column, value in expected.items():
+                if column != "time":
+                    assert value == actual[column] or math.isclose(value, actual[column]), (key, column)
+
+
+def _timed(func, *args):
+    best = math.inf
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - started)
+    return result, best * 1000
+
+
+def main():
+    random.seed(0)
+    message = sample_message()
+
+    encoded, json_ms = _timed(lambda m: json.dumps(m).encode(), message)
+    print(f"{'format':<16}{'bytes':>12}{'vs JSON':>10}{'encode ms':>12}{'decode ms':>12}")
+    _, json_decode_ms = _timed(json.loads, encoded)
+    print(f"{'json':<16}{len(encoded):>12}{1:>9.1f}x{json_ms:>12.1f}{json_decode_ms:>12.1f}")
+
+    codecs = [("cdw", wire.CODEC_NONE), ("cdw+deflate", wire.CODEC_DEFLATE)]
+    if wire.zstandard is not None:
+        codecs.append(("cdw+zstd", wire.CODEC_ZSTD))
+    for name, codec in codecs:
+        payload, encode_ms = _timed(wire.encode, message, codec)
+        decoded, decode_ms = _timed(wire.decode, payload)
+        _same(message, decoded)
+        ratio = len(encoded) / len(payload)
+        print(f"{name:<16}{len(payload):>12}{ratio:>9.1f}x{encode_ms:>12.1f}{decode_ms:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""How many scraper processes run, settled before prometheus_client is imported.
+
+With more than one (process-pool mode, see core/supervisor.py) every
+process records its metrics into files under PROMETHEUS_MULTIPROC_DIR,
+prometheus_client's multiprocess mode, and /metrics serves their sum, so
+the supervisor's port still shows every worker's ingest metrics.
+prometheus_client chooses the mode when it is imported, which is why
+main.py imports this module before anything else from core. Unless
+PROMETHEUS_MULTIPROC_DIR names an (empty) directory already, the
+supervisor makes a temporary one and removes it on exit. Likewise, each
+process has its own DB pool, so the default DB_POOL_MAX_SIZE is divided
+between the workers; an explicit DB_POOL_MAX_SIZE applies to every
+process, i.e. up to SCRAPER_WORKERS + 1 times that many connections.
+"""
+import os
+import tempfile
+
+
+def _cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on every platform
+        return os.cpu_count() or 1
+
+
+COUNT = int(os.getenv("SCRAPER_WORKERS", str(_cpu_count())))
+
+# Every process opens its own DB pool of up to DB_POOL_MAX_SIZE connections, so unless that is set
+# explicitly, split the single-process default across the workers (the supervisor's pool is used little)
+DB_CONNECTIONS = 10
+if COUNT > 1 and not os.getenv("DB_POOL_MAX_SIZE"):
+    os.environ["DB_POOL_MAX_SIZE"] = str(max(2, DB_CONNECTIONS // COUNT))
+
+# Set only in the process that created it; workers inherit the environment, so they all share one directory
+CREATED_METRICS_DIR = None
+if COUNT > 1 and not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    CREATED_METRICS_DIR = tempfile.mkdtemp(prefix="scraper-metrics-")
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = CREATED_METRICS_DIR
@@ -0,0 +1,376 @@
+"""Archive the ingest tables to partitioned Parquet (or Arrow IPC) files and load them back.
+
+Run from scrapers/:
+
+    python -m db.archive export /data/archive [--tables binance_ohlcv ...] [--format parquet|arrow] [--full]
+    python -m db.archive import /data/archive [--tables ...]
+
+Export streams each table through a server-side cursor in BATCH_ROWS batches
+ordered by time and writes one file per period and instrument:
+
+    <root>/<table>/date=<period start>/instrument=<name>/part.parquet
+
+Periods are a day, month or year depending on the table's volume (PERIODS).
+manifest.json at the root records every table's columns, primary key, format
+and partitions (rows, time range, size). Without --full, export resumes at
+the table's complete_through: periods that had ended when the last export
+ran are kept and only the newer ones are rewritten. Rows that arrive later
+for an already complete period (gap backfills) need a --full export.
+
+Import reads the partitions back in batches and upserts them with
+write_records, so large batches go through COPY and rows already present
+are left alone. The tables have to exist already (schema.sql, migrations).
+
+read() concatenates archived partitions for offline analysis; Arrow IPC
+files are memory-mapped without copying, Parquet files are memory-mapped and
+decoded.
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import os
+from datetime import date, datetime, timedelta, UTC
+from itertools import repeat
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from db import migrations
+from db.bulk_writer import write_records
+from db.db_connection import acquire, close_pool
+
+BATCH_ROWS = int(os.getenv("ARCHIVE_BATCH_ROWS", "50000"))
+MANIFEST = "manifest.json"
+FORMATS = {"parquet": "parquet", "arrow": "arrow"}  # format -> file extension
+TABLES = (*migrations.HYPERTABLES, "derived_metrics")
+# Partition period per table, sized so files hold tens of thousands of rows or more
+PERIODS = {
+    "binance_ohlcv": "day",
+    "derived_metrics": "day",
+    "deribit_funding_data": "month",
+    "binance_ohlcv_5m": "month",
+    "laevitas_25delta_skew": "month",
+    "laevitas_weighted_funding": "month",
+    "amberdata_delta_surfaces": "month",
+    "binance_ohlcv_1h": "year",
+    "fear_greed_index": "year",
+}
+ARROW_TYPES = {
+    "timestamp with time zone": pa.timestamp("us", tz="UTC"),
+    "text": pa.string(),
+    "double precision": pa.float64(),
+    "real": pa.float32(),
+    "integer": pa.int32(),
+    "bigint": pa.int64(),
+    "smallint": pa.int16(),
+    "boolean": pa.bool_(),
+}
+
+
+def period_start(timestamp, period):
+    if period == "day":
+        return timestamp.date()
+    if period == "month":
+        return date(timestamp.year, timestamp.month, 1)
+    return date(timestamp.year, 1, 1)
+
+
+def period_end(start, period):
+    if period == "day":
+        return date.fromordinal(start.toordinal() + 1)
+    if period == "month":
+        return date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return date(start.year + 1, 1, 1)
+
+
+def _as_datetime(day):
+    return datetime(day.year, day.month, day.day, tzinfo=UTC)
+
+
+def load_manifest(root):
+    path = os.path.join(root, MANIFEST)
+    if not os.path.exists(path):
+        return {"version": 1, "tables": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_manifest(root, manifest):
+    path = os.path.join(root, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+class _PartitionWriter:
+    """One partition file, written under a temporary name and renamed into place on close."""
+
+    def __init__(self, root, relative, schema, file_format):
+        self.path = os.path.join(root, relative)
+        self.relative = relative
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if file_format == "parquet":
+            self.sink = None
+            self.writer = pq.ParquetWriter(self.path + ".tmp", schema, compression="zstd")
+        else:
+            self.sink = pa.OSFile(self.path + ".tmp", "wb")
+            self.writer = pa.ipc.new_file(self.sink, schema)
+        self.rows = 0
+        self.min_time = None
+        self.max_time = None
+
+    def write(self, table):
+        self.writer.write_table(table)
+        self.rows += len(table)
+        times = table.column("time")
+        low, high = pc.min(times).as_py(), pc.max(times).as_py()
+        self.min_time = low if self.min_time is None else min(self.min_time, low)
+        self.max_time = high if self.max_time is None else max(self.max_time, high)
+
+    def _finish(self):
+        self.writer.close()
+        if self.sink is not None:
+            self.sink.close()
+
+    def abort(self):
+        self._finish()
+        os.unlink(self.path + ".tmp")
+
+    def close(self):
+        self._finish()
+        os.replace(self.path + ".tmp", self.path)
+        return {
+            "rows": self.rows,
+            "min_time": self.min_time.isoformat(),
+            "max_time": self.max_time.isoformat(),
+            "bytes": os.path.getsize(self.path),
+        }
+
+
+class Exporter:
+    """Splits time-ordered record batches into per-period, per-instrument partition files."""
+
+    def __init__(self, root, table, columns, types, period, file_format, partitions):
+        self.root = root
+        self.table = table
+        self.columns = tuple(columns)
+        self.schema = pa.schema([(column, ARROW_TYPES[type_]) for column, type_ in zip(columns, types)])
+        self.period = period
+        self.file_format = file_format
+        self.partitions = partitions  # relative path -> manifest entry, updated as files close
+        self.time_index = self.columns.index("time")
+        self.has_instrument = "instrument" in self.columns
+        self.writers = {}  # (period start, instrument) -> _PartitionWriter
+
+    def _relative(self, start, instrument):
+        parts = [self.table, f"date={start.isoformat()}"]
+        if instrument is not None:
+            parts.append(f"instrument={instrument}")
+        parts.append(f"part.{FORMATS[self.file_format]}")
+        return os.path.join(*parts)
+
+    def write(self, records):
+        if not records:
+            return
+        arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*records), self.schema)]
+        batch = pa.Table.from_arrays(arrays, schema=self.schema)
+        times = [record[self.time_index] for record in records]
+
+        offset = 0
+        while offset < len(records):
+            start = period_start(times[offset], self.period)
+            end = bisect.bisect_left(times, _as_datetime(period_end(start, self.period)), lo=offset)
+            self._close_before(start)
+            chunk = batch.slice(offset, end - offset)
+            if self.has_instrument:
+                for instrument in pc.unique(chunk.column("instrument")).to_pylist():
+                    self._writer(start, instrument).write(chunk.filter(pc.equal(chunk.column("instrument"), instrument)))
+            else:
+                self._writer(start, None).write(chunk)
+            offset = end
+
+    def _writer(self, start, instrument):
+        key = (start, instrument)
+        if key not in self.writers:
+            self.writers[key] = _PartitionWriter(self.root, self._relative(start, instrument), self.schema,
+                                                 self.file_format)
+        return self.writers[key]
+
+    def _close_before(self, start):
+        """Rows come in time order, so partitions of earlier periods are finished."""
+        for key in [key for key in self.writers if key[0] < start]:
+            self._close(key)
+
+    def _close(self, key):
+        writer = self.writers.pop(key)
+        self.partitions[writer.relative] = {
+            "period": key[0].isoformat(),
+            "instrument": key[1],
+            **writer.close(),
+        }
+
+    def close(self):
+        for key in list(self.writers):
+            self._close(key)
+
+    def abort(self):
+        """Drop unfinished partitions, leaving the previous files in place."""
+        for writer in self.writers.values():
+            writer.abort()
+        self.writers.clear()
+
+
+async def _describe(conn, table):
+    columns = await conn.fetch(
+        "SELECT column_name, data_type FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = $1 ORDER BY ordinal_position;",
+        table,
+    )
+    key = await conn.fetch(
+        "SELECT a.attname FROM pg_index i "
+        "JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+        "WHERE i.indrelid = $1::regclass AND i.indisprimary "
+        "ORDER BY array_position(i.indkey::int2[], a.attnum);",
+        table,
+    )
+    return [row["column_name"] for row in columns], [row["data_type"] for row in columns], [row["attname"] for row in key]
+
+
+async def export_table(conn, root, table, manifest, file_format="parquet", full=False):
+    """Export one table (or its periods from complete_through on); returns the rows written."""
+    started = datetime.now(UTC)
+    columns, types, key = await _describe(conn, table)
+    period = PERIODS.get(table, "month")
+    entry = manifest["tables"].get(table)
+    if entry is not None and not full and entry["format"] != file_format:
+        raise ValueError(f"{table} is archived as {entry['format']}; export it with --full to switch")
+    if entry is None or full:
+        entry = manifest["tables"][table] = {"partitions": {}}
+    since = entry.get("complete_through")
+    entry.update(columns=columns, types=types, key=key, period=period, format=file_format)
+
+    query = f"SELECT {', '.join(columns)} FROM {table}"
+    args = ()
+    if since is not None:
+        query += " WHERE time >= $1"
+        args = (datetime.fromisoformat(since),)
+    query += " ORDER BY time;"
+
+    exporter = Exporter(root, table, columns, types, period, file_format, entry["partitions"])
+    rows = 0
+    try:
+        async with conn.transaction():  # server-side cursors only live inside a transaction
+            cursor = await conn.cursor(query, *args)
+            while batch := await cursor.fetch(BATCH_ROWS):
+                exporter.write([tuple(record) for record in batch])
+                rows += len(batch)
+    except BaseException:
+        exporter.abort()
+        raise
+    exporter.close()
+    # Every period that ended before this export started is complete now
+    entry["complete_through"] = _as_datetime(period_start(started, period)).isoformat()
+    return rows
+
+
+def read_batches(path, file_format, batch_rows=BATCH_ROWS):
+    """Record batches of one partition file."""
+    if file_format == "parquet":
+        yield from pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=batch_rows)
+    else:
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i)
+
+
+def _pylist(column):
+    """Column values as Python objects; timestamps are built directly, which is far quicker than to_pylist()."""
+    if not pa.types.is_timestamp(column.type) or column.null_count:
+        return column.to_pylist()
+    micros = column.cast(pa.timestamp("us", tz=column.type.tz)).cast(pa.int64()).to_numpy()
+    seconds, remainder = divmod(micros, 1_000_000)
+    stamps = map(datetime.fromtimestamp, seconds.tolist(), repeat(UTC))
+    if not remainder.any():
+        return list(stamps)
+    return [stamp + timedelta(microseconds=extra) for stamp, extra in zip(stamps, remainder.tolist())]
+
+
+def to_records(batch):
+    """Record tuples of an Arrow batch, in column order."""
+    return list(zip(*map(_pylist, batch.columns)))
+
+
+async def import_table(root, table, manifest):
+    """Upsert every archived partition of table; returns the rows read."""
+    entry = manifest["tables"][table]
+    rows = 0
+    for relative in sorted(entry["partitions"]):
+        for batch in read_batches(os.path.join(root, relative), entry["format"]):
+            records = to_records(batch)
+            await write_records(table, entry["columns"], records, conflict_columns=entry["key"])
+            rows += len(records)
+    return rows
+
+
+def read(root, table, instruments=None, start=None, end=None):
+    """A table's archived rows in [start, end) as one Arrow table, for offline analysis."""
+    manifest = load_manifest(root)
+    entry = manifest["tables"][table]
+    tables = []
+    for relative, partition in sorted(entry["partitions"].items()):
+        if instruments is not None and partition["instrument"] not in instruments:
+            continue
+        if start is not None and datetime.fromisoformat(partition["max_time"]) < start:
+            continue
+        if end is not None and datetime.fromisoformat(partition["min_time"]) >= end:
+            continue
+        path = os.path.join(root, relative)
+        if entry["format"] == "parquet":
+            tables.append(pq.read_table(path, memory_map=True, partitioning=None))
+        else:
+            # Zero-copy: the table's buffers point into the mapped file
+            tables.append(pa.ipc.open_file(pa.memory_map(path)).read_all())
+    schema = pa.schema([(column, ARROW_TYPES[type_]) for column, type_ in zip(entry["columns"], entry["types"])])
+    result = pa.concat_tables(tables) if tables else schema.empty_table()
+    if start is not None:
+        result = result.filter(pc.greater_equal(result.column("time"), pa.scalar(start, schema.field("time").type)))
+    if end is not None:
+        result = result.filter(pc.less(result.column("time"), pa.scalar(end, schema.field("time").type)))
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=("export", "import"))
+    parser.add_argument("root", help="archive directory")
+    parser.add_argument("--tables", nargs="+", help=f"default: every table ({', '.join(TABLES)})")
+    parser.add_argument("--format", choices=tuple(FORMATS), default="parquet", help="file format for export")
+    parser.add_argument("--full", action="store_true", help="re-export everything instead of only new periods")
+    options = parser.parse_args()
+
+    os.makedirs(options.root, exist_ok=True)
+    manifest = load_manifest(options.root)
+    try:
+        if options.command == "export":
+            async with acquire() as conn:
+                for table in options.tables or TABLES:
+                    started = asyncio.get_running_loop().time()
+                    rows = await export_table(conn, options.root, table, manifest, options.format, options.full)
+                    _save_manifest(options.root, manifest)
+                    elapsed = asyncio.get_running_loop().time() - started
+                    print(f"Exported {rows} rows of {table} in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):.0f} rows/s)")
+        else:
+            for table in options.tables or manifest["tables"]:
+                started = asyncio.get_running_loop().time()
+                rows = await import_table(options.root, table, manifest)
+                elapsed = asyncio.get_running_loop().time() - started
+                print(f"Imported {rows} rows of {table} in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):.0f} rows/s)")
+    finally:
+        await close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+"""Archive round trip and throughput, without a database.
+
+Run from scrapers/:
+
+    python -m db.archive_benchmark [--rows 1000000] [--instruments 3]
+
+Feeds synthetic binance_ohlcv rows (1-minute candles for a few instruments,
+in the time order the export cursor returns them) through the exporter in
+BATCH_ROWS batches, in both formats. Reads everything back with read() and
+with the import path's batch reader and checks the rows survive unchanged,
+then reports rows/s for each stage and the bytes per row on disk.
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta, UTC
+
+from db import archive
+
+TABLE = "binance_ohlcv"
+COLUMNS = ("time", "instrument", "open", "high", "low", "close", "volume")
+TYPES = ("timestamp with time zone", "text") + ("double precision",) * 5
+START = datetime(2025, 1, 1, tzinfo=UTC)
+
+
+def _rows(count, instruments):
+    names = [f"inst{i}" for i in range(instruments)]
+    price = {name: 30000.0 for name in names}
+    rows = []
+    for i in range(count // instruments):
+        when = START + timedelta(minutes=i)
+        for name in names:
+            open_ = price[name]
+            close = price[name] = open_ * (1 + random.gauss(0, 0.001))
+            volume = None if random.random() < 0.001 else random.uniform(0, 50)
+            rows.append((when, name, open_, max(open_, close) * 1.0005, min(open_, close) * 0.9995, close, volume))
+    return rows
+
+
+def _export(root, rows, file_format):
+    partitions = {}
+    exporter = archive.Exporter(root, TABLE, COLUMNS, TYPES, archive.PERIODS[TABLE], file_format, partitions)
+    for offset in range(0, len(rows), archive.BATCH_ROWS):
+        exporter.write(rows[offset:offset + archive.BATCH_ROWS])
+    exporter.close()
+    manifest = {"version": 1, "tables": {TABLE: {
+        "columns": list(COLUMNS), "types": list(TYPES), "key": ["time", "instrument"],
+        "period": archive.PERIODS[TABLE], "format": file_format, "partitions": partitions,
+    }}}
+    archive._save_manifest(root, manifest)
+    return manifest
+
+
+def _import_records(root, manifest):
+    """The import path up to the write: partition batches back to record tuples."""
+    entry = manifest["tables"][TABLE]
+    records = []
+    for relative in sorted(entry["partitions"]):
+        for batch in archive.read_batches(os.path.join(root, relative), entry["format"]):
+            records.extend(archive.to_records(batch))
+    return records
+
+
+def _sorted(rows):
+    return sorted(rows, key=lambda row: (row[1], row[0]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--instruments", type=int, default=3)
+    args = parser.parse_args()
+    random.seed(0)
+    rows = _rows(args.rows, args.instruments)
+    expected = _sorted(rows)
+
+    print(f"{'format':<9}{'rows':>10}{'export r/s':>13}{'read r/s':>13}{'import r/s':>13}{'B/row':>8}{'files':>7}")
+    for file_format in archive.FORMATS:
+        root = tempfile.mkdtemp(prefix="archive-benchmark-")
+        try:
+            started = time.perf_counter()
+            manifest = _export(root, rows, file_format)
+            export_s = time.perf_counter() - started
+
+            started = time.perf_counter()
+            table = archive.read(root, TABLE)
+            read_s = time.perf_counter() - started
+
+            started = time.perf_counter()
+            records = _import_records(root, manifest)
+            import_s = time.perf_counter() - started
+
+            assert _sorted(records) == expected, f"{file_format}: import round trip differs"
+            assert _sorted(archive.to_records(table)) == expected, (
+                f"{file_format}: read round trip differs")
+
+            partitions = manifest["tables"][TABLE]["partitions"].values()
+            size = sum(partition["bytes"] for partition in partitions)
+            print(f"{file_format:<9}{len(rows):>10}{len(rows) / export_s:>13.0f}{len(rows) / read_s:>13.0f}"
+                  f"{len(rows) / import_s:>13.0f}{size / len(rows):>8.1f}{len(partitions):>7}")
+        finally:
+            shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
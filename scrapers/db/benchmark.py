@@ -0,0 +1,206 @@
+"""Query latency and disk footprint of the ingest schema, before and after the TimescaleDB migrations.
+
+Run from scrapers/ against a copy of production data:
+
+    python -m db.benchmark --instrument btc --migrate --compress
+
+Without --migrate it only measures the current state, which is useful for
+comparing two databases or two runs (--json writes the raw numbers).
+
+    python -m db.benchmark --bulk
+
+instead compares bulk_writer's two write paths (row-wise executemany and
+binary COPY into a staging table plus one merge) in rows per second, for a
+range of batch sizes. Every write is rolled back, so no rows are left behind.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import datetime, timedelta, UTC
+
+from db import bulk_writer, migrations
+from db.db_connection import acquire, close_pool
+from parsers import binance
+
+# The backend's per-tick queries (backend/websocket.js) plus the chart's longer-range reads
+QUERIES = {
+    "price_7d": ("SELECT * FROM binance_ohlcv WHERE instrument = $1 AND time > $2 ORDER BY time ASC", 7),
+    "price_latest": ("SELECT * FROM binance_ohlcv WHERE instrument = $1 AND time > $2 ORDER BY time ASC", 0.01),
+    "funding_7d": ("SELECT * FROM deribit_funding_data WHERE instrument = $1 AND time > $2 ORDER BY time ASC", 7),
+    "skew_7d": ("SELECT * FROM laevitas_25delta_skew WHERE instrument = $1 AND time > $2 ORDER BY time ASC", 7),
+    "weighted_funding_7d": (
+        "SELECT * FROM laevitas_weighted_funding WHERE instrument = $1 AND time > $2 ORDER BY time ASC", 7,
+    ),
+    "delta_surfaces_7d": (
+        "SELECT * FROM amberdata_delta_surfaces WHERE instrument = $1 AND time > $2 ORDER BY time ASC", 7,
+    ),
+    "price_1h_90d": (
+        "SELECT date_trunc('hour', time) AS time, MAX(high), MIN(low) FROM binance_ohlcv "
+        "WHERE instrument = $1 AND time > $2 GROUP BY 1 ORDER BY 1", 90,
+    ),
+}
+# Same 90-day hourly read served by the continuous aggregate once it exists
+ROLLUP_QUERY = (
+    "SELECT time, high, low FROM binance_ohlcv_rollup_1h WHERE instrument = $1 AND time > $2 ORDER BY time",
+    90,
+)
+
+# Batch sizes for --bulk, around bulk_writer.BULK_THRESHOLD; rows are synthetic 1m candles for an unused instrument
+BULK_SIZES = (50, 100, 500, 1000, 5000, 10000, 50000)
+BULK_INSTRUMENT = "benchmark"
+
+
+async def _time_query(conn, query, args, repeats):
+    await conn.fetch(query, *args)  # warm the plan and buffer cache
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        await conn.fetch(query, *args)
+        samples.append((time.perf_counter() - started) * 1000)
+    return {"median_ms": statistics.median(samples), "max_ms": max(samples)}
+
+
+async def _table_size(conn, table):
+    has_timescale = await conn.fetchval("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'timescaledb');")
+    if has_timescale and await conn.fetchval(
+        "SELECT EXISTS (SELECT 1 FROM timescaledb_information.hypertables WHERE hypertable_name = $1);", table
+    ):
+        return await conn.fetchval("SELECT hypertable_size($1::regclass);", table)
+    return await conn.fetchval("SELECT pg_total_relation_size($1::regclass);", table)
+
+
+async def measure(instrument, repeats):
+    """Latency of every benchmark query and the on-disk size of every table."""
+    now = datetime.now(UTC)
+    result = {"latency": {}, "size_bytes": {}}
+    async with acquire() as conn:
+        queries = dict(QUERIES)
+        has_rollup = await conn.fetchval("SELECT to_regclass('binance_ohlcv_rollup_1h') IS NOT NULL;")
+        if has_rollup:
+            queries["price_1h_90d_rollup"] = ROLLUP_QUERY
+        for name, (query, days) in queries.items():
+            args = (instrument, now - timedelta(days=days))
+            result["latency"][name] = await _time_query(conn, query, args, repeats)
+        for table in migrations.HYPERTABLES:
+            result["size_bytes"][table] = await _table_size(conn, table)
+    return result
+
+
+async def compress_now():
+    """Compress every chunk the compression policy would eventually compress."""
+    older_than = timedelta(days=migrations.COMPRESS_AFTER_DAYS)
+    async with acquire() as conn:
+        for table in migrations.HYPERTABLES:
+            await conn.execute(
+                "SELECT compress_chunk(c, if_not_compressed => true) FROM show_chunks($1::regclass, older_than => $2) c;",
+                table, older_than,
+            )
+
+
+def _candles(count):
+    start = datetime(2000, 1, 1, tzinfo=UTC)
+    return [(start + timedelta(minutes=minute), BULK_INSTRUMENT, 100.0, 101.0, 99.0, 100.5, 12.5)
+            for minute in range(count)]
+
+
+async def _time_write(conn, records, copy, repeats):
+    """Median seconds for one upsert of records into binance_ohlcv, as bulk_writer writes them (rolled back)."""
+    insert_query, staging, create_staging, merge_query = bulk_writer._build_queries(
+        binance.TABLE, binance.COLUMNS, ("time", "instrument"), binance.COLUMNS[2:]
+    )
+    # The staging table outlives transactions in a pooled session; create it up front so it isn't timed
+    await conn.execute(create_staging)
+    samples = []
+    for _ in range(repeats):
+        transaction = conn.transaction()
+        await transaction.start()
+        try:
+            started = time.perf_counter()
+            if copy:
+                await conn.execute(create_staging)
+                await conn.copy_records_to_table(staging, records=records, columns=binance.COLUMNS)
+                await conn.execute(merge_query)
+            else:
+                await conn.executemany(insert_query, records)
+            samples.append(time.perf_counter() - started)
+        finally:
+            await transaction.rollback()
+    return statistics.median(samples)
+
+
+async def measure_bulk(repeats):
+    """Rows per second of both write paths for every batch size in BULK_SIZES."""
+    result = {}
+    async with acquire() as conn:
+        for size in BULK_SIZES:
+            records = _candles(size)
+            result[size] = {
+                "executemany_rows_per_s": size / await _time_write(conn, records, False, repeats),
+                "copy_rows_per_s": size / await _time_write(conn, records, True, repeats),
+            }
+    return result
+
+
+def _report_bulk(result):
+    print(f"{'rows':>8}{'executemany/s':>16}{'copy/s':>12}{'speedup':>10}")
+    for size, rates in result.items():
+        executemany, copy = rates["executemany_rows_per_s"], rates["copy_rows_per_s"]
+        print(f"{size:>8}{executemany:>16,.0f}{copy:>12,.0f}{copy / executemany:>9.1f}x")
+    print(f"\nbulk_writer switches to COPY at BULK_INSERT_THRESHOLD={bulk_writer.BULK_THRESHOLD} rows")
+
+
+def _report(before, after):
+    print(f"{'query':<24}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    for name, stats in after["latency"].items():
+        baseline = before["latency"].get(name, before["latency"].get(name.removesuffix("_rollup")))
+        if baseline is None:
+            continue
+        speedup = baseline["median_ms"] / stats["median_ms"] if stats["median_ms"] else float("inf")
+        print(f"{name:<24}{baseline['median_ms']:>12.2f}{stats['median_ms']:>12.2f}{speedup:>9.1f}x")
+
+    print(f"\n{'table':<28}{'before MB':>12}{'after MB':>12}{'ratio':>8}")
+    for table, size in after["size_bytes"].items():
+        previous = before["size_bytes"][table]
+        ratio = previous / size if size else float("inf")
+        print(f"{table:<28}{previous / 2**20:>12.1f}{size / 2**20:>12.1f}{ratio:>7.1f}x")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--instrument", default="btc")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--migrate", action="store_true", help="apply pending migrations between the two runs")
+    parser.add_argument("--compress", action="store_true", help="compress eligible chunks now instead of waiting for the policy")
+    parser.add_argument("--bulk", action="store_true", help="compare COPY and executemany write throughput instead")
+    parser.add_argument("--json", help="write the raw measurements to this file")
+    options = parser.parse_args()
+
+    try:
+        if options.bulk:
+            # Fewer repeats than the read queries by default: the largest batches take seconds row by row
+            result = await measure_bulk(max(1, options.repeats // 4))
+            _report_bulk(result)
+            if options.json:
+                with open(options.json, "w") as f:
+                    json.dump({"bulk": result}, f, indent=2)
+            return
+        before = await measure(options.instrument, options.repeats)
+        after = before
+        if options.migrate:
+            print(f"Applied migrations: {await migrations.apply() or 'none pending'}")
+        if options.compress:
+            await compress_now()
+        if options.migrate or options.compress:
+            after = await measure(options.instrument, options.repeats)
+        _report(before, after)
+        if options.json:
+            with open(options.json, "w") as f:
+                json.dump({"before": before, "after": after}, f, indent=2)
+    finally:
+        await close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
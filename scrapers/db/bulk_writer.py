@@ -0,0 +1,214 @@
+import asyncio
+import json
+import logging
+import os
+from operator import itemgetter
+
+import asyncpg
+
+from core import metrics
+from db import spool, watermarks
+from db.db_connection import acquire
+
+# Batches at least this large go through binary COPY + a single merge statement
+BULK_THRESHOLD = int(os.getenv("BULK_INSERT_THRESHOLD", "500"))
+# Committed writes are announced here so the backend pushes deltas instead of polling
+NOTIFY_CHANNEL = os.getenv("NOTIFY_CHANNEL", "scraper_changes")
+NOTIFY_ENABLED = os.getenv("NOTIFY_ENABLED", "1") == "1"
+# Consecutive spooled batches for one table are merged into writes of about this many rows
+DRAIN_BATCH_ROWS = int(os.getenv("SPOOL_DRAIN_BATCH_ROWS", "50000"))
+DRAIN_MAX_BACKOFF = float(os.getenv("SPOOL_DRAIN_MAX_BACKOFF_SECONDS", "60"))
+# The server accepted the statement but not the rows; retrying the same batch can't help
+REJECTED = (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError)
+
+_queries = {}
+# Called as listener(table, columns, records) for every committed batch, e.g. by the analytics stage
+_listeners = []
+
+logger = logging.getLogger(__name__)
+
+
+def _conflict_clause(conflict_columns, update_columns):
+    """Build the ON CONFLICT clause shared by the row-wise and staged paths."""
+    target = ", ".join(conflict_columns)
+    if not update_columns:
+        return f"ON CONFLICT ({target}) DO NOTHING"
+    assignments = ", ".join(f"{column} = EXCLUDED.{column}" for column in update_columns)
+    return f"ON CONFLICT ({target}) DO UPDATE SET {assignments}"
+
+
+def _build_queries(table, columns, conflict_columns, update_columns):
+    """Return (insert, staging DDL, merge) statements, cached per target shape."""
+    key = (table, columns, conflict_columns, update_columns)
+    if key not in _queries:
+        column_list = ", ".join(columns)
+        placeholders = ", ".join(f"${i}" for i in range(1, len(columns) + 1))
+        conflict = _conflict_clause(conflict_columns, update_columns)
+        staging = f"_staging_{table}"
+        _queries[key] = (
+            f"INSERT INTO {table} ({column_list}) VALUES ({placeholders}) {conflict};",
+            staging,
+            # One staging table per session, emptied at the end of every transaction
+            f"CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS;",
+            # Staged records have unique keys (see _write), so DO UPDATE never touches a row twice
+            f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {staging} {conflict};",
+        )
+    return _queries[key]
+
+
+async def write_records(table, columns, records, conflict_columns=("time", "instrument"), update_columns=None):
+    """Upsert records into table, through the write-ahead spool when it is open."""
+    if not records:
+        return
+
+    columns = tuple(columns)
+    conflict_columns = tuple(conflict_columns)
+    update_columns = tuple(update_columns) if update_columns else None
+    latest = _latest_times(columns, records)
+
+    if spool.is_open():
+        # Listeners hear about these rows from the drainer, once the database has committed them
+        spool.append(spool.Target(table, columns, conflict_columns, update_columns), records, latest)
+        # The rows are safe on disk, so the next fetch starts after them even while the DB is down
+        for instrument, timestamp in latest.items():
+            watermarks.spooled(table, instrument, timestamp)
+        return
+
+    try:
+        committed = await _write(table, columns, records, conflict_columns, update_columns, latest)
+    except Exception:
+        for instrument in latest:
+            watermarks.invalidate(table, instrument)
+        raise
+
+    metrics.record_committed(table, committed)
+    for instrument, timestamp in latest.items():
+        watermarks.advance(table, instrument, timestamp)
+    _notify_listeners(table, columns, records)
+
+
+def add_listener(listener):
+    _listeners.append(listener)
+
+
+def _notify_listeners(table, columns, records):
+    for listener in _listeners:
+        try:
+            listener(table, columns, records)
+        except Exception as e:
+            logger.error(f"Write listener failed for {table}: {e}", exc_info=True)
+
+
+async def _write(table, columns, records, conflict_columns, update_columns, latest):
+    """One transaction: upsert the records (staged through binary COPY when large) and notify.
+
+    Returns how many rows were committed. The merge reports the rows it
+    inserted or updated. executemany reports nothing, so there every record
+    counts, including one that ON CONFLICT DO NOTHING skipped.
+    """
+    insert_query, staging, create_staging, merge_query = _build_queries(
+        table, columns, conflict_columns, update_columns
+    )
+    async with acquire() as conn:
+        async with conn.transaction():
+            if len(records) < BULK_THRESHOLD:
+                await conn.executemany(insert_query, records)
+                committed = len(records)
+            else:
+                # One row per key, the one executemany would have left, so the outcome doesn't depend on batch size
+                records = _one_per_key(columns, conflict_columns, records, last=bool(update_columns))
+                await conn.execute(create_staging)
+                await conn.copy_records_to_table(staging, records=records, columns=columns)
+                committed = _inserted_rows(await conn.execute(merge_query), len(records))
+            if NOTIFY_ENABLED:
+                # Queued inside the transaction, so listeners only hear about committed rows
+                await conn.executemany("SELECT pg_notify($1, $2);", [
+                    (NOTIFY_CHANNEL, _change_payload(table, instrument, timestamp))
+                    for instrument, timestamp in latest.items()
+                ])
+    return committed
+
+
+def _inserted_rows(status, staged):
+    """Rows an INSERT reported in its command status, "INSERT 0 <rows>"; every staged row if it didn't say."""
+    try:
+        return int(status.rsplit(" ", 1)[-1])
+    except (AttributeError, ValueError):
+        logger.warning(f"Unexpected command status {status!r} from a merge; counting all {staged} staged rows")
+        return staged
+
+
+async def drain_spool():
+    """Replay the spool into the database until cancelled, backing off while the database is unreachable."""
+    delay = 1
+    isolate = False  # after a rejected merge, retry its batches one at a time to find the bad one
+    while True:
+        batch = spool.peek(1 if isolate else DRAIN_BATCH_ROWS)
+        if batch is None:
+            await spool.wait()
+            continue
+
+        target = batch.target
+        records = batch.records
+        if batch.frames > 1 and target.update_columns:
+            # Keep the newest spooled version of each row so the merge can't regress an updated one
+            records = _one_per_key(target.columns, target.conflict_columns, records)
+        latest = _latest_times(target.columns, records)
+        try:
+            committed = await _write(target.table, target.columns, records, target.conflict_columns,
+                                     target.update_columns, latest)
+        except REJECTED as e:
+            if batch.frames > 1:
+                isolate = True
+                continue
+            metrics.record_error("spool", None, "rejected")
+            logger.error(f"Dropping {len(records)} spooled rows for {target.table} rejected by the database: {e}",
+                         extra={"source": "spool", "table": target.table})
+            # Their watermarks moved past them when they were spooled; send the next fetch back to the table
+            for instrument in latest:
+                watermarks.invalidate(target.table, instrument)
+        except Exception as e:
+            metrics.record_error("spool", None, "drain")
+            logger.error(f"Failed to drain {len(records)} spooled rows for {target.table}, retrying in {delay}s: {e}",
+                         extra={"source": "spool", "table": target.table})
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, DRAIN_MAX_BACKOFF)
+            continue
+        else:
+            metrics.record_committed(target.table, committed)
+            for instrument, timestamp in latest.items():
+                watermarks.advance(target.table, instrument, timestamp)
+            _notify_listeners(target.table, target.columns, records)
+        spool.commit(batch)
+        delay = 1
+        isolate = False
+
+
+def _one_per_key(columns, conflict_columns, records, last=True):
+    """Drop records with a repeated conflict key, keeping the last (or first) of each, in first-seen order."""
+    key = itemgetter(*(columns.index(column) for column in conflict_columns))
+    if last:
+        return list({key(record): record for record in records}.values())
+    unique = {}
+    for record in records:
+        unique.setdefault(key(record), record)
+    return list(unique.values())
+
+
+def _change_payload(table, instrument, timestamp):
+    return json.dumps({"table": table, "instrument": instrument, "time": timestamp.isoformat()})
+
+
+def _latest_times(columns, records):
+    """Newest time per instrument in a batch (keyed by None for tables without an instrument column)."""
+    time_index = columns.index("time")
+    if "instrument" not in columns:
+        return {None: max(record[time_index] for record in records)}
+
+    instrument_index = columns.index("instrument")
+    latest = {}
+    for record in records:
+        instrument, timestamp = record[instrument_index], record[time_index]
+        if instrument not in latest or timestamp > latest[instrument]:
+            latest[instrument] = timestamp
+    return latest
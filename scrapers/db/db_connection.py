@@ -1,9 +1,83 @@
-import asyncpg
+import asyncio
+import logging
 import os
+import time
+from contextlib import asynccontextmanager
+
+import asyncpg
 
 DB_URL = os.getenv("DATABASE_URL")
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+# Per process: in process-pool mode core/workers.py divides this default between the workers
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+MAX_INACTIVE_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", "300"))
+HEALTHCHECK_IDLE_SECONDS = float(os.getenv("DB_POOL_HEALTHCHECK_IDLE", "30"))
+HEALTHCHECK_TIMEOUT = float(os.getenv("DB_POOL_HEALTHCHECK_TIMEOUT", "5"))
+ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "10"))
+
+_pool = None
+_pool_lock = asyncio.Lock()
+_last_used = {}  # backend pid -> monotonic time the connection was last released
+
+logger = logging.getLogger(__name__)
+
+
+async def init_pool():
+    """Create the process-wide connection pool (no-op if it already exists)."""
+    global _pool
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await asyncpg.create_pool(
+                DB_URL,
+                min_size=POOL_MIN_SIZE,
+                max_size=POOL_MAX_SIZE,
+                statement_cache_size=STATEMENT_CACHE_SIZE,
+                max_inactive_connection_lifetime=MAX_INACTIVE_LIFETIME,
+            )
+            logger.info(f"Database pool ready (min={POOL_MIN_SIZE}, max={POOL_MAX_SIZE}).")
+    return _pool
+
+
+async def close_pool():
+    """Close the process-wide connection pool, waiting for borrowed connections."""
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            await _pool.close()
+            _pool = None
+            _last_used.clear()
+
+
+async def _is_healthy(conn):
+    """Ping connections that have been idle long enough to have been dropped server-side."""
+    if conn.is_closed():
+        return False
+    last_used = _last_used.get(conn.get_server_pid())
+    if last_used is not None and time.monotonic() - last_used < HEALTHCHECK_IDLE_SECONDS:
+        return True
+    try:
+        await conn.fetchval("SELECT 1;", timeout=HEALTHCHECK_TIMEOUT)
+        return True
+    except (asyncpg.PostgresError, OSError, asyncio.TimeoutError):
+        return False
+
+
+@asynccontextmanager
+async def acquire():
+    """Borrow a health-checked connection from the pool and return it afterwards."""
+    pool = _pool or await init_pool()
 
+    conn = await pool.acquire(timeout=ACQUIRE_TIMEOUT)
+    if not await _is_healthy(conn):
+        _last_used.pop(conn.get_server_pid(), None)
+        conn.terminate()
+        await pool.release(conn)
+        conn = await pool.acquire(timeout=ACQUIRE_TIMEOUT)
 
-async def get_db_connection():
-    """Establish a connection to the PostgreSQL/TimescaleDB database."""
-    return await asyncpg.connect(DB_URL)
+    try:
+        yield conn
+    finally:
+        if not conn.is_closed():
+            _last_used[conn.get_server_pid()] = time.monotonic()
+        await pool.release(conn)
@@ -0,0 +1,181 @@
+"""TimescaleDB migrations for the ingest schema.
+
+schema.sql creates plain tables; these migrations turn them into hypertables,
+enable native compression and define continuous aggregates on top. Applied
+migrations are recorded in schema_migrations, so apply() is safe to run on
+every start. Continuous aggregates cannot be created inside a transaction,
+so each statement runs on its own and every statement is idempotent.
+"""
+import logging
+import os
+
+from db.db_connection import acquire
+
+# Chunks older than this are compressed (recent chunks stay row-based for upserts)
+COMPRESS_AFTER_DAYS = int(os.getenv("TIMESCALE_COMPRESS_AFTER_DAYS", "7"))
+# Arbitrary key for pg_advisory_lock so concurrent starts don't race
+LOCK_KEY = 7436021
+
+# table -> (chunk interval, segmentby column); chunks sized to a few hundred MB at most
+HYPERTABLES = {
+    "binance_ohlcv": ("1 day", "instrument"),
+    "binance_ohlcv_5m": ("7 days", "instrument"),
+    "binance_ohlcv_1h": ("30 days", "instrument"),
+    "deribit_funding_data": ("7 days", "instrument"),
+    "laevitas_25delta_skew": ("7 days", "instrument"),
+    "laevitas_weighted_funding": ("7 days", "instrument"),
+    "amberdata_delta_surfaces": ("30 days", "instrument"),
+    "fear_greed_index": ("365 days", None),
+}
+
+# view -> (bucket, refresh start offset, refresh schedule)
+OHLCV_ROLLUPS = {
+    "binance_ohlcv_rollup_5m": ("5 minutes", "1 hour", "1 minute"),
+    "binance_ohlcv_rollup_1h": ("1 hour", "1 day", "5 minutes"),
+    "binance_ohlcv_rollup_1d": ("1 day", "7 days", "1 hour"),
+}
+
+logger = logging.getLogger(__name__)
+
+
+def _hypertable_statements():
+    statements = []
+    for table, (chunk_interval, _) in HYPERTABLES.items():
+        statements.append(
+            f"SELECT create_hypertable('{table}', 'time', chunk_time_interval => INTERVAL '{chunk_interval}', "
+            f"migrate_data => true, if_not_exists => true);"
+        )
+    return statements
+
+
+def _compression_statements():
+    statements = []
+    for table, (_, segment_by) in HYPERTABLES.items():
+        options = "timescaledb.compress, timescaledb.compress_orderby = 'time DESC'"
+        if segment_by:
+            options += f", timescaledb.compress_segmentby = '{segment_by}'"
+        statements.append(f"ALTER TABLE {table} SET ({options});")
+        statements.append(
+            f"SELECT add_compression_policy('{table}', INTERVAL '{COMPRESS_AFTER_DAYS} days', if_not_exists => true);"
+        )
+    return statements
+
+
+def _aggregate_statements():
+    statements = []
+    for view, (bucket, start_offset, schedule) in OHLCV_ROLLUPS.items():
+        statements += [
+            f"""
+            CREATE MATERIALIZED VIEW IF NOT EXISTS {view}
+            WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+            SELECT time_bucket(INTERVAL '{bucket}', time) AS time,
+                   instrument,
+                   first(open, time) AS open,
+                   MAX(high) AS high,
+                   MIN(low) AS low,
+                   last(close, time) AS close,
+                   SUM(volume) AS volume
+            FROM binance_ohlcv
+            GROUP BY 1, instrument
+            WITH NO DATA;
+            """,
+            f"SELECT add_continuous_aggregate_policy('{view}', start_offset => INTERVAL '{start_offset}', "
+            f"end_offset => INTERVAL '{bucket}', schedule_interval => INTERVAL '{schedule}', if_not_exists => true);",
+        ]
+
+    statements += [
+        """
+        CREATE MATERIALIZED VIEW IF NOT EXISTS deribit_funding_1h
+        WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+        SELECT time_bucket(INTERVAL '1 hour', time) AS time,
+               instrument,
+               AVG(interest_8h) AS interest_8h,
+               last(index_price, time) AS index_price
+        FROM deribit_funding_data
+        GROUP BY 1, instrument
+        WITH NO DATA;
+        """,
+        "SELECT add_continuous_aggregate_policy('deribit_funding_1h', start_offset => INTERVAL '1 day', "
+        "end_offset => INTERVAL '1 hour', schedule_interval => INTERVAL '15 minutes', if_not_exists => true);",
+        """
+        CREATE MATERIALIZED VIEW IF NOT EXISTS laevitas_weighted_funding_1h
+        WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+        SELECT time_bucket(INTERVAL '1 hour', time) AS time,
+               instrument,
+               AVG(weighted_funding) AS weighted_funding,
+               last(price, time) AS price
+        FROM laevitas_weighted_funding
+        GROUP BY 1, instrument
+        WITH NO DATA;
+        """,
+        "SELECT add_continuous_aggregate_policy('laevitas_weighted_funding_1h', start_offset => INTERVAL '1 day', "
+        "end_offset => INTERVAL '1 hour', schedule_interval => INTERVAL '15 minutes', if_not_exists => true);",
+    ]
+    return statements
+
+
+DERIVED_METRICS_STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS derived_metrics (
+        time TIMESTAMPTZ NOT NULL,
+        instrument TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        value DOUBLE PRECISION NOT NULL,
+        PRIMARY KEY (time, instrument, metric)
+    );
+    """,
+    "SELECT create_hypertable('derived_metrics', 'time', chunk_time_interval => INTERVAL '7 days', "
+    "migrate_data => true, if_not_exists => true);",
+    "ALTER TABLE derived_metrics SET (timescaledb.compress, timescaledb.compress_orderby = 'time DESC', "
+    "timescaledb.compress_segmentby = 'instrument, metric');",
+    f"SELECT add_compression_policy('derived_metrics', INTERVAL '{COMPRESS_AFTER_DAYS} days', if_not_exists => true);",
+]
+
+
+# Applied in order; never edit a migration once it has shipped, add a new one instead
+MIGRATIONS = [
+    ("001_timescaledb_extension", ["CREATE EXTENSION IF NOT EXISTS timescaledb;"]),
+    ("002_hypertables", _hypertable_statements()),
+    ("003_compression", _compression_statements()),
+    ("004_continuous_aggregates", _aggregate_statements()),
+    ("005_derived_metrics", DERIVED_METRICS_STATEMENTS),
+]
+
+
+async def timescale_available(conn):
+    """Whether the server can load the timescaledb extension at all."""
+    return await conn.fetchval("SELECT EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'timescaledb');")
+
+
+async def applied(conn):
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            name TEXT PRIMARY KEY,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+    return {row["name"] for row in await conn.fetch("SELECT name FROM schema_migrations;")}
+
+
+async def apply():
+    """Run every pending migration; returns the names of the ones applied."""
+    async with acquire() as conn:
+        if not await timescale_available(conn):
+            logger.warning("timescaledb extension is not available; keeping plain tables.")
+            return []
+
+        await conn.execute("SELECT pg_advisory_lock($1);", LOCK_KEY)
+        try:
+            done = await applied(conn)
+            newly_applied = []
+            for name, statements in MIGRATIONS:
+                if name in done:
+                    continue
+                logger.info(f"Applying migration {name} ({len(statements)} statements)")
+                for statement in statements:
+                    await conn.execute(statement)
+                await conn.execute("INSERT INTO schema_migrations (name) VALUES ($1) ON CONFLICT DO NOTHING;", name)
+                newly_applied.append(name)
+            return newly_applied
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1);", LOCK_KEY)
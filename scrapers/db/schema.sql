@@ -78,9 +78,24 @@ CREATE TABLE IF NOT EXISTS binance_ohlcv (
     PRIMARY KEY (time, instrument)
 );
 
+CREATE TABLE IF NOT EXISTS binance_ohlcv_5m (LIKE binance_ohlcv INCLUDING ALL);
+
+CREATE TABLE IF NOT EXISTS binance_ohlcv_1h (LIKE binance_ohlcv INCLUDING ALL);
+
 CREATE TABLE IF NOT EXISTS fear_greed_index (
     time TIMESTAMPTZ NOT NULL PRIMARY KEY,
     value INT NOT NULL,
     classification TEXT NOT NULL
 );
 
+-- Rolling metrics derived from the tables above at ingest time (core/analytics.py)
+CREATE TABLE IF NOT EXISTS derived_metrics (
+    time TIMESTAMPTZ NOT NULL,
+    instrument TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (time, instrument, metric)
+);
+
+-- Hypertables, compression and continuous aggregates are applied on top of these
+-- tables by db/migrations.py (run automatically when the scrapers start).
@@ -0,0 +1,316 @@
+"""Write-ahead spool: batches are kept on local disk until the database has them.
+
+write_records() appends each batch here and returns; bulk_writer.drain_spool()
+replays the spool into Postgres in order, merging consecutive batches for the
+same table into one write. A batch is marked drained only after its
+transaction committed, so a crash replays it (at-least-once); the ON CONFLICT
+keys make the replay idempotent.
+
+The spool is a directory of memory-mapped segment files. A segment starts
+with a 16-byte header (magic, offset of the first undrained frame) followed
+by frames:
+
+    <u32 payload length> <u32 crc32 of payload> <payload>
+
+where the payload is two pickles: the batch header (target table, columns,
+conflict/update columns, row count, newest time per instrument) and the
+records. The length is written after the payload, so a frame torn by a crash
+reads as the end of the segment. Segment files live in the page cache, so
+they survive the process dying; SPOOL_SYNC=1 also msyncs every append for
+host crashes.
+
+Each worker process spools into SPOOL_DIR/shard-<index>. The number of
+workers can change between runs, so before any worker starts,
+adopt_shards() moves the segments of shards that no longer exist into
+the ones that do.
+"""
+import asyncio
+import io
+import logging
+import mmap
+import os
+import pickle
+import re
+import struct
+import zlib
+from dataclasses import dataclass
+
+from core import metrics
+
+ENABLED = os.getenv("SPOOL_ENABLED", "1") == "1"
+DIRECTORY = os.getenv("SPOOL_DIR", "spool")
+SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", str(8 * 2**20)))
+# Appends are refused beyond this, leaving the watermark behind so the rows are fetched again later
+MAX_BYTES = int(os.getenv("SPOOL_MAX_BYTES", str(512 * 2**20)))
+SYNC = os.getenv("SPOOL_SYNC", "0") == "1"
+
+MAGIC = b"SPOOL1\0\0"
+_HEADER = struct.Struct("<8sQ")
+_FRAME = struct.Struct("<II")
+
+logger = logging.getLogger(__name__)
+
+
+class SpoolFull(Exception):
+    """Raised when an append would take the spool past MAX_BYTES."""
+
+
+@dataclass(frozen=True)
+class Target:
+    table: str
+    columns: tuple
+    conflict_columns: tuple
+    update_columns: tuple | None
+
+
+@dataclass
+class Batch:
+    """Consecutive spooled batches for one target, read by the drainer."""
+    target: Target
+    records: list
+    segment: object
+    end: int
+    frames: int
+    size: int
+
+
+class _Segment:
+    def __init__(self, path, size):
+        self.path = path
+        self.file = open(path, "r+b" if os.path.exists(path) else "w+b")
+        if os.fstat(self.file.fileno()).st_size < size:
+            self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.size = len(self.map)
+        magic, self.read = _HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            _HEADER.pack_into(self.map, 0, MAGIC, _HEADER.size)
+            self.read = _HEADER.size
+        self.write = self.read
+        # Appends continue after the last intact frame
+        while (frame := self.frame(self.write)) is not None:
+            self.write = frame[2]
+
+    def frame(self, offset):
+        """(header, stream positioned at the records, next offset, payload size), None at the end."""
+        if offset + _FRAME.size > self.size:
+            return None
+        length, checksum = _FRAME.unpack_from(self.map, offset)
+        start, end = offset + _FRAME.size, offset + _FRAME.size + length
+        if length == 0 or end > self.size:
+            return None
+        with memoryview(self.map)[start:end] as payload:
+            if zlib.crc32(payload) != checksum:
+                return None
+            stream = io.BytesIO(payload)
+        return pickle.load(stream), stream, end, length
+
+    def append(self, payload):
+        start = self.write + _FRAME.size
+        self.map[start:start + len(payload)] = payload
+        # The length goes in last: until then the frame reads as the end of the segment
+        _FRAME.pack_into(self.map, self.write, len(payload), zlib.crc32(payload))
+        self.write = start + len(payload)
+        if SYNC:
+            self.map.flush()
+
+    def fits(self, payload):
+        return self.write + _FRAME.size + len(payload) <= self.size
+
+    def mark_drained(self, offset):
+        self.read = offset
+        _HEADER.pack_into(self.map, 0, MAGIC, offset)
+
+    def close(self, delete=False):
+        self.map.close()
+        self.file.close()
+        if delete:
+            os.unlink(self.path)
+
+
+_segments = []  # oldest first; the last one takes appends
+_next_sequence = 0
+_pending = {"frames": 0, "rows": 0, "bytes": 0}
+_latest = {}  # (table, instrument) -> newest spooled time, for watermarks after a restart
+_appended = asyncio.Event()
+
+
+def is_open():
+    return bool(_segments)
+
+
+def shard_name(index):
+    return f"shard-{index}"
+
+
+def _sequences(directory):
+    return sorted(int(entry.removesuffix(".seg")) for entry in os.listdir(directory) if entry.endswith(".seg"))
+
+
+def adopt_shards(count):
+    """Move the segments of shard spools with an index >= count into shard index % count.
+
+    Must run before any of the `count` shards opens its spool. The adopted
+    segments go after the shard's own, so they are replayed by the worker
+    that opens it. Returns the names of the adopted spools.
+    """
+    if not ENABLED or not os.path.isdir(DIRECTORY):
+        return []
+    adopted = []
+    for entry in sorted(os.listdir(DIRECTORY)):
+        match = re.fullmatch(r"shard-(\d+)", entry)
+        if match is None or int(match[1]) < count:
+            continue
+        source = os.path.join(DIRECTORY, entry)
+        target = os.path.join(DIRECTORY, shard_name(int(match[1]) % count))
+        os.makedirs(target, exist_ok=True)
+        sequences = _sequences(target)
+        next_sequence = sequences[-1] + 1 if sequences else 0
+        for sequence in _sequences(source):
+            os.rename(os.path.join(source, f"{sequence:012d}.seg"), os.path.join(target, f"{next_sequence:012d}.seg"))
+            next_sequence += 1
+        os.rmdir(source)
+        adopted.append(entry)
+        logger.info(f"Moved the spool of {entry} into {os.path.basename(target)}; "
+                    f"SCRAPER_WORKERS is now {count}")
+    return adopted
+
+
+def open_spool(name):
+    """Open (or create) the spool directory SPOOL_DIR/name and load any undrained frames."""
+    global _next_sequence
+    if not ENABLED or _segments:
+        return
+    directory = os.path.join(DIRECTORY, name)
+    os.makedirs(directory, exist_ok=True)
+    paths = sorted(entry for entry in os.listdir(directory) if entry.endswith(".seg"))
+    for entry in paths:
+        path = os.path.join(directory, entry)
+        _next_sequence = int(entry.removesuffix(".seg")) + 1
+        if os.path.getsize(path) < _HEADER.size:  # created but never written
+            os.unlink(path)
+            continue
+        segment = _Segment(path, 0)
+        if segment.read == segment.write:
+            segment.close(delete=True)
+            continue
+        _segments.append(segment)
+        offset = segment.read
+        while (frame := segment.frame(offset)) is not None:
+            header, _, offset, size = frame
+            _track(header, size)
+    if _pending["frames"]:
+        logger.info(f"Spool {directory} holds {_pending['rows']} undrained rows "
+                    f"({_pending['bytes'] / 2**20:.1f} MB); replaying them")
+        _appended.set()
+    try:
+        _new_segment(directory, SEGMENT_BYTES)
+    except SpoolFull:
+        if not _segments:
+            raise
+        logger.warning(f"Spool {directory} is full; new batches are refused until it drains")
+
+
+def _new_segment(directory, size):
+    global _next_sequence
+    used = sum(segment.size for segment in _segments)
+    if used + size > MAX_BYTES:
+        raise SpoolFull(f"spool would exceed {MAX_BYTES} bytes ({_pending['rows']} rows undrained)")
+    segment = _Segment(os.path.join(directory, f"{_next_sequence:012d}.seg"), size)
+    _next_sequence += 1
+    _segments.append(segment)
+    return segment
+
+
+def _track(header, size):
+    """Count a newly spooled (or, at startup, found) frame in the backlog."""
+    target, rows, latest = header
+    _pending["frames"] += 1
+    _pending["rows"] += rows
+    _pending["bytes"] += size
+    for instrument, timestamp in latest.items():
+        key = (target.table, instrument)
+        if key not in _latest or timestamp > _latest[key]:
+            _latest[key] = timestamp
+    metrics.record_spool_backlog(_pending["rows"], _pending["bytes"])
+
+
+def append(target, records, latest):
+    """Spool one batch; latest is its newest time per instrument."""
+    header = (target, len(records), latest)
+    payload = pickle.dumps(header, pickle.HIGHEST_PROTOCOL) + pickle.dumps(records, pickle.HIGHEST_PROTOCOL)
+    active = _segments[-1]
+    if not active.fits(payload):
+        directory = os.path.dirname(active.path)
+        needed = _HEADER.size + _FRAME.size + len(payload)
+        active = _new_segment(directory, max(SEGMENT_BYTES, needed))
+        _retire(_segments[-2])
+    active.append(payload)
+    _track(header, len(payload))
+    _appended.set()
+
+
+def pending_latest():
+    """Newest spooled time per (table, instrument); the spool is ahead of the table there."""
+    return dict(_latest)
+
+
+def backlog():
+    return dict(_pending)
+
+
+async def wait():
+    """Block until something has been appended since the last call."""
+    await _appended.wait()
+    _appended.clear()
+
+
+def peek(max_rows):
+    """The oldest undrained frames that share a target, up to about max_rows rows."""
+    while _segments:
+        segment = _segments[0]
+        frame = segment.frame(segment.read)
+        if frame is not None:
+            break
+        if segment is _segments[-1]:
+            return None
+        _segments.pop(0)
+        segment.close(delete=True)
+    else:
+        return None
+
+    target, records, frames, size = frame[0][0], [], 0, 0
+    while frame is not None and frame[0][0] == target and (not records or len(records) + frame[0][1] <= max_rows):
+        _, stream, end, length = frame
+        records.extend(pickle.load(stream))
+        frames += 1
+        size += length
+        frame = segment.frame(end)
+    return Batch(target, records, segment, end, frames, size)
+
+
+def commit(batch):
+    """Mark a batch drained once the database has committed it."""
+    batch.segment.mark_drained(batch.end)
+    _pending["frames"] -= batch.frames
+    _pending["rows"] -= len(batch.records)
+    _pending["bytes"] -= batch.size
+    if not _pending["frames"]:
+        _latest.clear()
+    metrics.record_spool_backlog(_pending["rows"], _pending["bytes"])
+    if batch.segment is not _segments[-1]:
+        _retire(batch.segment)
+
+
+def _retire(segment):
+    """Delete a segment that takes no more appends once everything in it is drained."""
+    if segment.read == segment.write and segment is not _segments[-1]:
+        _segments.remove(segment)
+        segment.close(delete=True)
+
+
+def close_spool():
+    for segment in _segments:
+        segment.map.flush()
+        segment.close()
+    _segments.clear()
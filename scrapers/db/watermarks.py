@@ -0,0 +1,109 @@
+import logging
+from datetime import datetime, timedelta, UTC
+
+from db.db_connection import acquire
+from db.migrations import HYPERTABLES
+
+# How far back a source starts when it has no (recent) data stored
+DEFAULT_WINDOW = timedelta(days=7)
+WINDOWS = {
+    "fear_greed_index": timedelta(days=100),
+}
+
+# Every ingest table, split by whether it is keyed by (time, instrument) or by time only (fear_greed_index)
+INSTRUMENT_TABLES = tuple(table for table, (_, segment_by) in HYPERTABLES.items() if segment_by == "instrument")
+GLOBAL_TABLES = tuple(table for table, (_, segment_by) in HYPERTABLES.items() if segment_by is None)
+
+_watermarks = {}  # (table, instrument) -> latest stored time, None if the table has no rows for it
+_seeded_tables = set()
+_stale = set()
+
+logger = logging.getLogger(__name__)
+
+
+def default_start(table):
+    """Start of the default fetch window for a table."""
+    return datetime.now(UTC) - WINDOWS.get(table, DEFAULT_WINDOW)
+
+
+def _clamp(table, latest_timestamp):
+    """Never look further back than the table's default window."""
+    start = default_start(table)
+    if latest_timestamp is None or latest_timestamp < start:
+        return start
+    return latest_timestamp
+
+
+async def seed():
+    """Load every table's high-water marks with a single grouped query."""
+    selects = [
+        f"SELECT '{table}' AS tbl, instrument, MAX(time) AS latest FROM {table} GROUP BY instrument"
+        for table in INSTRUMENT_TABLES
+    ] + [
+        f"SELECT '{table}' AS tbl, NULL::text AS instrument, MAX(time) AS latest FROM {table}"
+        for table in GLOBAL_TABLES
+    ]
+    async with acquire() as conn:
+        rows = await conn.fetch(" UNION ALL ".join(selects) + ";")
+
+    for row in rows:
+        if row["latest"] is not None:
+            _watermarks[(row["tbl"], row["instrument"])] = row["latest"]
+    _seeded_tables.update(INSTRUMENT_TABLES + GLOBAL_TABLES)
+    _stale.clear()
+    logger.info(f"Seeded {len(rows)} watermarks.")
+
+
+async def _load(table, instrument):
+    """Read a single watermark from the database (cache miss or after a failed write)."""
+    if instrument is None:
+        query = f"SELECT MAX(time) FROM {table};"
+        args = ()
+    else:
+        query = f"SELECT MAX(time) FROM {table} WHERE instrument = $1;"
+        args = (instrument,)
+    async with acquire() as conn:
+        return await conn.fetchval(query, *args)
+
+
+async def latest_timestamp(table, instrument=None):
+    """Return where the next fetch for (table, instrument) should start."""
+    key = (table, instrument)
+    if key in _stale or (key not in _watermarks and table not in _seeded_tables):
+        latest = await _load(table, instrument)
+        _stale.discard(key)
+        if latest is not None:
+            _watermarks[key] = latest
+        else:
+            _watermarks.pop(key, None)
+    return _clamp(table, _watermarks.get(key))
+
+
+def advance(table, instrument, timestamp):
+    """Move a watermark forward after a successful write."""
+    key = (table, instrument)
+    if key in _stale or (key not in _watermarks and table not in _seeded_tables):
+        # The cache doesn't know the stored maximum yet; let the next read consult the DB
+        return
+    current = _watermarks.get(key)
+    if current is None or timestamp > current:
+        _watermarks[key] = timestamp
+
+
+def spooled(table, instrument, timestamp):
+    """Move a watermark forward for rows held in the write-ahead spool; the table gets them later.
+
+    An invalidated watermark stays invalidated: spooled rows were dropped
+    behind it, and only the table knows where the gap starts.
+    """
+    key = (table, instrument)
+    if key in _stale:
+        return
+    current = _watermarks.get(key)
+    if current is None or timestamp > current:
+        _watermarks[key] = timestamp
+
+
+def invalidate(table, instrument=None):
+    """Forget a watermark so the next read goes back to the database."""
+    _stale.add((table, instrument))
@@ -1,32 +1,257 @@
 import asyncio
+import importlib
+import logging
+import os
+import shutil
+import signal
+import time
+from datetime import timedelta
+# First: settles the worker count, the metrics mode and the DB pool size before their modules are imported
+from core import workers
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from parsers import laevitas, amberdata, deribit, laevitas_funding, binance, alternative
+from clients import breaker, http_client
+from core import analytics, config, http_server, log, metrics, supervisor
+from core.scheduler import AdaptiveScheduler
+from core.supervisor import Shard, Supervisor
+from db import migrations, spool, watermarks
+from db.bulk_writer import drain_spool
+from db.db_connection import init_pool, close_pool
 
+BINANCE_INTERVALS = os.getenv("BINANCE_INTERVALS", "1m").split(",")
+BINANCE_BACKFILL_MINUTES = int(os.getenv("BINANCE_BACKFILL_MINUTES", "15"))
+PLAN_LOG_MINUTES = int(os.getenv("SCHEDULER_PLAN_LOG_MINUTES", "15"))
+HTTP_WARMUP = os.getenv("HTTP_WARMUP", "1") == "1"
+HTTP_WARMUP_TIMEOUT = float(os.getenv("HTTP_WARMUP_TIMEOUT", "5"))
+
+# Parser modules per source, imported only when the source has work on the shard
+PARSERS = {
+    "laevitas": ("parsers.laevitas",),
+    "amberdata": ("parsers.amberdata",),
+    "deribit": ("parsers.deribit",),
+    "binance": ("parsers.binance", "parsers.binance_backfill", "parsers.binance_stream"),
+    "laevitas_funding": ("parsers.laevitas_funding",),
+    "alternative": ("parsers.alternative",),
+}
+# Fetched by a single job rather than split by instrument across shards
+UNSPLIT = ("amberdata", "alternative")
+
+logger = logging.getLogger(__name__)
+
+
+def _cancel_on_sigterm():
+    """Treat SIGTERM (docker stop, the supervisor) like Ctrl-C: cancel main and clean up."""
+    task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+
+
+def _load_parsers(shard):
+    """Import the parser modules of the sources with work on this shard; {module name: module}."""
+    modules = {}
+    for source, names in PARSERS.items():
+        if shard.owns(source) if source in UNSPLIT else shard.instruments(source):
+            for name in names:
+                modules[name.rpartition(".")[2]] = importlib.import_module(name)
+    return modules
+
+
+async def _warm_database(shard, reporter):
+    """Pool, migrations, then watermarks and the analytics windows side by side; returns the analytics task."""
+    # Open the shared DB pool once; every parser borrows connections from it.
+    # With the spool open, scraping goes on through an outage and the pool is retried on first use.
+    try:
+        await init_pool()
+    except Exception as e:
+        if not spool.is_open():
+            raise
+        logger.error(f"Database unavailable at startup, spooling until it is back: {e}")
+
+    # Hypertables, compression and continuous aggregates; a no-op once applied (the supervisor applies them)
+    if reporter is None:
+        try:
+            await migrations.apply()
+        except Exception as e:
+            logger.error(f"Failed to apply schema migrations, continuing on the current schema: {e}")
+
+    async def seed_watermarks():
+        # Load every source's high-water mark once instead of a SELECT MAX(time) per tick
+        try:
+            await watermarks.seed()
+        except Exception as e:
+            logger.error(f"Failed to seed watermarks, falling back to per-job lookups: {e}")
+        # Spooled rows are newer than the table, so fetches resume after them rather than refetching
+        for (table, instrument), timestamp in spool.pending_latest().items():
+            watermarks.spooled(table, instrument, timestamp)
+
+    if not analytics.ENABLED:
+        await seed_watermarks()
+        return None
+    # Rolling derived metrics, updated from every committed batch
+    _, analytics_task = await asyncio.gather(seed_watermarks(), analytics.start(shard.instruments))
+    return analytics_task
+
+
+async def _warm_http(urls):
+    """Open a connection to each upstream host so the first fetches skip DNS, TCP and TLS setup."""
+    async def connect(url):
+        try:
+            # Bypasses the breakers: a host that doesn't serve its root shouldn't count as failing
+            await http_client.get_client().head(url, timeout=HTTP_WARMUP_TIMEOUT)
+        except http_client.HTTPError as e:
+            logger.warning(f"Could not warm up a connection to {http_client.host_of(url)}: {e}")
+
+    hosts = {http_client.host_of(url): url for url in urls}
+    await asyncio.gather(*(connect(f"https://{host}/") for host in hosts))
+
+
+async def run(shard=Shard(), reporter=None):
+    """Run the scheduler over the shard's jobs; reporter is the pipe to the supervisor, if any."""
+    _cancel_on_sigterm()
+    metrics.mark_started()
+    started = time.perf_counter()
 
-async def main():
     # Initialize scheduler
-    print("Set Up")
+    logger.info(f"Set Up (shard {shard.index + 1}/{shard.count})")
+    parsers = _load_parsers(shard)
+
+    # Batches are spooled to local disk first; whatever the last run left undrained is replayed
+    if reporter is None:
+        # Alone, this process owns every shard a previous run with more workers spooled into
+        spool.adopt_shards(shard.count)
+    spool.open_spool(spool.shard_name(shard.index))
+
+    # The database and the upstream connections warm up concurrently, before any job is armed
+    warmups = [_warm_database(shard, reporter)]
+    if HTTP_WARMUP:
+        urls = [getattr(module, "BASE_URL", None) or getattr(module, "API_URL", None) for module in parsers.values()]
+        warmups.append(_warm_http([url for url in urls if url]))
+    analytics_task, *_ = await asyncio.gather(*warmups)
+    drainer = asyncio.create_task(drain_spool())
 
     scheduler = AsyncIOScheduler()
-    instruments = ["btc", "eth"]
-    for instrument in instruments:
-        scheduler.add_job(laevitas.fetch_data, "interval", minutes=1, args=[instrument], max_instances=1)
-        scheduler.add_job(amberdata.fetch_data, "interval", minutes=1, args=[instrument], max_instances=1)
-        scheduler.add_job(deribit.fetch_data, "interval", minutes=1, args=[instrument], max_instances=1)
-        scheduler.add_job(binance.fetch_data, "interval", seconds=30, args=[instrument], max_instances=1)
-        scheduler.add_job(laevitas_funding.fetch_data, "interval", minutes=1, args=[instrument], max_instances=1)
-
-    scheduler.add_job(alternative.fetch_data, "interval", minutes=1, max_instances=1)
+    adaptive = AdaptiveScheduler(scheduler)
+    # With streaming on, polling only backfills at startup and reconciles gaps left by reconnects
+    deribit = parsers.get("deribit")
+    binance_stream = parsers.get("binance_stream")
+    deribit_poll = timedelta(minutes=30 if deribit and deribit.STREAM_ENABLED else 1)
+    # Same for Binance: the kline stream carries live candles, REST reconciles
+    binance_poll = timedelta(seconds=300 if binance_stream and binance_stream.STREAM_ENABLED else 30)
+
+    # One job per source; instruments fan out through the source's bounded worker pool.
+    # Each shard only gets its own instruments, and sources that don't land on it are left out.
+    def add(name, func, args=(), source=None, **kwargs):
+        adaptive.add(name, func, args, instruments=shard.instruments(source or name), **kwargs)
+
+    if "laevitas" in parsers:
+        laevitas = parsers["laevitas"]
+        add("laevitas", laevitas.fetch_data, poll_interval=timedelta(minutes=1), cadence=laevitas.CADENCE,
+            table=laevitas.TABLE, url=laevitas.BASE_URL)
+    # Amberdata's GraphQL API takes every instrument in one aliased request, so it isn't split
+    if "amberdata" in parsers:
+        amberdata = parsers["amberdata"]
+        adaptive.add("amberdata", amberdata.fetch_batch, instruments=config.instruments_for("amberdata"), batch=True,
+                     poll_interval=timedelta(minutes=1), cadence=amberdata.CADENCE,
+                     table=amberdata.TABLE, url=amberdata.BASE_URL)
+    if deribit is not None:
+        add("deribit", deribit.fetch_data, poll_interval=deribit_poll)
+    if "binance" in parsers:
+        binance, binance_backfill = parsers["binance"], parsers["binance_backfill"]
+        add("binance", binance.fetch_data, poll_interval=binance_poll, url=binance.BASE_URL)
+        for interval in BINANCE_INTERVALS:
+            add(f"binance_backfill:{interval}", binance_backfill.backfill, [interval], source="binance",
+                poll_interval=timedelta(minutes=BINANCE_BACKFILL_MINUTES), url=binance.BASE_URL)
+    if "laevitas_funding" in parsers:
+        laevitas_funding = parsers["laevitas_funding"]
+        add("laevitas_funding", laevitas_funding.fetch_data, poll_interval=timedelta(minutes=1),
+            cadence=laevitas_funding.CADENCE, table=laevitas_funding.TABLE, url=laevitas_funding.BASE_URL)
+    if "alternative" in parsers:
+        alternative = parsers["alternative"]
+        adaptive.add("alternative", alternative.fetch_data, poll_interval=timedelta(minutes=1),
+                     cadence=alternative.CADENCE, table=alternative.TABLE, url=alternative.API_URL)
+    scheduler.add_job(adaptive.log_plan, "interval", minutes=PLAN_LOG_MINUTES)
     scheduler.start()
 
-    print("Scheduler Started")
+    # Prometheus metrics and the scheduler plan; workers serve theirs next to the supervisor's port
+    port = http_server.PORT if reporter is None else http_server.PORT + 1 + shard.index
+    http_runner = await http_server.start(adaptive, port=port)
+
+    if deribit is not None and deribit.STREAM_ENABLED:
+        await deribit.start_stream(shard.instruments("deribit"))
+    if binance_stream is not None and binance_stream.STREAM_ENABLED:
+        binance_stream.start_stream(shard.instruments("binance"))
+
+    logger.info(f"Scheduler Started after {time.perf_counter() - started:.2f}s "
+                f"({len(adaptive.jobs)} jobs from {len(parsers)} parser modules)")
 
     try:
         while True:
-            await asyncio.sleep(1)
-    except (KeyboardInterrupt, SystemExit):
+            if reporter is not None:
+                reporter.send({"plan": adaptive.plan(), "breakers": breaker.status()})
+            await asyncio.sleep(supervisor.HEALTH_SECONDS)
+    except (KeyboardInterrupt, SystemExit, asyncio.CancelledError):
         # Shut down the scheduler gracefully
         scheduler.shutdown()
+    finally:
+        await http_runner.cleanup()
+        if binance_stream is not None:
+            await binance_stream.stop_stream()
+        if deribit is not None:
+            await deribit.deribit_ws.close_client()
+        await http_client.close_client()
+        if analytics_task is not None:
+            analytics_task.cancel()
+            await asyncio.gather(analytics_task, return_exceptions=True)
+            await analytics.flush()
+        # Let the drainer finish unwinding before its spool and pool go away under it
+        drainer.cancel()
+        await asyncio.gather(drainer, return_exceptions=True)
+        spool.close_spool()
+        await close_pool()
+
+
+def run_worker(index, count, reporter):
+    """Entry point of a worker process started by the supervisor."""
+    log.setup()
+    try:
+        asyncio.run(run(Shard(index, count), reporter))
+    except KeyboardInterrupt:
+        pass  # Ctrl-C reaches the whole process group; the supervisor handles it
+
+
+async def supervise(count):
+    """Run `count` workers and serve their aggregated status until cancelled."""
+    _cancel_on_sigterm()
+    logger.info(f"Starting {count} scraper workers")
+
+    # The supervisor keeps a small pool of its own for migrations and /snapshot
+    try:
+        await init_pool()
+        await migrations.apply()
+    except Exception as e:
+        logger.error(f"Failed to apply schema migrations, continuing on the current schema: {e}")
+
+    # Spools of workers that a previous run had and this one doesn't would never be drained otherwise
+    spool.adopt_shards(count)
+    pool = Supervisor(run_worker, count)
+    pool.start()
+    http_runner = await http_server.start(supervisor=pool)
+    try:
+        await pool.watch()
+    except (KeyboardInterrupt, SystemExit, asyncio.CancelledError):
+        logger.info("Stopping scraper workers")
+    finally:
+        await pool.stop()
+        await http_runner.cleanup()
+        await close_pool()
+        if workers.CREATED_METRICS_DIR is not None:
+            shutil.rmtree(workers.CREATED_METRICS_DIR, ignore_errors=True)
+
+
+async def main():
+    log.setup()
+    if supervisor.WORKERS > 1:
+        await supervise(supervisor.WORKERS)
+    else:
+        await run()
 
 
 # Run the asyncio event loop
@@ -1,27 +1,52 @@
-import requests
+import logging
 from datetime import datetime, timedelta, UTC
-from db.db_connection import get_db_connection
+from clients import http_client
+from core import metrics
+from core.columns import Column, ColumnSpec, Converted
+from db import watermarks
+from db.bulk_writer import write_records
 
+SOURCE = "alternative"
 API_URL = "https://api.alternative.me/fng/?limit={}"
+TABLE = "fear_greed_index"
+SPEC = ColumnSpec(
+    Column("time", "timestamp", "s"),
+    Column("value", "value", "int", required=True),
+    Column("classification", "value_classification", "str", required=True),
+)
+COLUMNS = SPEC.names
+# The index is published once a day
+CADENCE = timedelta(days=1)
+
+logger = logging.getLogger(__name__)
+
+
+def convert(data):
+    """Index entries to records in SPEC order, in one loop (faster than SPEC.convert() for three columns)."""
+    records = []
+    append = records.append
+    skipped, sample = 0, None
+    for entry in data:
+        try:
+            classification = entry["value_classification"]
+            if classification is None:
+                raise ValueError("missing classification")
+            append((datetime.fromtimestamp(float(entry["timestamp"]), UTC), int(entry["value"]), str(classification)))
+        except (TypeError, ValueError, KeyError, OverflowError, OSError):
+            skipped += 1
+            if sample is None:
+                sample = entry
+    return Converted(records, skipped, sample, "bad or missing value" if skipped else None)
+
 
 async def fetch_latest_timestamp():
-    """Fetch the latest timestamp from the database."""
+    """Fetch the latest timestamp from the watermark cache (last 100 days by default)."""
     try:
-        conn = await get_db_connection()
-        query = "SELECT MAX(time) FROM fear_greed_index;"
-        latest_timestamp = await conn.fetchval(query)
-        await conn.close()
-
-        now = datetime.now(UTC)
-        days_ago = now - timedelta(days=100)  # ✅ Default to last 100 days
-
-        # If no timestamp exists OR it's older than 1 month, fetch the last month
-        if latest_timestamp is None or latest_timestamp < days_ago:
-            return days_ago
-        return latest_timestamp
+        return await watermarks.latest_timestamp(TABLE)
     except Exception as e:
-        print(f"[ERROR] Failed to fetch latest timestamp: {e}")
-        return datetime.now(UTC) - timedelta(days=100)  # Default to last 100 days if error occurs
+        metrics.record_error(SOURCE, None, "watermark")
+        logger.error(f"Failed to fetch latest timestamp: {e}", extra={"source": SOURCE})
+        return watermarks.default_start(TABLE)
 
 
 async def fetch_data():
@@ -29,62 +54,57 @@ async def fetch_data():
     try:
         latest_timestamp = await fetch_latest_timestamp()
         current_timestamp = datetime.now(UTC)
-        if (current_timestamp - latest_timestamp) < timedelta(days=1):
+        if (current_timestamp - latest_timestamp) < CADENCE:
             return
 
         # ✅ Calculate how many days to fetch (max 100)
         limit = min((current_timestamp - latest_timestamp).days + 10, 100)
 
-        response = requests.get(API_URL.format(limit))
+        with metrics.phase(SOURCE, None, "fetch"):
+            response = await http_client.get(API_URL.format(limit))
+        metrics.record_bytes(SOURCE, None, len(response.content))
         if response.status_code != 200:
-            print(f"[ERROR] Failed to fetch Fear & Greed Index: HTTP {response.status_code}")
+            metrics.record_error(SOURCE, None, "fetch")
+            logger.error(f"Failed to fetch Fear & Greed Index: HTTP {response.status_code}",
+                         extra={"source": SOURCE, "status": response.status_code})
             return
 
-        data = response.json().get("data", [])
-        formatted_data = [
-            {
-                "time": datetime.fromtimestamp(int(entry["timestamp"]), UTC),
-                "value": int(entry["value"]),
-                "classification": entry["value_classification"]
-            }
-            for entry in data if datetime.fromtimestamp(int(entry["timestamp"]), UTC) > latest_timestamp
-        ]
-
-        if formatted_data:
-            await store_data(formatted_data)  # ✅ Call `store_data()` inside `fetch_data()`
+        with metrics.phase(SOURCE, None, "decode"):
+            data = response.json().get("data", [])
+        with metrics.phase(SOURCE, None, "parse"):
+            converted = convert(data)
+            records = [record for record in converted.records if record[0] > latest_timestamp]
+        converted.log_skipped(logger, SOURCE)
+        metrics.record_rows(SOURCE, None, parsed=len(records), skipped=converted.skipped)
+
+        if records:
+            await store_data(records)  # ✅ Call `store_data()` inside `fetch_data()`
         else:
-            print("[INFO] No new Fear & Greed Index data to store.")
+            logger.info("No new Fear & Greed Index data to store.", extra={"source": SOURCE})
 
-    except requests.RequestException as e:
-        print(f"[ERROR] Network error while fetching Fear & Greed Index: {e}")
+    except http_client.HTTPError as e:
+        logger.error(f"Network error while fetching Fear & Greed Index: {e}", extra={"source": SOURCE})
     except Exception as e:
-        print(f"[ERROR] Unexpected error in fetch_data: {e}")
+        logger.error(f"Unexpected error in fetch_data: {e}", extra={"source": SOURCE})
 
 
-async def store_data(data):
-    """Store the Fear and Greed Index data in the database."""
+async def store_data(records):
+    """Store Fear and Greed Index records (in COLUMNS order) in the database."""
     try:
-        conn = await get_db_connection()
-
-        query = """
-        INSERT INTO fear_greed_index (time, value, classification)
-        VALUES ($1, $2, $3)
-        ON CONFLICT (time) DO NOTHING;
-        """
-
-        records = [(entry["time"], entry["value"], entry["classification"]) for entry in data]
-
         if records:
-            await conn.executemany(query, records)
-            print(f"[INFO] Inserted {len(records)} new Fear & Greed Index records.")
-
-        await conn.close()
+            with metrics.phase(SOURCE, None, "store"):
+                await write_records(TABLE, COLUMNS, records, conflict_columns=("time",))
+            metrics.record_rows(SOURCE, None, accepted=len(records))
+            logger.info(f"Accepted {len(records)} new Fear & Greed Index records.",
+                        extra={"source": SOURCE, "rows": len(records)})
 
     except Exception as e:
-        print(f"[ERROR] Failed to store data: {e}")
+        logger.error(f"Failed to store data: {e}", extra={"source": SOURCE})
 
 
 # Run fetch and store function
 if __name__ == "__main__":
     import asyncio
+    from core import log
+    log.setup()
     asyncio.run(fetch_data())  # ✅ Only `fetch_data()` is called
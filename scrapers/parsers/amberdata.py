@@ -1,8 +1,41 @@
-import requests
+import asyncio
+import logging
+import os
+import random
+from collections import deque
 from datetime import datetime, timedelta, UTC
-from db.db_connection import get_db_connection
 
+import ijson
+from ijson.common import ObjectBuilder
+
+from clients import http_client
+from core import config, metrics
+from core.columns import Column, ColumnSpec
+from db import watermarks
+from db.bulk_writer import write_records
+
+SOURCE = "amberdata"
 BASE_URL = "https://derivatives-graphql.amberdata.com/graphql"
+TABLE = "amberdata_delta_surfaces"
+DELTAS = ("05", "10", "15", "25", "35")
+# delta_call_05_ratio <- deltaCall05Ratio, and so on for every side, delta and measure
+SPEC = ColumnSpec(
+    Column("time", "date", "ms"),
+    Column("instrument"),
+    # Stored as received, like the surfaces: upstream sends nulls for some buckets and they are kept
+    Column("days_to_expiration", "daysToExpiration"),
+    *(
+        Column(f"delta_{side}_{delta}_{kind}", f"delta{side.title()}{delta}{kind.title()}")
+        for side in ("call", "put") for delta in DELTAS for kind in ("ratio", "spread")
+    ),
+)
+COLUMNS = SPEC.names
+# Delta surfaces are hourly
+CADENCE = timedelta(hours=1)
+# Catch-ups are split into windows of this many days, fetched a few at a time
+CHUNK_DAYS = int(os.getenv("AMBERDATA_CHUNK_DAYS", "1"))
+CHUNK_CONCURRENCY = int(os.getenv("AMBERDATA_CHUNK_CONCURRENCY", "3"))
+CHUNK_RETRIES = int(os.getenv("AMBERDATA_CHUNK_RETRIES", "2"))
 HEADERS = {
     "Accept-Encoding": "gzip, deflate, br, zstd",
     "Accept-Language": "en-US,en;q=0.9,ru;q=0.8,hy;q=0.7",
@@ -22,143 +55,235 @@ HEADERS = {
     "Content-Type": "application/json"
 }
 
+FIELDS = """
+    date
+    exchange
+    currency
+    daysToExpiration
+    deltaCall05Ratio
+    deltaCall05Spread
+    deltaCall10Ratio
+    deltaCall10Spread
+    deltaCall15Ratio
+    deltaCall15Spread
+    deltaCall25Ratio
+    deltaCall25Spread
+    deltaCall35Ratio
+    deltaCall35Spread
+    deltaPut05Ratio
+    deltaPut05Spread
+    deltaPut10Ratio
+    deltaPut10Spread
+    deltaPut15Ratio
+    deltaPut15Spread
+    deltaPut25Ratio
+    deltaPut25Spread
+    deltaPut35Ratio
+    deltaPut35Spread
+    __typename
+"""
+
+logger = logging.getLogger(__name__)
+
 
 async def fetch_latest_timestamp(instrument):
-    """Fetch the latest timestamp for the given instrument from the database."""
+    """Fetch the latest timestamp for the given instrument from the watermark cache."""
     try:
-        conn = await get_db_connection()
-        query = "SELECT MAX(time) FROM amberdata_delta_surfaces WHERE instrument = $1;"
-        latest_timestamp = await conn.fetchval(query, instrument)
-        await conn.close()
-
-        now = datetime.now(UTC)
-        seven_days_ago = now - timedelta(days=7)
-
-        # If no timestamp exists OR it's older than 7 days, fetch the last 7 days
-        if latest_timestamp is None or latest_timestamp < seven_days_ago:
-            return seven_days_ago
-        return latest_timestamp
+        return await watermarks.latest_timestamp(TABLE, instrument)
     except Exception as e:
-        print(f"[ERROR] Failed to fetch latest timestamp for {instrument}: {e}")
-        return datetime.now(UTC) - timedelta(days=7)  # Default to last 7 days if error occurs
+        metrics.record_error(SOURCE, instrument, "watermark")
+        logger.error(f"Failed to fetch latest timestamp for {instrument}: {e}", extra={"source": SOURCE, "instrument": instrument})
+        return watermarks.default_start(TABLE)
+
+
+def build_payload(instruments, start_date, end_date):
+    """One GraphQL request for several instruments, each under its own alias (i0, i1, ...)."""
+    selections = "\n".join(
+        f"""
+        i{index}: DeltaSurfacesConstantWings(
+            startDate: $startDate
+            endDate: $endDate
+            exchange: $exchange
+            currency: {config.symbol("amberdata", instrument)}
+            interval: $interval
+        ) {{{FIELDS}}}"""
+        for index, instrument in enumerate(instruments)
+    )
+    return {
+        "operationName": "DeltaSurfacesConstantWings",
+        "variables": {
+            "exchange": "deribit",
+            "interval": "hours",
+            "startDate": start_date,
+            "endDate": end_date,
+        },
+        "query": f"""
+            query DeltaSurfacesConstantWings($startDate: String, $endDate: String, $exchange: ExchangeEnumType, $interval: String) {{
+                {selections}
+            }}
+        """
+    }
 
 
 async def fetch_data(instrument):
     """Fetch Amberdata data starting from the latest available timestamp."""
+    await fetch_batch([instrument])
+
+
+def windows(start, end):
+    """Split the days from start to end into consecutive windows of CHUNK_DAYS days.
+
+    Both dates of a (start_date, end_date) window are included, as upstream
+    treats endDate, so the next window starts the day after.
+    """
+    day = start.date()
+    last = end.date()
+    result = []
+    while True:
+        window_end = min(day + timedelta(days=CHUNK_DAYS - 1), last)
+        result.append((day, window_end))
+        if window_end >= last:
+            return result
+        day = window_end + timedelta(days=1)
+
+
+class _BodyReader:
+    """Adapts an httpx streaming response to the async read() ijson expects."""
+
+    def __init__(self, response):
+        self._chunks = response.aiter_bytes()
+
+    async def read(self, size=-1):
+        if size == 0:
+            # ijson probes with read(0) to tell bytes from str
+            return b""
+        return await anext(self._chunks, b"")
+
+
+async def _surfaces(response):
+    """Yield (alias, entry) for each surface as soon as the parser has read all of it."""
+    builder = alias = item_prefix = None
+    async for prefix, event, value in ijson.parse_async(_BodyReader(response), use_float=True):
+        if builder is None:
+            # Surfaces live at data.<alias>.item
+            if event == "start_map" and prefix.startswith("data.") and prefix.endswith(".item"):
+                builder = ObjectBuilder()
+                alias, item_prefix = prefix[len("data."):-len(".item")], prefix
+            else:
+                continue
+        builder.event(event, value)
+        if event == "end_map" and prefix == item_prefix:
+            yield alias, builder.value
+            builder = None
+
+
+async def _fetch_window(instruments, window):
+    """Fetch one window for every instrument, retrying only this window on failure.
+
+    Returns {instrument: entries}, or None when every attempt failed.
+    """
+    start_date, end_date = (day.strftime('%Y-%m-%d') for day in window)
+    payload = build_payload(instruments, start_date, end_date)
+    for attempt in range(CHUNK_RETRIES + 1):
+        if attempt:
+            # Window retries share the host's retry budget and stop once its circuit opens
+            if not http_client.allow_retry(BASE_URL):
+                break
+            await asyncio.sleep(random.uniform(0, 2 ** attempt))
+        try:
+            entries = {f"i{index}": [] for index in range(len(instruments))}
+            # One request covers every due instrument, so fetch is reported without an instrument label
+            with metrics.phase(SOURCE, None, "fetch"):
+                async with http_client.stream("POST", BASE_URL, headers=HEADERS, json=payload) as response:
+                    if response.status_code != 200:
+                        raise http_client.HTTPError(f"HTTP {response.status_code}")
+                    # Parsed incrementally, so only this window's rows are ever held in memory
+                    async for alias, entry in _surfaces(response):
+                        entries.setdefault(alias, []).append(entry)
+                metrics.record_bytes(SOURCE, None, response.num_bytes_downloaded)
+            return {instrument: entries[f"i{index}"] for index, instrument in enumerate(instruments)}
+        except (http_client.HTTPError, http_client.StreamError, ijson.JSONError) as e:
+            logger.warning(f"Window {start_date}..{end_date} failed (attempt {attempt + 1}/{CHUNK_RETRIES + 1}): {e}",
+                           extra={"source": SOURCE, "instruments": instruments})
+    return None
+
+
+async def fetch_batch(instruments):
+    """Fetch every instrument that is due for new surfaces, one day-sized window at a time.
+
+    Windows are fetched CHUNK_CONCURRENCY at a time but stored strictly in
+    order, so a window that keeps failing stops the run there and the
+    watermark never jumps past a hole; the next run resumes from it.
+    """
     try:
-        latest_timestamp = await fetch_latest_timestamp(instrument)
         current_timestamp = datetime.now(UTC)
-        if (current_timestamp - latest_timestamp) < timedelta(hours=1):
+        starts = {}
+        for instrument in instruments:
+            latest_timestamp = await fetch_latest_timestamp(instrument)
+            if (current_timestamp - latest_timestamp) >= CADENCE:
+                starts[instrument] = latest_timestamp
+        if not starts:
             return
 
-        start_date = latest_timestamp.strftime('%Y-%m-%d')
-        end_date = current_timestamp.strftime('%Y-%m-%d')
-
-        payload = {
-            "operationName": "DeltaSurfacesConstantWings",
-            "variables": {
-                "exchange": "deribit",
-                "symbol": instrument.upper(),
-                "interval": "hours",
-                "startDate": start_date,
-                "endDate": end_date,
-            },
-            "query": """
-                query DeltaSurfacesConstantWings($startDate: String, $endDate: String, $exchange: ExchangeEnumType, $symbol: SymbolEnumType, $interval: String) {
-                    DeltaSurfacesConstantWings(
-                        startDate: $startDate
-                        endDate: $endDate
-                        exchange: $exchange
-                        currency: $symbol
-                        interval: $interval
-                    ) {
-                        date
-                        exchange
-                        currency
-                        daysToExpiration
-                        deltaCall05Ratio
-                        deltaCall05Spread
-                        deltaCall10Ratio
-                        deltaCall10Spread
-                        deltaCall15Ratio
-                        deltaCall15Spread
-                        deltaCall25Ratio
-                        deltaCall25Spread
-                        deltaCall35Ratio
-                        deltaCall35Spread
-                        deltaPut05Ratio
-                        deltaPut05Spread
-                        deltaPut10Ratio
-                        deltaPut10Spread
-                        deltaPut15Ratio
-                        deltaPut15Spread
-                        deltaPut25Ratio
-                        deltaPut25Spread
-                        deltaPut35Ratio
-                        deltaPut35Spread
-                        __typename
-                    }
-                }
-            """
-        }
-
-        with requests.Session() as session:
-            session.headers.update(HEADERS)
-            response = session.post(BASE_URL, headers=HEADERS, json=payload)
-
-        if response.status_code == 200:
-            data = response.json()
-            await store_data(data.get("data", {}).get("DeltaSurfacesConstantWings", []), instrument)
-        else:
-            print(f"[ERROR] Failed to fetch data for {instrument}: HTTP {response.status_code}")
-    except requests.RequestException as e:
-        print(f"[ERROR] Network error while fetching data for {instrument}: {e}")
+        pending = deque()  # (window, instruments, task) in window order
+
+        async def store_oldest():
+            """Store the oldest pending window; False once a fetch or a write has failed."""
+            window, due, task = pending.popleft()
+            data = await task
+            if data is None:
+                metrics.record_error(SOURCE, None, "fetch")
+                logger.error(f"Giving up on {', '.join(due)} from {window[0]} until the next run",
+                             extra={"source": SOURCE, "instruments": due})
+                return False
+            for instrument, entries in data.items():
+                if not await store_data(entries, instrument):
+                    logger.error(f"Stopping at {window[0]} after failing to store {instrument}; "
+                                 f"the next run resumes from its watermark",
+                                 extra={"source": SOURCE, "instrument": instrument})
+                    return False
+            return True
+
+        try:
+            for window in windows(min(starts.values()), current_timestamp):
+                # Instruments already stored past this window are left out of its request
+                due = [instrument for instrument, start in starts.items() if start.date() <= window[1]]
+                if len(pending) >= CHUNK_CONCURRENCY and not await store_oldest():
+                    return
+                pending.append((window, due, asyncio.create_task(_fetch_window(due, window))))
+            while pending:
+                if not await store_oldest():
+                    return
+        finally:
+            for _, _, task in pending:
+                task.cancel()
+    except http_client.HTTPError as e:
+        logger.error(f"Network error while fetching data for {', '.join(instruments)}: {e}",
+                     extra={"source": SOURCE, "instruments": instruments})
     except Exception as e:
-        print(f"[ERROR] Unexpected error in fetch_data for {instrument}: {e}")
+        logger.error(f"Unexpected error in fetch_data for {', '.join(instruments)}: {e}",
+                     extra={"source": SOURCE, "instruments": instruments})
 
 
 async def store_data(data, instrument):
-    """Insert new data into the TimescaleDB database."""
-    try:
-        conn = await get_db_connection()
-
-        query = """
-        INSERT INTO amberdata_delta_surfaces (
-            time, instrument, days_to_expiration, delta_call_05_ratio, delta_call_05_spread,
-            delta_call_10_ratio, delta_call_10_spread, delta_call_15_ratio, delta_call_15_spread,
-            delta_call_25_ratio, delta_call_25_spread, delta_call_35_ratio, delta_call_35_spread,
-            delta_put_05_ratio, delta_put_05_spread, delta_put_10_ratio, delta_put_10_spread,
-            delta_put_15_ratio, delta_put_15_spread, delta_put_25_ratio, delta_put_25_spread,
-            delta_put_35_ratio, delta_put_35_spread
-        )
-        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17, $18, $19, $20, $21, $22, $23)
-        ON CONFLICT (time, instrument) DO NOTHING;
-        """
+    """Insert new data into the TimescaleDB database.
 
-        records = []
-        for entry in data:
-            try:
-                timestamp = datetime.fromtimestamp(int(entry["date"]) / 1000, UTC)  # Convert ms to UTC datetime
-                records.append((
-                    timestamp, instrument, entry["daysToExpiration"],
-                    entry.get("deltaCall05Ratio"), entry.get("deltaCall05Spread"),
-                    entry.get("deltaCall10Ratio"), entry.get("deltaCall10Spread"),
-                    entry.get("deltaCall15Ratio"), entry.get("deltaCall15Spread"),
-                    entry.get("deltaCall25Ratio"), entry.get("deltaCall25Spread"),
-                    entry.get("deltaCall35Ratio"), entry.get("deltaCall35Spread"),
-                    entry.get("deltaPut05Ratio"), entry.get("deltaPut05Spread"),
-                    entry.get("deltaPut10Ratio"), entry.get("deltaPut10Spread"),
-                    entry.get("deltaPut15Ratio"), entry.get("deltaPut15Spread"),
-                    entry.get("deltaPut25Ratio"), entry.get("deltaPut25Spread"),
-                    entry.get("deltaPut35Ratio"), entry.get("deltaPut35Spread")
-                ))
-            except Exception as e:
-                print(f"[WARNING] Skipping malformed entry for {instrument}: {entry} | Error: {e}")
+    Returns whether the batch was stored.
+    """
+    try:
+        with metrics.phase(SOURCE, instrument, "parse"):
+            converted = SPEC.convert(data, instrument=instrument)
+        records = converted.records
+        converted.log_skipped(logger, SOURCE, instrument)
+        metrics.record_rows(SOURCE, instrument, parsed=len(records), skipped=converted.skipped)
 
         if records:
-            await conn.executemany(query, records)
-            print(f"[INFO] Inserted {len(records)} new records for {instrument} (amberdata_delta_surfaces).")
-
-        await conn.close()
+            with metrics.phase(SOURCE, instrument, "store"):
+                await write_records(TABLE, COLUMNS, records)
+            metrics.record_rows(SOURCE, instrument, accepted=len(records))
+            logger.info(f"Accepted {len(records)} new records for {instrument} ({TABLE}).",
+                        extra={"source": SOURCE, "instrument": instrument, "rows": len(records)})
+        return True
     except Exception as e:
-        print(f"[ERROR] Failed to store data for {instrument}: {e}")
+        logger.error(f"Failed to store data for {instrument}: {e}", extra={"source": SOURCE, "instrument": instrument})
+        return False
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, UTC
+from clients import http_client
+from core import metrics
+from db import watermarks
+from db.db_connection import acquire
+from parsers import binance
+
+MAX_CANDLES_PER_REQUEST = 1000
+CONCURRENCY = int(os.getenv("BINANCE_BACKFILL_CONCURRENCY", "4"))
+# Binance allows 6000 request weight per minute per IP; stay well below it
+WEIGHT_LIMIT = int(os.getenv("BINANCE_WEIGHT_LIMIT", "4800"))
+KLINES_WEIGHT = 2
+
+# Islands of missing candle open times between $2 and $3, stepping by $4
+GAP_QUERY = """
+WITH expected AS (
+    SELECT generate_series($2::timestamptz, $3::timestamptz, $4::interval) AS time
+),
+missing AS (
+    SELECT e.time
+    FROM expected e
+    LEFT JOIN {table} t ON t.time = e.time AND t.instrument = $1
+    WHERE t.time IS NULL
+),
+islands AS (
+    SELECT time, time - ROW_NUMBER() OVER (ORDER BY time) * $4::interval AS island
+    FROM missing
+)
+SELECT MIN(time) AS gap_start, MAX(time) AS gap_end
+FROM islands
+GROUP BY island
+ORDER BY gap_start;
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class WeightLimiter:
+    """Client-side view of Binance's per-minute request weight budget.
+
+    The local count is corrected from the X-MBX-USED-WEIGHT-1M header of every
+    response, and a 429/418 pauses all callers for the advertised Retry-After.
+    """
+
+    def __init__(self, limit=WEIGHT_LIMIT):
+        self.limit = limit
+        self.used = 0
+        self.window = self._current_window()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _current_window():
+        return int(time.time() // 60)
+
+    async def acquire(self, weight):
+        async with self._lock:
+            while True:
+                now = time.time()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                if self._current_window() != self.window:
+                    self.window = self._current_window()
+                    self.used = 0
+                if self.used + weight <= self.limit:
+                    self.used += weight
+                    return
+                # Budget exhausted: wait for Binance's minute window to roll over
+                await asyncio.sleep((self.window + 1) * 60 - now)
+
+    def update(self, response):
+        used = response.headers.get("X-MBX-USED-WEIGHT-1M")
+        if used is not None and self._current_window() == self.window:
+            self.used = max(self.used, int(used))
+        if response.status_code in (418, 429):
+            retry_after = int(response.headers.get("Retry-After", "60"))
+            self.paused_until = max(self.paused_until, time.time() + retry_after)
+
+
+_limiter = WeightLimiter()
+
+
+def _align(timestamp, interval_seconds):
+    """Floor a datetime to the start of its candle."""
+    epoch = int(timestamp.timestamp()) // interval_seconds * interval_seconds
+    return datetime.fromtimestamp(epoch, UTC)
+
+
+async def find_gaps(instrument, interval="1m", since=None):
+    """Return (start, end) open-time ranges of closed candles missing from the table."""
+    table = binance.INTERVAL_TABLES[interval]
+    step = timedelta(seconds=binance.INTERVAL_SECONDS[interval])
+    start = _align(since or watermarks.default_start(table), int(step.total_seconds()))
+    # The in-progress candle is not a gap; the regular poll keeps it current
+    end = _align(datetime.now(UTC), int(step.total_seconds())) - step
+    if end < start:
+        return []
+
+    async with acquire() as conn:
+        rows = await conn.fetch(GAP_QUERY.format(table=table), instrument, start, end, step)
+    return [(row["gap_start"], row["gap_end"]) for row in rows]
+
+
+def _pages(gaps, interval):
+    """Split gaps into request windows of at most MAX_CANDLES_PER_REQUEST candles."""
+    step_ms = binance.INTERVAL_SECONDS[interval] * 1000
+    for gap_start, gap_end in gaps:
+        page_start = int(gap_start.timestamp() * 1000)
+        gap_end_ms = int(gap_end.timestamp() * 1000)
+        while page_start <= gap_end_ms:
+            page_end = min(page_start + (MAX_CANDLES_PER_REQUEST - 1) * step_ms, gap_end_ms)
+            yield page_start, page_end
+            page_start = page_end + step_ms
+
+
+async def _fetch_page(instrument, interval, start_ms, end_ms, semaphore):
+    """Fetch and store one page; returns the number of candles stored, or None when the page failed."""
+    params = {
+        "symbol": binance.symbol(instrument),
+        "interval": interval,
+        "startTime": start_ms,
+        "endTime": end_ms,
+        "limit": MAX_CANDLES_PER_REQUEST,
+    }
+    async with semaphore:
+        await _limiter.acquire(KLINES_WEIGHT)
+        with metrics.phase(binance.SOURCE, instrument, "backfill_fetch"):
+            response = await http_client.get(binance.BASE_URL, params=params)
+        _limiter.update(response)
+    metrics.record_bytes(binance.SOURCE, instrument, len(response.content))
+
+    if response.status_code != 200:
+        metrics.record_error(binance.SOURCE, instrument, "backfill_fetch")
+        logger.error(f"Backfill page {start_ms}-{end_ms} failed for {instrument} {interval}: HTTP {response.status_code}")
+        return None
+    data = response.json()
+    if not await binance.store_data(data, instrument, interval):
+        return None
+    return len(data)
+
+
+async def backfill(instrument, interval="1m"):
+    """Find and fill every gap in the stored candles for one instrument and interval.
+
+    Gaps are found from the table on every pass, so pages that fail to fetch
+    or to store are simply looked for again on the next one.
+    """
+    try:
+        gaps = await find_gaps(instrument, interval)
+        if not gaps:
+            return
+
+        pages = list(_pages(gaps, interval))
+        logger.info(f"Backfilling {len(gaps)} gaps ({len(pages)} requests) for {instrument} {interval}")
+
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+        results = await asyncio.gather(
+            *(_fetch_page(instrument, interval, start, end, semaphore) for start, end in pages),
+            return_exceptions=True,
+        )
+        errors = [result for result in results if isinstance(result, Exception)]
+        for error in errors:
+            logger.error(f"Backfill request failed for {instrument} {interval}: {error}")
+        stored = [result for result in results if isinstance(result, int)]
+        # Failed pages (network errors, HTTP errors, failed writes) stay gaps for the next pass
+        failed = len(results) - len(stored)
+        if failed:
+            metrics.record_error(binance.SOURCE, instrument, "backfill")
+        logger.info(f"Backfilled {sum(stored)} candles for {instrument} {interval} ({failed} failed requests)")
+    except Exception as e:
+        logger.error(f"Unexpected error in backfill for {instrument} {interval}: {e}")
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from datetime import datetime, UTC
+
+import websockets
+
+from core import metrics
+from db.bulk_writer import write_records
+from parsers import binance
+
+SOURCE = "binance_stream"
+WS_URL = os.getenv("BINANCE_WS_URL", "wss://stream.binance.com:9443/stream")
+STREAM_ENABLED = os.getenv("BINANCE_STREAM", "0") == "1"
+FLUSH_INTERVAL = float(os.getenv("BINANCE_STREAM_FLUSH_INTERVAL", "1"))
+# How often the in-progress candle is written; closed candles are written on the next flush
+OPEN_SNAPSHOT_INTERVAL = float(os.getenv("BINANCE_STREAM_SNAPSHOT_INTERVAL", "5"))
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+
+logger = logging.getLogger(__name__)
+
+
+class KlineStream:
+    """Combined <symbol>@kline_1m stream for every instrument over one socket.
+
+    Updates are coalesced in memory: each candle keeps only its latest state,
+    closed candles are flushed in micro-batches and the open candle is written
+    at most every OPEN_SNAPSHOT_INTERVAL seconds.
+    """
+
+    def __init__(self, instruments, url=WS_URL):
+        self.instruments = {binance.symbol(instrument): instrument for instrument in instruments}
+        streams = "/".join(f"{symbol.lower()}@kline_1m" for symbol in self.instruments)
+        self.url = f"{url}?streams={streams}"
+        self._closed = {}  # (instrument, open time ms) -> record of a finished candle
+        self._open = {}  # instrument -> record of the in-progress candle
+        self._open_dirty = set()
+        self._last_snapshot = 0.0
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._consume()), asyncio.create_task(self._flush_loop())]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush(force_snapshot=True)
+
+    async def _consume(self):
+        delay = RECONNECT_MIN_DELAY
+        while True:
+            try:
+                async with websockets.connect(self.url) as ws:
+                    logger.info(f"Connected to Binance kline stream for {', '.join(self.instruments.values())}")
+                    delay = RECONNECT_MIN_DELAY
+                    async for message in ws:
+                        try:
+                            self.handle(json.loads(message))
+                        except Exception as e:
+                            # One malformed frame must not end the stream
+                            logger.error(f"Skipping Binance kline stream message {message[:200]!r}: {e!r}")
+            except Exception as e:
+                logger.error(f"Binance kline stream error: {e!r}")
+            await asyncio.sleep(random.uniform(0, delay))
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def handle(self, message):
+        """Merge one combined-stream kline event into the in-memory candles."""
+        kline = message.get("data", {}).get("k")
+        if kline is None:
+            return
+        instrument = self.instruments.get(kline.get("s"))
+        if instrument is None:
+            return
+
+        try:
+            record = (
+                datetime.fromtimestamp(kline["t"] / 1000, UTC), instrument,
+                float(kline["o"]), float(kline["h"]), float(kline["l"]),
+                float(kline["c"]), float(kline["v"])
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            metrics.record_rows(SOURCE, instrument, skipped=1)
+            logger.warning(f"Skipping malformed kline for {instrument}: {kline} | Error: {e}")
+            return
+        if kline.get("x"):
+            self._closed[(instrument, kline["t"])] = record
+            current = self._open.get(instrument)
+            if current is not None and current[0] <= record[0]:
+                del self._open[instrument]
+                self._open_dirty.discard(instrument)
+        else:
+            self._open[instrument] = record
+            self._open_dirty.add(instrument)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await self.flush()
+
+    async def flush(self, force_snapshot=False):
+        """Write closed candles plus, when due, a snapshot of the open ones."""
+        closed = self._closed
+        self._closed = {}
+        records = list(closed.values())
+
+        now = time.monotonic()
+        if self._open_dirty and (force_snapshot or now - self._last_snapshot >= OPEN_SNAPSHOT_INTERVAL):
+            records.extend(self._open[instrument] for instrument in self._open_dirty)
+            self._open_dirty.clear()
+            self._last_snapshot = now
+
+        if not records:
+            return
+        try:
+            with metrics.phase(SOURCE, None, "store"):
+                await write_records(binance.TABLE, binance.COLUMNS, records, update_columns=binance.COLUMNS[2:])
+            metrics.record_rows(SOURCE, None, accepted=len(records))
+        except Exception as e:
+            # Closed candles are final and only sent once; keep them for the next flush
+            for key, record in closed.items():
+                self._closed.setdefault(key, record)
+            logger.error(f"Failed to store {len(records)} streamed candles: {e}")
+
+
+_stream = None
+
+
+def start_stream(instruments):
+    """Start streaming 1m klines for the given instruments (idempotent)."""
+    global _stream
+    if _stream is None:
+        _stream = KlineStream(instruments)
+        _stream.start()
+    return _stream
+
+
+async def stop_stream():
+    global _stream
+    if _stream is not None:
+        await _stream.close()
+        _stream = None
@@ -1,38 +1,40 @@
 import asyncio
-import websockets
-import json
+import logging
+import os
 from datetime import datetime, UTC, timedelta
-from db.db_connection import get_db_connection
-
-WS_URL = "wss://www.deribit.com/ws/api/v2"
-HEADERS = {
-    "Origin": "https://www.deribit.com",
-    "Cache-Control": "no-cache",
-    "Accept-Language": "en-US,en;q=0.9,ru;q=0.8,hy;q=0.7",
-    "Pragma": "no-cache",
-    "Accept-Encoding": "gzip, deflate, br, zstd",
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36"
-}
+from clients import deribit_ws
+from core import config, metrics
+from core.columns import Column, ColumnSpec
+from db import watermarks
+from db.bulk_writer import write_records
+
+SOURCE = "deribit"
+TABLE = "deribit_funding_data"
+SPEC = ColumnSpec(
+    Column("time", "timestamp", "ms"),
+    Column("instrument"),
+    Column("index_price", "index_price"),
+    Column("interest_8h", "interest_8h"),
+)
+COLUMNS = SPEC.names
+# Ticker notifications are aggregated by Deribit before they are pushed
+TICKER_CHANNEL = "ticker.{}.agg2"
+STREAM_ENABLED = os.getenv("DERIBIT_STREAM", "0") == "1"
+
+_stream_samples = {}  # instrument -> latest ticker sample for the current minute
+_pending_writes = set()
+
+logger = logging.getLogger(__name__)
 
 
 async def fetch_latest_timestamp(instrument):
-    """Fetch the latest timestamp for the given instrument from the database."""
+    """Fetch the latest timestamp for the given instrument from the watermark cache."""
     try:
-        conn = await get_db_connection()
-        query = "SELECT MAX(time) FROM deribit_funding_data WHERE instrument = $1;"
-        latest_timestamp = await conn.fetchval(query, instrument)
-        await conn.close()
-
-        now = datetime.now(UTC)
-        seven_days_ago = now - timedelta(days=7)
-
-        # If no timestamp exists OR it's older than 7 days, fetch the last 7 days
-        if latest_timestamp is None or latest_timestamp < seven_days_ago:
-            return seven_days_ago
-        return latest_timestamp
+        return await watermarks.latest_timestamp(TABLE, instrument)
     except Exception as e:
-        print(f"[ERROR] Failed to fetch latest timestamp for {instrument}: {e}")
-        return datetime.now(UTC) - timedelta(days=7)  # Default to last 7 days if error occurs
+        metrics.record_error(SOURCE, instrument, "watermark")
+        logger.error(f"Failed to fetch latest timestamp for {instrument}: {e}", extra={"source": SOURCE, "instrument": instrument})
+        return watermarks.default_start(TABLE)
 
 
 def determine_length(start_timestamp):
@@ -46,74 +48,74 @@ def determine_length(start_timestamp):
         return "24h"
 
 
+def instrument_name(instrument):
+    return config.symbol(SOURCE, instrument)
+
+
 async def fetch_data(instrument):
-    """Fetch funding chart data from Deribit WebSocket (one-time connection)."""
+    """Fetch funding chart data over the shared Deribit WebSocket session."""
     try:
         latest_timestamp = await fetch_latest_timestamp(instrument)
         start_time = int(latest_timestamp.timestamp() * 1000)  # Convert to milliseconds
         length = determine_length(start_time)  # ✅ Dynamically select `8h`, `1d`, or `1m`
 
-        async with websockets.connect(WS_URL, additional_headers=HEADERS) as websocket:
-            print(f"[INFO] Connected to Deribit WebSocket for {instrument}")
+        with metrics.phase(SOURCE, instrument, "fetch"):
+            result = await deribit_ws.get_client().call(
+                "public/get_funding_chart_data",
+                {"instrument_name": instrument_name(instrument), "length": length},
+            )
 
-            # Send request for funding chart data
-            message = {
-                "jsonrpc": "2.0",
-                "id": 22,
-                "method": "public/get_funding_chart_data",
-                "params": {
-                    "instrument_name":  f'{instrument.upper()}-PERPETUAL',
-                    "length": length  # ✅ Dynamic selection
-                }
-            }
+        if result and "data" in result:
+            await store_data(result["data"], instrument)
+        else:
+            metrics.record_error(SOURCE, instrument, "fetch")
+            logger.warning(f"Unexpected response format: {result}", extra={"source": SOURCE, "instrument": instrument})
 
-            await websocket.send(json.dumps(message))
+    except (deribit_ws.DeribitError, ConnectionError, asyncio.TimeoutError) as e:
+        logger.error(f"WebSocket error: {e}", extra={"source": SOURCE, "instrument": instrument})
 
-            # Receive and process response
-            response = await websocket.recv()
-            response_data = json.loads(response)
+    except Exception as e:
+        logger.error(f"An error occurred: {e}", extra={"source": SOURCE, "instrument": instrument})
 
-            if "result" in response_data and "data" in response_data["result"]:
-                await store_data(response_data["result"]["data"], instrument)
-            else:
-                print(f"[WARNING] Unexpected response format: {response}")
 
-    except websockets.exceptions.WebSocketException as e:
-        print(f"[ERROR] WebSocket error: {e}")
+async def start_stream(instruments):
+    """Stream perpetual ticker updates into deribit_funding_data, one row per minute."""
+    channels = {TICKER_CHANNEL.format(instrument_name(instrument)): instrument for instrument in instruments}
 
-    except Exception as e:
-        print(f"[ERROR] An error occurred: {e}")
+    def on_ticker(channel, data):
+        instrument = channels[channel]
+        minute = data["timestamp"] // 60_000 * 60_000
+        sample = {
+            "timestamp": minute,
+            "index_price": data.get("index_price"),
+            "interest_8h": data.get("funding_8h"),
+        }
+        previous = _stream_samples.get(instrument)
+        _stream_samples[instrument] = sample
+        if previous is not None and previous["timestamp"] < minute:
+            # The previous minute is complete; write its last sample
+            task = asyncio.create_task(store_data([previous], instrument))
+            _pending_writes.add(task)
+            task.add_done_callback(_pending_writes.discard)
+
+    await deribit_ws.get_client().subscribe(list(channels), on_ticker)
+    logger.info(f"Streaming Deribit tickers for {', '.join(instruments)}", extra={"source": SOURCE})
 
 
 async def store_data(data, instrument):
     """Insert new data into the TimescaleDB database."""
     try:
-        conn = await get_db_connection()
-
-        query = """
-        INSERT INTO deribit_funding_data (
-            time, instrument, index_price, interest_8h
-        )
-        VALUES ($1, $2, $3, $4)
-        ON CONFLICT (time, instrument) DO NOTHING;
-        """
-
-        records = []
-        for entry in data:
-            try:
-                timestamp = datetime.fromtimestamp(entry["timestamp"] / 1000, UTC)
-                records.append((
-                    timestamp, instrument,
-                    entry.get("index_price"),
-                    entry.get("interest_8h"),
-                ))
-            except Exception as e:
-                print(f"[WARNING] Skipping malformed entry for {instrument}: {entry} | Error: {e}")
+        with metrics.phase(SOURCE, instrument, "parse"):
+            converted = SPEC.convert(data, instrument=instrument)
+        records = converted.records
+        converted.log_skipped(logger, SOURCE, instrument)
+        metrics.record_rows(SOURCE, instrument, parsed=len(records), skipped=converted.skipped)
 
         if records:
-            await conn.executemany(query, records)
-            print(f"[INFO] Inserted {len(records)} new records for {instrument} (deribit_funding_data).")
-
-        await conn.close()
+            with metrics.phase(SOURCE, instrument, "store"):
+                await write_records(TABLE, COLUMNS, records)
+            metrics.record_rows(SOURCE, instrument, accepted=len(records))
+            logger.info(f"Accepted {len(records)} new records for {instrument} (deribit_funding_data).",
+                        extra={"source": SOURCE, "instrument": instrument, "rows": len(records)})
     except Exception as e:
-        print(f"[ERROR] Failed to store data for {instrument}: {e}")
+        logger.error(f"Failed to store data for {instrument}: {e}", extra={"source": SOURCE, "instrument": instrument})
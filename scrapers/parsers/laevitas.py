@@ -1,8 +1,24 @@
-import requests
+import logging
 from datetime import datetime, timedelta, UTC
-from db.db_connection import get_db_connection
+from clients import http_cache, http_client
+from core import config, metrics
+from core.columns import Column, ColumnSpec
+from db import watermarks
+from db.bulk_writer import write_records
 
+SOURCE = "laevitas"
 BASE_URL = "https://be.laevitas.ch/charts/options/type/skew/deribit"
+TABLE = "laevitas_25delta_skew"
+PERIODS = (1, 7, 14, 30, 60, 90, 180, 365)
+# Skew per tenor comes keyed by its number of days
+SPEC = ColumnSpec(
+    Column("time", "date", "ms"),
+    Column("instrument"),
+    *(Column(f"period_{days}", str(days)) for days in PERIODS),
+)
+COLUMNS = SPEC.names
+# New skew points show up roughly every 5 minutes
+CADENCE = timedelta(minutes=5)
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36",
     "sec-ch-ua": '"Not A(Brand";v="8", "Chromium";v="132", "Google Chrome";v="132"',
@@ -15,25 +31,17 @@ HEADERS = {
     "authorization": "bearer"
 }
 
+logger = logging.getLogger(__name__)
+
 
 async def fetch_latest_timestamp(instrument):
-    """Fetch the latest timestamp for the given instrument from the database."""
+    """Fetch the latest timestamp for the given instrument from the watermark cache."""
     try:
-        conn = await get_db_connection()
-        query = "SELECT MAX(time) FROM laevitas_25delta_skew WHERE instrument = $1;"
-        latest_timestamp = await conn.fetchval(query, instrument)
-        await conn.close()
-
-        now = datetime.now(UTC)
-        seven_days_ago = now - timedelta(days=7)
-
-        # If no timestamp exists OR it's older than 7 days, fetch the last 7 days
-        if latest_timestamp is None or latest_timestamp < seven_days_ago:
-            return seven_days_ago
-        return latest_timestamp
+        return await watermarks.latest_timestamp(TABLE, instrument)
     except Exception as e:
-        print(f"[ERROR] Failed to fetch latest timestamp for {instrument}: {e}")
-        return datetime.now(UTC) - timedelta(days=7)  # Default to last 7 days if error occurs
+        metrics.record_error(SOURCE, instrument, "watermark")
+        logger.error(f"Failed to fetch latest timestamp for {instrument}: {e}", extra={"source": SOURCE, "instrument": instrument})
+        return watermarks.default_start(TABLE)
 
 
 async def fetch_data(instrument):
@@ -41,59 +49,59 @@ async def fetch_data(instrument):
     try:
         latest_timestamp = await fetch_latest_timestamp(instrument)
         current_timestamp = datetime.now(UTC)
-        if (current_timestamp - latest_timestamp) < timedelta(minutes=5):
+        if (current_timestamp - latest_timestamp) < CADENCE:
             return
 
         start_date = latest_timestamp.strftime('%Y-%m-%d')
         end_date = current_timestamp.strftime('%Y-%m-%d')
 
-        url = f"{BASE_URL}/{instrument}/25d/?start={start_date}&end={end_date}"
+        symbol = config.symbol(SOURCE, instrument)
+        url = f"{BASE_URL}/{symbol}/25d/?start={start_date}&end={end_date}"
 
-        with requests.Session() as session:
-            session.headers.update(HEADERS)
-            response = session.get(url)
+        with metrics.phase(SOURCE, instrument, "fetch"):
+            response = await http_cache.get(url, SOURCE, instrument, headers=HEADERS)
+        if response is None:
+            return  # ✅ Same payload as the last stored one; nothing to parse
+        metrics.record_bytes(SOURCE, instrument, len(response.content))
 
         if response.status_code == 200:
-            data = response.json()
-            await store_data(data, instrument)
+            with metrics.phase(SOURCE, instrument, "decode"):
+                data = response.json()
+            if await store_data(data, instrument, since=latest_timestamp):
+                http_cache.remember(url, response)
         else:
-            print(f"[ERROR] Failed to fetch data for {instrument}: HTTP {response.status_code}")
-    except requests.RequestException as e:
-        print(f"[ERROR] Network error while fetching data for {instrument}: {e}")
+            metrics.record_error(SOURCE, instrument, "fetch")
+            logger.error(f"Failed to fetch data for {instrument}: HTTP {response.status_code}",
+                         extra={"source": SOURCE, "instrument": instrument, "status": response.status_code})
+    except http_client.HTTPError as e:
+        logger.error(f"Network error while fetching data for {instrument}: {e}", extra={"source": SOURCE, "instrument": instrument})
     except Exception as e:
-        print(f"[ERROR] Unexpected error in fetch_data for {instrument}: {e}")
+        logger.error(f"Unexpected error in fetch_data for {instrument}: {e}", extra={"source": SOURCE, "instrument": instrument})
 
 
-async def store_data(data, instrument):
-    """Insert new data into the TimescaleDB database."""
-    try:
-        conn = await get_db_connection()
+async def store_data(data, instrument, since=None):
+    """Insert new data into the TimescaleDB database; rows at or before `since` are already stored.
 
-        query = """
-        INSERT INTO laevitas_25delta_skew (
-            time, instrument, period_1, period_7, period_14, period_30, 
-            period_60, period_90, period_180, period_365
-        )
-        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
-        ON CONFLICT (time, instrument) DO NOTHING;
-        """
-
-        records = []
-        for entry in data:
-            try:
-                timestamp = datetime.fromtimestamp(entry["date"] / 1000, UTC)  # Convert ms to UTC datetime
-                records.append((
-                    timestamp, instrument,
-                    entry.get("1"), entry.get("7"), entry.get("14"), entry.get("30"),
-                    entry.get("60"), entry.get("90"), entry.get("180"), entry.get("365")
-                ))
-            except Exception as e:
-                print(f"[WARNING] Skipping malformed entry for {instrument}: {entry} | Error: {e}")
+    Returns whether the batch was stored.
+    """
+    try:
+        with metrics.phase(SOURCE, instrument, "parse"):
+            converted = SPEC.convert(data, instrument=instrument)
+        records = converted.records
+        if since is not None:
+            # Day-granular requests repeat everything already stored today
+            records = [record for record in records if record[0] > since]
+        converted.log_skipped(logger, SOURCE, instrument)
+        metrics.record_rows(SOURCE, instrument, parsed=len(records), skipped=converted.skipped,
+                            filtered=len(converted.records) - len(records))
 
         if records:
-            await conn.executemany(query, records)
-            print(f"[INFO] Inserted {len(records)} new records for {instrument} (laevitas_25delta_skew).")
-
-        await conn.close()
+            with metrics.phase(SOURCE, instrument, "store"):
+                await write_records(TABLE, COLUMNS, records)
+            metrics.record_rows(SOURCE, instrument, accepted=len(records))
+            logger.info(f"Accepted {len(records)} new records for {instrument} ({TABLE}).",
+                        extra={"source": SOURCE, "instrument": instrument, "rows": len(records)})
+        return True
     except Exception as e:
-        print(f"[ERROR] Failed to store data for {instrument}: {e}")
+        logger.error(f"Failed to store data for {instrument}: {e}", extra={"source": SOURCE, "instrument": instrument})
+        return False
@@ -1,8 +1,23 @@
-import requests
+import logging
 from datetime import datetime, UTC, timedelta
-from db.db_connection import get_db_connection
+from clients import http_cache, http_client
+from core import config, metrics
+from core.columns import Column, ColumnSpec
+from db import watermarks
+from db.bulk_writer import write_records
 
+SOURCE = "laevitas_funding"
 BASE_URL = "https://be.laevitas.ch/charts/futures/weighted_funding"
+TABLE = "laevitas_weighted_funding"
+SPEC = ColumnSpec(
+    Column("time", "d", "ms"),
+    Column("instrument"),
+    Column("price", "p"),  # ✅ Save price
+    Column("weighted_funding", "a"),  # ✅ Save weighted funding APR
+)
+COLUMNS = SPEC.names
+# Weighted funding is refreshed roughly every 5 minutes
+CADENCE = timedelta(minutes=5)
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36",
     "sec-ch-ua-platform": '"Windows"',
@@ -15,72 +30,77 @@ HEADERS = {
     "cache-duration": "30"
 }
 
+logger = logging.getLogger(__name__)
 
-async def fetch_latest_timestamp(instrument):
-    """Fetch the latest timestamp for the given instrument from the database."""
-    conn = await get_db_connection()
-    query = "SELECT MAX(time) FROM laevitas_weighted_funding WHERE instrument = $1;"
-    latest_timestamp = await conn.fetchval(query, instrument)
-    await conn.close()
-
-    now = datetime.now(UTC)
-    seven_days_ago = now - timedelta(days=7)
 
-    if latest_timestamp is None or latest_timestamp < seven_days_ago:
-        return seven_days_ago
-    return latest_timestamp
+async def fetch_latest_timestamp(instrument):
+    """Fetch the latest timestamp for the given instrument from the watermark cache."""
+    try:
+        return await watermarks.latest_timestamp(TABLE, instrument)
+    except Exception as e:
+        metrics.record_error(SOURCE, instrument, "watermark")
+        logger.error(f"Failed to fetch latest timestamp for {instrument}: {e}", extra={"source": SOURCE, "instrument": instrument})
+        return watermarks.default_start(TABLE)
 
 
 async def fetch_data(instrument):
     """Fetch Laevitas weighted funding data starting from the latest timestamp."""
-    latest_timestamp = await fetch_latest_timestamp(instrument)
-    current_timestamp = datetime.now(UTC)
-    if (current_timestamp - latest_timestamp) < timedelta(minutes=5):
-        return
-
-    start_date = latest_timestamp.strftime('%Y-%m-%d')
-    end_date = current_timestamp.strftime('%Y-%m-%d')
-
-    url = f"{BASE_URL}/{instrument}/?start={start_date}&end={end_date}&class_attribute=all_apr"
-
-    with requests.Session() as session:
-        session.headers.update(HEADERS)
-        response = session.get(url)
-
-    if response.status_code == 200:
-        data = response.json()
-        await store_data(data, instrument)
-    else:
-        print(f"Failed to fetch data for {instrument}: {response.status_code}")
-
-
-async def store_data(data, instrument):
-    """Insert new data into the TimescaleDB database."""
-    conn = await get_db_connection()
-
-    query = """
-    INSERT INTO laevitas_weighted_funding (
-        time, instrument, price, weighted_funding
-    )
-    VALUES ($1, $2, $3, $4)
-    ON CONFLICT (time, instrument) DO NOTHING;
+    try:
+        latest_timestamp = await fetch_latest_timestamp(instrument)
+        current_timestamp = datetime.now(UTC)
+        if (current_timestamp - latest_timestamp) < CADENCE:
+            return
+
+        start_date = latest_timestamp.strftime('%Y-%m-%d')
+        end_date = current_timestamp.strftime('%Y-%m-%d')
+
+        symbol = config.symbol(SOURCE, instrument)
+        url = f"{BASE_URL}/{symbol}/?start={start_date}&end={end_date}&class_attribute=all_apr"
+
+        with metrics.phase(SOURCE, instrument, "fetch"):
+            response = await http_cache.get(url, SOURCE, instrument, headers=HEADERS)
+        if response is None:
+            return  # ✅ Same payload as the last stored one; nothing to parse
+        metrics.record_bytes(SOURCE, instrument, len(response.content))
+
+        if response.status_code == 200:
+            with metrics.phase(SOURCE, instrument, "decode"):
+                data = response.json()
+            if await store_data(data, instrument, since=latest_timestamp):
+                http_cache.remember(url, response)
+        else:
+            metrics.record_error(SOURCE, instrument, "fetch")
+            logger.error(f"Failed to fetch data for {instrument}: HTTP {response.status_code}",
+                         extra={"source": SOURCE, "instrument": instrument, "status": response.status_code})
+    except http_client.HTTPError as e:
+        logger.error(f"Network error while fetching data for {instrument}: {e}", extra={"source": SOURCE, "instrument": instrument})
+    except Exception as e:
+        logger.error(f"Unexpected error in fetch_data for {instrument}: {e}", extra={"source": SOURCE, "instrument": instrument})
+
+
+async def store_data(data, instrument, since=None):
+    """Insert new data into the TimescaleDB database; rows at or before `since` are already stored.
+
+    Returns whether the batch was stored.
     """
-
-    records = []
-    for entry in data:
-        try:
-            timestamp = datetime.fromtimestamp(entry["d"] / 1000, UTC)  # ✅ Fix key error
-            records.append((
-                timestamp, instrument,
-                entry.get("p"),  # ✅ Save price
-                entry.get("a")   # ✅ Save weighted funding APR
-            ))
-        except Exception as e:
-            print(f"[WARNING] Skipping malformed entry for {instrument}: {entry} | Error: {e}")
-
-    if records:
-        await conn.executemany(query, records)
-        print(f"Inserted {len(records)} new records for {instrument} laevitas_weighted_funding.")
-
-    await conn.close()
-
+    try:
+        with metrics.phase(SOURCE, instrument, "parse"):
+            converted = SPEC.convert(data, instrument=instrument)
+        records = converted.records
+        if since is not None:
+            # Day-granular requests repeat everything already stored today
+            records = [record for record in records if record[0] > since]
+        converted.log_skipped(logger, SOURCE, instrument)
+        metrics.record_rows(SOURCE, instrument, parsed=len(records), skipped=converted.skipped,
+                            filtered=len(converted.records) - len(records))
+
+        if records:
+            with metrics.phase(SOURCE, instrument, "store"):
+                await write_records(TABLE, COLUMNS, records)
+            metrics.record_rows(SOURCE, instrument, accepted=len(records))
+            logger.info(f"Accepted {len(records)} new records for {instrument} {TABLE}.",
+                        extra={"source": SOURCE, "instrument": instrument, "rows": len(records)})
+        return True
+    except Exception as e:
+        logger.error(f"Failed to store data for {instrument}: {e}", extra={"source": SOURCE, "instrument": instrument})
+        return False
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The scrapers run from scrapers/ (python -m core.X), so tests import core, db, clients and parsers from there
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,152 @@
+"""As-of alignment onto a common grid, the frame cache and the grid size limit."""
+import asyncio
+from contextlib import asynccontextmanager
+
+import numpy as np
+import pytest
+
+from core import alignment
+
+T0 = 1_700_000_040  # a whole minute
+PRICE = alignment.SOURCES["price"]
+
+
+def test_asof_carries_each_row_forward_until_max_age():
+    times = np.array([T0, T0 + 120.0])
+    values = np.array([[1.0], [2.0]])
+    grid = T0 + np.array([0.0, 60, 120, 180, 240, 300])
+
+    result = alignment.asof(times, values, grid, max_age=120)[:, 0]
+    # The second row is 180s old at the last grid point, past max_age
+    np.testing.assert_array_equal(result, [1, 1, 2, 2, 2, np.nan])
+
+
+def test_asof_is_missing_before_the_first_row():
+    times = np.array([T0 + 90.0])
+    values = np.array([[1.0, 10.0]])
+    grid = T0 + np.array([0.0, 60, 120])
+
+    result = alignment.asof(times, values, grid, max_age=600)
+    np.testing.assert_array_equal(result, [[np.nan, np.nan], [np.nan, np.nan], [1, 10]])
+
+
+def test_asof_includes_a_row_stamped_exactly_at_the_grid_point():
+    times = np.array([T0, T0 + 60.0, T0 + 60.0])
+    values = np.array([[1.0], [2.0], [3.0]])
+    grid = np.array([T0 + 59.0, T0 + 60.0])
+
+    # side="right": a row at the grid time counts, and of equal times the last one wins
+    np.testing.assert_array_equal(alignment.asof(times, values, grid, max_age=600)[:, 0], [1, 3])
+
+
+def test_asof_of_an_empty_source_is_all_missing():
+    result = alignment.asof(np.empty(0), np.empty((0, 2)), T0 + np.array([0.0, 60]), max_age=600)
+    assert result.shape == (2, 2) and np.isnan(result).all()
+
+
+@pytest.fixture
+def tables(monkeypatch):
+    """Rows per table as array_agg would return them; records every query."""
+    rows = {}
+    queries = []
+
+    class Connection:
+        async def fetchrow(self, query, *args):
+            queries.append((query, args))
+            table = next(table for table in rows if f"FROM {table} " in query)
+            return rows[table]
+
+    @asynccontextmanager
+    async def acquire():
+        yield Connection()
+
+    monkeypatch.setattr(alignment, "acquire", acquire)
+    monkeypatch.setattr(alignment, "_cache", alignment.OrderedDict())
+    return rows, queries
+
+
+def _price_rows(times, values):
+    """The aggregated row for the price table: times, then the same values in every column."""
+    return (list(times), *(list(values) for _ in PRICE.columns))
+
+
+def test_build_aligns_a_source_and_fills_its_columns(tables):
+    rows, queries = tables
+    rows[PRICE.table] = _price_rows([T0 - 30, T0 + 60], [1.0, 2.0])
+
+    result = asyncio.run(alignment.build("btc", T0, T0 + 120, 60, keys=["price"]))
+
+    np.testing.assert_array_equal(result.times, [T0, T0 + 60, T0 + 120])
+    np.testing.assert_array_equal(result.columns[f"price.{PRICE.columns[0]}"], [1, 2, 2])
+    (query, args), = queries
+    assert args[2] == "btc" and "ORDER BY time DESC LIMIT 1" in query
+
+
+def test_build_of_an_empty_table_is_all_missing(tables):
+    rows, _ = tables
+    rows[PRICE.table] = (None,) * (len(PRICE.columns) + 1)
+
+    result = asyncio.run(alignment.build("btc", T0, T0 + 60, 60, keys=["price"]))
+    assert all(np.isnan(values).all() for values in result.columns.values())
+
+
+def test_build_refuses_grids_over_max_points(tables, monkeypatch):
+    rows, queries = tables
+    rows[PRICE.table] = (None,) * (len(PRICE.columns) + 1)
+    monkeypatch.setattr(alignment, "MAX_POINTS", 10)
+
+    with pytest.raises(ValueError, match="11 grid points"):
+        asyncio.run(alignment.build("btc", T0, T0 + 600, 60, keys=["price"]))
+    assert queries == []
+    # Exactly MAX_POINTS is allowed
+    assert len(asyncio.run(alignment.build("btc", T0, T0 + 540, 60, keys=["price"])).times) == 10
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+def test_recent_frames_expire_after_the_ttl(tables, monkeypatch):
+    rows, queries = tables
+    rows[PRICE.table] = _price_rows([T0], [1.0])
+    clock = Clock(T0 + 120)
+    monkeypatch.setattr(alignment, "time", clock)
+
+    def frame():
+        return asyncio.run(alignment.frame("btc", T0, T0 + 60, 60, keys=["price"]))
+
+    first = frame()
+    clock.now += alignment.CACHE_TTL - 1
+    assert frame() is first and len(queries) == 1
+    clock.now += 2
+    assert frame() is not first and len(queries) == 2
+
+
+def test_settled_frames_stay_cached_past_the_ttl(tables, monkeypatch):
+    rows, queries = tables
+    rows[PRICE.table] = _price_rows([T0], [1.0])
+    clock = Clock(T0 + 60 + alignment.SETTLED_AFTER)
+    monkeypatch.setattr(alignment, "time", clock)
+
+    first = asyncio.run(alignment.frame("btc", T0, T0 + 60, 60, keys=["price"]))
+    clock.now += 10 * alignment.CACHE_TTL
+    assert asyncio.run(alignment.frame("btc", T0, T0 + 60, 60, keys=["price"])) is first
+    assert len(queries) == 1
+
+
+def test_the_cache_evicts_the_least_recently_used_frame(tables, monkeypatch):
+    rows, queries = tables
+    rows[PRICE.table] = _price_rows([T0], [1.0])
+    monkeypatch.setattr(alignment, "time", Clock(T0 + 120))
+    monkeypatch.setattr(alignment, "CACHE_MAX_ENTRIES", 2)
+
+    def frame(instrument):
+        return asyncio.run(alignment.frame(instrument, T0, T0 + 60, 60, keys=["price"]))
+
+    frame("btc"), frame("eth"), frame("btc"), frame("sol")
+    assert [key[0] for key in alignment._cache] == ["btc", "sol"]
+    assert len(queries) == 3
@@ -0,0 +1,75 @@
+"""Amberdata catch-ups: day windows and storing them strictly in order."""
+import asyncio
+from datetime import date, datetime, time, timedelta, UTC
+
+import pytest
+
+from db import bulk_writer, spool, watermarks
+from parsers import amberdata
+
+NOW = datetime.combine(datetime.now(UTC).date(), time(12), UTC)
+SURFACE = {column.key: 0.1 for column in amberdata.SPEC.columns[3:]}
+
+
+def test_windows_cover_each_day_once(monkeypatch):
+    monkeypatch.setattr(amberdata, "CHUNK_DAYS", 1)
+    start = datetime(2025, 1, 1, 18, tzinfo=UTC)
+    assert amberdata.windows(start, start + timedelta(days=2)) == [
+        (date(2025, 1, 1), date(2025, 1, 1)),
+        (date(2025, 1, 2), date(2025, 1, 2)),
+        (date(2025, 1, 3), date(2025, 1, 3)),
+    ]
+
+
+def test_windows_of_several_days_end_at_the_last_day(monkeypatch):
+    monkeypatch.setattr(amberdata, "CHUNK_DAYS", 3)
+    start = datetime(2025, 1, 1, tzinfo=UTC)
+    assert amberdata.windows(start, start + timedelta(days=4)) == [
+        (date(2025, 1, 1), date(2025, 1, 3)),
+        (date(2025, 1, 4), date(2025, 1, 5)),
+    ]
+    assert amberdata.windows(start, start + timedelta(hours=1)) == [(date(2025, 1, 1), date(2025, 1, 1))]
+
+
+class FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return NOW
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    """Rows written per (instrument, day), with the real writer's watermark bookkeeping."""
+    stored = []
+
+    async def write(table, columns, records, conflict_columns, update_columns, latest):
+        stored.extend((record[1], record[0].date()) for record in records)
+        return len(records)
+
+    monkeypatch.setattr(amberdata, "datetime", FrozenDatetime)
+    monkeypatch.setattr(amberdata, "CHUNK_DAYS", 1)
+    monkeypatch.setattr(bulk_writer, "_write", write)
+    monkeypatch.setattr(spool, "is_open", lambda: False)
+    monkeypatch.setattr(watermarks, "_watermarks", {(amberdata.TABLE, "btc"): NOW - timedelta(days=2)})
+    monkeypatch.setattr(watermarks, "_seeded_tables", {amberdata.TABLE})
+    monkeypatch.setattr(watermarks, "_stale", set())
+    return stored
+
+
+def test_a_failed_window_stops_the_run_before_later_windows_are_stored(stored, monkeypatch):
+    requested = []
+
+    async def fetch_window(instruments, window):
+        requested.append(window[0])
+        if len(requested) == 2:
+            return None
+        hour = datetime.combine(window[0], time(18), UTC)
+        return {instrument: [{"date": int(hour.timestamp() * 1000), **SURFACE}] for instrument in instruments}
+
+    monkeypatch.setattr(amberdata, "_fetch_window", fetch_window)
+    asyncio.run(amberdata.fetch_batch(["btc"]))
+
+    first, _, third = (NOW.date() - timedelta(days=days) for days in (2, 1, 0))
+    assert len(requested) == 3 and requested[2] == third
+    assert stored == [("btc", first)]
+    assert watermarks._watermarks[(amberdata.TABLE, "btc")] == datetime.combine(first, time(18), UTC)
@@ -0,0 +1,153 @@
+"""Archive export and read-back without a database."""
+import asyncio
+import os
+import random
+from datetime import date, datetime, timedelta, UTC
+
+import pytest
+
+from db import archive, archive_benchmark
+
+TABLE = archive_benchmark.TABLE
+
+
+@pytest.fixture
+def rows():
+    random.seed(0)
+    # Two and a half days of candles for three instruments: several daily partitions each
+    return archive_benchmark._rows(3 * 3600, 3)
+
+
+@pytest.mark.parametrize("file_format", list(archive.FORMATS))
+def test_export_round_trips(tmp_path, rows, file_format, monkeypatch):
+    # Small batches, so batches straddle period boundaries
+    monkeypatch.setattr(archive, "BATCH_ROWS", 1000)
+    root = str(tmp_path)
+    manifest = archive_benchmark._export(root, rows, file_format)
+    expected = archive_benchmark._sorted(rows)
+
+    assert archive_benchmark._sorted(archive_benchmark._import_records(root, manifest)) == expected
+    assert archive_benchmark._sorted(archive.to_records(archive.read(root, TABLE))) == expected
+
+    partitions = manifest["tables"][TABLE]["partitions"]
+    assert sorted(partitions) == sorted(
+        os.path.join(TABLE, f"date={day}", f"instrument={name}", f"part.{archive.FORMATS[file_format]}")
+        for day in ("2025-01-01", "2025-01-02", "2025-01-03") for name in ("inst0", "inst1", "inst2")
+    )
+    assert sum(partition["rows"] for partition in partitions.values()) == len(rows)
+    for relative, partition in partitions.items():
+        assert os.path.getsize(os.path.join(root, relative)) == partition["bytes"]
+        assert partition["period"] == datetime.fromisoformat(partition["min_time"]).date().isoformat()
+    assert not [name for _, _, names in os.walk(root) for name in names if name.endswith(".tmp")]
+
+
+def test_read_filters_by_instrument_and_time(tmp_path, rows):
+    root = str(tmp_path)
+    archive_benchmark._export(root, rows, "arrow")
+    start = archive_benchmark.START + timedelta(hours=30)
+    end = start + timedelta(hours=5)
+    table = archive.read(root, TABLE, instruments={"inst1"}, start=start, end=end)
+    expected = [row for row in rows if row[1] == "inst1" and start <= row[0] < end]
+    assert archive.to_records(table) == expected
+    assert archive.read(root, TABLE, start=datetime(2030, 1, 1, tzinfo=UTC)).num_rows == 0
+
+
+def test_tables_without_instruments_and_yearly_periods(tmp_path):
+    root = str(tmp_path)
+    columns = ("time", "value", "classification")
+    types = ("timestamp with time zone", "integer", "text")
+    partitions = {}
+    exporter = archive.Exporter(root, "fear_greed_index", columns, types, "year", "parquet", partitions)
+    days = [datetime(2024, 12, 30, tzinfo=UTC) + timedelta(days=i) for i in range(4)]
+    records = [(day, i, None if i == 2 else "Fear") for i, day in enumerate(days)]
+    exporter.write(records)
+    exporter.close()
+    assert sorted(partitions) == [
+        os.path.join("fear_greed_index", "date=2024-01-01", "part.parquet"),
+        os.path.join("fear_greed_index", "date=2025-01-01", "part.parquet"),
+    ]
+    read_back = []
+    for relative in sorted(partitions):
+        for batch in archive.read_batches(os.path.join(root, relative), "parquet"):
+            read_back.extend(archive.to_records(batch))
+    assert read_back == records
+
+
+def test_aborted_export_leaves_no_partial_files(tmp_path, rows):
+    partitions = {}
+    exporter = archive.Exporter(str(tmp_path), TABLE, archive_benchmark.COLUMNS, archive_benchmark.TYPES,
+                                "day", "parquet", partitions)
+    exporter.write(rows[:100])
+    exporter.abort()
+    assert partitions == {}
+    assert not [name for _, _, names in os.walk(tmp_path) for name in names]
+
+
+def test_periods():
+    when = datetime(2025, 12, 31, 23, 59, tzinfo=UTC)
+    assert archive.period_start(when, "day") == date(2025, 12, 31)
+    assert archive.period_end(date(2025, 12, 31), "day") == date(2026, 1, 1)
+    assert archive.period_start(when, "month") == date(2025, 12, 1)
+    assert archive.period_end(date(2025, 12, 1), "month") == date(2026, 1, 1)
+    assert archive.period_end(date(2025, 1, 1), "month") == date(2025, 2, 1)
+    assert archive.period_start(when, "year") == date(2025, 1, 1)
+    assert archive.period_end(date(2025, 1, 1), "year") == date(2026, 1, 1)
+
+
+class _Cursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def fetch(self, count):
+        batch, self.rows = self.rows[:count], self.rows[count:]
+        return batch
+
+
+class _Transaction:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class _Connection:
+    """Just enough of an asyncpg connection for export_table: the catalog queries and a cursor."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    async def fetch(self, query, table):
+        if "information_schema" in query:
+            return [{"column_name": column, "data_type": type_}
+                    for column, type_ in zip(archive_benchmark.COLUMNS, archive_benchmark.TYPES)]
+        return [{"attname": "time"}, {"attname": "instrument"}]
+
+    def transaction(self):
+        return _Transaction()
+
+    async def cursor(self, query, *args):
+        self.queries.append((query, args))
+        since = args[0] if args else None
+        return _Cursor([row for row in self.rows if since is None or row[0] >= since])
+
+
+def test_incremental_export_resumes_at_complete_through(tmp_path, rows):
+    root = str(tmp_path)
+    manifest = archive.load_manifest(root)
+    conn = _Connection(rows)
+    assert asyncio.run(archive.export_table(conn, root, TABLE, manifest)) == len(rows)
+    entry = manifest["tables"][TABLE]
+    complete_through = datetime.fromisoformat(entry["complete_through"])
+    assert complete_through == datetime.combine(datetime.now(UTC).date(), datetime.min.time(), UTC)
+    assert entry["key"] == ["time", "instrument"]
+
+    # The second run only asks for rows from complete_through on and keeps every earlier partition
+    partitions = dict(entry["partitions"])
+    assert asyncio.run(archive.export_table(conn, root, TABLE, manifest)) == 0
+    assert conn.queries[-1][1] == (complete_through,)
+    assert entry["partitions"] == partitions
+
+    with pytest.raises(ValueError):
+        asyncio.run(archive.export_table(conn, root, TABLE, manifest, file_format="arrow"))
@@ -0,0 +1,192 @@
+"""The replay harness: time shifting, fixture matching, injected faults and recording."""
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+import websockets
+
+from bench import fixtures, stubs
+from clients import deribit_ws
+
+KLINES_URL = "https://api.binance.com/api/v3/klines"
+T0 = 1_700_000_000_000  # epoch ms, a whole minute
+MINUTE = 60_000
+
+
+def _exchange(query, body, recorded_at, sent=None, method="GET", url=KLINES_URL, status=200):
+    parts = httpx.URL(url)
+    return {"method": method, "host": parts.netloc.decode(), "path": parts.path, "query": query, "sent": sent,
+            "status": status, "headers": {"Content-Type": "application/json"}, "body": json.dumps(body),
+            "recorded_at": recorded_at}
+
+
+def _serve(fixture_set, scenario, faults=stubs.Faults()):
+    async def main():
+        stub = stubs.HttpStub(fixture_set, faults)
+        client = stubs.redirect_client(await stub.start())
+        try:
+            return await scenario(stub, client)
+        finally:
+            await client.aclose()
+            await stub.stop()
+    return asyncio.run(main())
+
+
+def test_offset_is_whole_minutes_since_recording():
+    assert fixtures.offset_ms(1000, now=1000 + 59) == 0
+    assert fixtures.offset_ms(1000, now=1000 + 150) == 2 * MINUTE
+    assert fixtures.offset_ms(1000, now=900) == 0
+
+
+def test_shift_moves_timestamps_in_every_payload_shape():
+    kline = [T0, "1.0", "2.0", "0.5", "1.5", "10", T0 + MINUTE - 1, "15", 42, "5", "7", "0"]
+    payload = {
+        "klines": [kline],
+        "skew": [{"date": T0, "7": 1.5}],
+        "fng": [{"timestamp": str(T0 // 1000), "value": "40"}],
+        "frame": {"data": {"E": T0 + 5, "k": {"t": T0, "T": T0 + MINUTE - 1, "n": 42}}},
+    }
+    shifted = fixtures.shift(payload, 3 * MINUTE)
+
+    assert shifted["klines"][0][0] == T0 + 3 * MINUTE
+    assert shifted["klines"][0][6] == T0 + 4 * MINUTE - 1
+    assert shifted["klines"][0][1:6] == kline[1:6] and shifted["klines"][0][8] == 42
+    assert shifted["skew"] == [{"date": T0 + 3 * MINUTE, "7": 1.5}]
+    assert shifted["fng"] == [{"timestamp": str(T0 // 1000 + 180), "value": "40"}]
+    assert shifted["frame"]["data"] == {"E": T0 + 5 + 3 * MINUTE, "k": {"t": T0 + 3 * MINUTE, "T": T0 + 4 * MINUTE - 1,
+                                                                          "n": 42}}
+    assert fixtures.shift(payload, 0) is payload
+
+
+def test_time_params_reads_query_values_and_graphql_dates():
+    sent = {"variables": {"startDate": "2023-11-14", "exchange": "deribit"}}
+    times = fixtures.time_params({"startTime": str(T0), "symbol": "BTCUSDT", "limit": "1000"}, sent)
+    assert times == {"startTime": T0, "startDate": 1_699_920_000_000}
+
+
+def test_stub_serves_the_recording_with_the_same_parameters_and_nearest_time():
+    now = time.time()
+    starts = [T0 + page * 1000 * MINUTE for page in range(3)]
+    pages = [_exchange({"symbol": "BTCUSDT", "startTime": str(start)}, [[start] + [0] * 11], recorded_at=now)
+             for start in starts]
+    other = _exchange({"symbol": "ETHUSDT", "startTime": str(T0 + 1000 * MINUTE)}, "eth", recorded_at=now)
+    fixture_set = fixtures.FixtureSet(http=[*pages, other])
+
+    async def scenario(stub, client):
+        response = await client.get(KLINES_URL, params={"symbol": "BTCUSDT", "startTime": T0 + 1010 * MINUTE})
+        assert response.json()[0][0] == T0 + 1000 * MINUTE
+        response = await client.get(KLINES_URL, params={"symbol": "ETHUSDT", "startTime": T0})
+        assert response.json() == "eth"
+        response = await client.get("https://api.binance.com/api/v3/depth")
+        assert response.status_code == 404
+        return stub.stats
+
+    assert _serve(fixture_set, scenario) == {"served": 2, "unmatched": 1}
+
+
+def test_stub_shifts_replayed_bodies_by_the_time_since_recording():
+    fixture_set = fixtures.FixtureSet(http=[_exchange({}, [{"date": T0}], recorded_at=time.time() - 125)])
+
+    async def scenario(stub, client):
+        return (await client.get(KLINES_URL)).json()
+
+    assert _serve(fixture_set, scenario) == [{"date": T0 + 2 * MINUTE}]
+
+
+def test_stub_injects_errors_with_retry_after():
+    fixture_set = fixtures.FixtureSet(http=[_exchange({}, [], recorded_at=time.time())])
+    faults = stubs.Faults(error_rate=1.0, error_status=429, retry_after=7)
+
+    async def scenario(stub, client):
+        response = await client.get(KLINES_URL)
+        assert (response.status_code, response.headers["Retry-After"]) == (429, "7")
+        return stub.stats
+
+    assert _serve(fixture_set, scenario, faults) == {"injected_errors": 1}
+
+
+def test_stub_adds_latency():
+    fixture_set = fixtures.FixtureSet(http=[_exchange({}, [], recorded_at=time.time())])
+
+    async def scenario(stub, client):
+        started = time.perf_counter()
+        await asyncio.gather(*(client.get(KLINES_URL) for _ in range(4)))
+        return time.perf_counter() - started
+
+    # Concurrent requests are delayed side by side, not one after another
+    assert 0.2 <= _serve(fixture_set, scenario, stubs.Faults(latency=0.2)) < 0.6
+
+
+def test_recorded_exchanges_replay_through_the_stub(tmp_path):
+    def upstream(request):
+        return httpx.Response(200, json={"echo": request.url.params["symbol"], "date": T0},
+                              headers={"Content-Encoding": "identity", "X-MBX-USED-WEIGHT-1M": "2"})
+
+    async def record():
+        writer = fixtures.Writer(str(tmp_path))
+        transport = fixtures.RecordingTransport(writer, httpx.MockTransport(upstream))
+        async with httpx.AsyncClient(transport=transport) as client:
+            response = await client.get(KLINES_URL, params={"symbol": "BTCUSDT"})
+        assert response.json() == {"echo": "BTCUSDT", "date": T0}
+        return writer.counts
+
+    assert asyncio.run(record()) == {fixtures.HTTP: 1}
+    fixture_set = fixtures.load(str(tmp_path))
+    assert fixture_set.http[0]["query"] == {"symbol": "BTCUSDT"}
+    assert "Content-Encoding" not in fixture_set.http[0]["headers"]
+
+    async def scenario(stub, client):
+        response = await client.get(KLINES_URL, params={"symbol": "BTCUSDT"})
+        return response.json(), response.headers["X-MBX-USED-WEIGHT-1M"]
+
+    assert _serve(fixture_set, scenario) == ({"echo": "BTCUSDT", "date": T0}, "2")
+
+
+def test_deribit_stub_answers_calls_and_replays_subscriptions():
+    now = time.time()
+    fixture_set = fixtures.FixtureSet(
+        deribit_results=[{"method": "public/get_funding_chart_data", "params": {"instrument_name": "BTC-PERPETUAL"},
+                          "result": {"data": [{"timestamp": T0, "interest_8h": 0.1}]}, "recorded_at": now}],
+        deribit_notifications=[{"channel": "ticker.BTC-PERPETUAL.agg2", "data": {"timestamp": T0 + offset},
+                                "offset": offset, "recorded_at": now} for offset in range(2)],
+    )
+
+    async def main():
+        stub = stubs.DeribitStub(fixture_set)
+        client = deribit_ws.DeribitClient(await stub.start())
+        notifications = asyncio.Queue()
+        try:
+            result = await client.call("public/get_funding_chart_data", {"instrument_name": "BTC-PERPETUAL"})
+            assert result == {"data": [{"timestamp": T0, "interest_8h": 0.1}]}
+            with pytest.raises(deribit_ws.DeribitError) as error:
+                await client.call("public/get_instruments", {})
+            assert error.value.code == -32601
+            await client.subscribe(["ticker.BTC-PERPETUAL.agg2"],
+                                   lambda channel, data: notifications.put_nowait(data["timestamp"]))
+            return [await asyncio.wait_for(notifications.get(), 5) for _ in range(2)]
+        finally:
+            await client.close()
+            await stub.stop()
+
+    assert asyncio.run(main()) == [T0, T0 + 1]
+
+
+def test_binance_stream_stub_replays_only_the_requested_streams():
+    now = time.time()
+    fixture_set = fixtures.FixtureSet(binance_frames=[
+        {"frame": {"stream": stream, "data": {"k": {"t": T0}}}, "offset": 0, "recorded_at": now}
+        for stream in ("btcusdt@kline_1m", "ethusdt@kline_1m")
+    ])
+
+    async def main():
+        stub = stubs.BinanceStreamStub(fixture_set)
+        url = await stub.start()
+        try:
+            async with websockets.connect(f"{url}/stream?streams=ethusdt@kline_1m") as ws:
+                return json.loads(await asyncio.wait_for(ws.recv(), 5))
+        finally:
+            await stub.stop()
+
+    assert asyncio.run(main()) == {"stream": "ethusdt@kline_1m", "data": {"k": {"t": T0}}}
@@ -0,0 +1,142 @@
+"""Binance backfill: gap paging, the request-weight limiter and failed pages."""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, UTC
+
+import httpx
+
+from parsers import binance, binance_backfill
+
+T0 = datetime(2025, 1, 1, tzinfo=UTC)
+MINUTE = timedelta(minutes=1)
+
+
+def _ms(timestamp):
+    return int(timestamp.timestamp() * 1000)
+
+
+def test_pages_split_gaps_into_full_requests():
+    gaps = [(T0, T0 + 2499 * MINUTE), (T0 + 3000 * MINUTE, T0 + 3000 * MINUTE)]
+    pages = list(binance_backfill._pages(gaps, "1m"))
+    assert pages == [
+        (_ms(T0), _ms(T0 + 999 * MINUTE)),
+        (_ms(T0 + 1000 * MINUTE), _ms(T0 + 1999 * MINUTE)),
+        (_ms(T0 + 2000 * MINUTE), _ms(T0 + 2499 * MINUTE)),
+        # A single missing candle is a page of its own
+        (_ms(T0 + 3000 * MINUTE), _ms(T0 + 3000 * MINUTE)),
+    ]
+
+
+def test_pages_step_by_the_interval():
+    hour = timedelta(hours=1)
+    pages = list(binance_backfill._pages([(T0, T0 + 1500 * hour)], "1h"))
+    assert pages == [(_ms(T0), _ms(T0 + 999 * hour)), (_ms(T0 + 1000 * hour), _ms(T0 + 1500 * hour))]
+
+
+def test_find_gaps_asks_for_closed_candles_since_the_aligned_start(monkeypatch):
+    calls = []
+
+    class Connection:
+        async def fetch(self, query, *args):
+            calls.append((query, args))
+            return [{"gap_start": T0, "gap_end": T0 + MINUTE}]
+
+    @asynccontextmanager
+    async def acquire():
+        yield Connection()
+
+    monkeypatch.setattr(binance_backfill, "acquire", acquire)
+    since = datetime.now(UTC) - timedelta(hours=2, seconds=30)
+    gaps = asyncio.run(binance_backfill.find_gaps("btc", "5m", since=since))
+
+    assert gaps == [(T0, T0 + MINUTE)]
+    (query, (instrument, start, end, step)), = calls
+    assert "binance_ohlcv_5m" in query
+    assert instrument == "btc" and step == timedelta(minutes=5)
+    assert start <= since < start + step and start.timestamp() % 300 == 0
+    # The in-progress candle is left to the regular poll
+    assert end + 2 * step > datetime.now(UTC) >= end + step
+
+
+def test_find_gaps_is_empty_before_a_whole_candle_has_closed(monkeypatch):
+    monkeypatch.setattr(binance_backfill, "acquire", None)  # must not be reached
+    assert asyncio.run(binance_backfill.find_gaps("btc", "1h", since=datetime.now(UTC))) == []
+
+
+def test_weight_limiter_counts_weight_and_follows_the_server_header():
+    limiter = binance_backfill.WeightLimiter(limit=10)
+
+    async def main():
+        await limiter.acquire(4)
+        await limiter.acquire(4)
+        assert limiter.used == 8
+        # Other clients on the same IP spend weight too; the server's count wins when it is higher
+        limiter.update(httpx.Response(200, headers={"X-MBX-USED-WEIGHT-1M": "9"}))
+        assert limiter.used == 9
+        limiter.update(httpx.Response(200, headers={"X-MBX-USED-WEIGHT-1M": "2"}))
+        assert limiter.used == 9
+
+        # A new minute window starts from zero
+        limiter.window -= 1
+        await limiter.acquire(4)
+        assert limiter.used == 4
+
+    asyncio.run(main())
+
+
+def test_weight_limiter_pauses_every_caller_after_a_429():
+    limiter = binance_backfill.WeightLimiter()
+    before = time.time()
+    limiter.update(httpx.Response(429, headers={"Retry-After": "120"}))
+    assert limiter.paused_until >= before + 120
+    limiter.update(httpx.Response(418))
+    assert limiter.paused_until >= before + 120  # a shorter ban doesn't cut the pause short
+
+    limiter.paused_until = time.time() + 0.2
+    started = time.perf_counter()
+    asyncio.run(limiter.acquire(binance_backfill.KLINES_WEIGHT))
+    assert time.perf_counter() - started >= 0.19
+
+
+def test_pages_that_fail_to_store_are_counted_as_failed(monkeypatch, caplog):
+    gaps = [(T0, T0 + 1999 * MINUTE)]
+    stored = []
+
+    async def find_gaps(instrument, interval):
+        return gaps
+
+    async def get(url, params):
+        return httpx.Response(200, json=[[params["startTime"]]] * 3)
+
+    async def store_data(data, instrument, interval):
+        if data[0][0] == _ms(T0):
+            return False  # e.g. the database is down and the spool is disabled
+        stored.append(data)
+        return True
+
+    errors = []
+    monkeypatch.setattr(binance_backfill, "find_gaps", find_gaps)
+    monkeypatch.setattr(binance_backfill, "_limiter", binance_backfill.WeightLimiter())
+    monkeypatch.setattr(binance_backfill.http_client, "get", get)
+    monkeypatch.setattr(binance, "store_data", store_data)
+    monkeypatch.setattr(binance_backfill.metrics, "record_error",
+                        lambda source, instrument, phase: errors.append((source, instrument, phase)))
+
+    with caplog.at_level(logging.INFO, logger=binance_backfill.__name__):
+        asyncio.run(binance_backfill.backfill("btc"))
+
+    assert len(stored) == 1
+    assert "Backfilled 3 candles for btc 1m (1 failed requests)" in caplog.text
+    assert errors == [("binance", "btc", "backfill")]
+
+
+def test_store_data_reports_a_failed_write(monkeypatch):
+    async def write_records(*args, **kwargs):
+        raise ConnectionError("database unavailable")
+
+    monkeypatch.setattr(binance, "write_records", write_records)
+    candle = [_ms(T0), "1", "2", "0.5", "1.5", "10"]
+    assert asyncio.run(binance.store_data([candle], "btc")) is False
+    assert asyncio.run(binance.store_data([], "btc")) is True
@@ -0,0 +1,165 @@
+"""KlineStream against a local WebSocket stub that replays combined-stream kline frames."""
+import asyncio
+import json
+
+import pytest
+import websockets
+
+from parsers import binance_stream
+
+MINUTE = 60_000
+T0 = 1_700_000_040_000  # open time of a 1m candle, in ms
+
+
+def kline(symbol, open_time, close, closed=False):
+    """One combined-stream frame, as Binance sends it for <symbol>@kline_1m."""
+    return {
+        "stream": f"{symbol.lower()}@kline_1m",
+        "data": {"e": "kline", "s": symbol, "k": {
+            "t": open_time, "s": symbol, "i": "1m", "x": closed,
+            "o": "100", "h": "110", "l": "90", "c": str(close), "v": "5",
+        }},
+    }
+
+
+class StubBinance:
+    """Replays frames pushed by the test to the connected stream and records the request paths."""
+
+    def __init__(self):
+        self.paths = []
+        self.connections = []
+        self.server = None
+
+    async def __aenter__(self):
+        self.server = await websockets.serve(self._handle, "127.0.0.1", 0)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.server.close()
+        await self.server.wait_closed()
+
+    @property
+    def url(self):
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"ws://{host}:{port}/stream"
+
+    async def _handle(self, ws):
+        self.paths.append(ws.request.path)
+        self.connections.append(ws)
+        await ws.wait_closed()
+
+    async def replay(self, *frames):
+        for _ in range(500):
+            if self.connections:
+                break
+            await asyncio.sleep(0.01)
+        for frame in frames:
+            await self.connections[-1].send(frame if isinstance(frame, str) else json.dumps(frame))
+
+
+class Clock:
+    """Stands in for the time module in binance_stream so snapshot throttling is deterministic."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class Writer:
+    """Collects the batches write_records would have stored, failing the first `failures` calls."""
+
+    def __init__(self, failures=0):
+        self.batches = []
+        self.failures = failures
+
+    async def __call__(self, table, columns, records, update_columns=None):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("database unavailable")
+        self.batches.append(list(records))
+
+    def written(self):
+        return [(record[1], int(record[0].timestamp() * 1000), record[5]) for batch in self.batches for record in batch]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(binance_stream, "time", clock)
+    # Flushes are driven by the test
+    monkeypatch.setattr(binance_stream, "FLUSH_INTERVAL", 3600)
+    monkeypatch.setattr(binance_stream, "OPEN_SNAPSHOT_INTERVAL", 5)
+    return clock
+
+
+async def _until(condition):
+    for _ in range(500):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("the stream did not receive the replayed frames")
+
+
+def test_closed_candles_are_written_once_and_open_snapshots_are_throttled(monkeypatch, clock):
+    writer = Writer()
+    monkeypatch.setattr(binance_stream, "write_records", writer)
+
+    async def main():
+        async with StubBinance() as stub:
+            stream = binance_stream.KlineStream(["btc", "eth"], url=stub.url)
+            stream.start()
+            try:
+                await stub.replay(
+                    kline("BTCUSDT", T0, 1), kline("BTCUSDT", T0, 2),
+                    # Malformed frames are skipped without dropping the connection
+                    "[]", {"data": "not a kline"}, "not json",
+                    kline("BTCUSDT", T0, 3, closed=True), kline("ETHUSDT", T0, 30, closed=True),
+                    kline("BTCUSDT", T0 + MINUTE, 4),
+                )
+                await _until(lambda: "btc" in stream._open and stream._open["btc"][5] == 4)
+                await stream.flush()
+                assert sorted(writer.written()) == [
+                    ("btc", T0, 3), ("btc", T0 + MINUTE, 4), ("eth", T0, 30),
+                ]
+
+                await stub.replay(kline("BTCUSDT", T0 + MINUTE, 5))
+                await _until(lambda: stream._open["btc"][5] == 5)
+                clock.now += 1
+                await stream.flush()
+                assert len(writer.batches) == 1  # the snapshot isn't due yet
+
+                clock.now += binance_stream.OPEN_SNAPSHOT_INTERVAL
+                await stream.flush()
+                assert writer.batches[1:] == [[stream._open["btc"]]]
+
+                clock.now += binance_stream.OPEN_SNAPSHOT_INTERVAL
+                await stream.flush()
+                assert len(writer.batches) == 2  # nothing new since the last snapshot
+                assert len(stub.connections) == 1
+            finally:
+                await stream.close()
+
+        assert stub.paths == ["/stream?streams=btcusdt@kline_1m/ethusdt@kline_1m"]
+        closed = [entry for entry in writer.written() if entry[1] == T0]
+        assert sorted(closed) == [("btc", T0, 3), ("eth", T0, 30)]
+
+    asyncio.run(main())
+
+
+def test_closed_candles_survive_a_failed_write(monkeypatch, clock):
+    writer = Writer(failures=1)
+    monkeypatch.setattr(binance_stream, "write_records", writer)
+    stream = binance_stream.KlineStream(["btc"])
+
+    async def main():
+        stream.handle(kline("BTCUSDT", T0, 3, closed=True))
+        await stream.flush()
+        assert writer.batches == []
+        # Written on the next flush, together with a candle that closed meanwhile
+        stream.handle(kline("BTCUSDT", T0 + MINUTE, 7, closed=True))
+        await stream.flush()
+
+    asyncio.run(main())
+    assert sorted(writer.written()) == [("btc", T0, 3), ("btc", T0 + MINUTE, 7)]
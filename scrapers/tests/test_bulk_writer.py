@@ -0,0 +1,142 @@
+"""bulk_writer's write paths: repeated keys within a batch, the merge's row count and a real server."""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, UTC
+
+import pytest
+
+from db import bulk_writer, db_connection
+
+COLUMNS = ("time", "instrument", "price")
+T0 = datetime(2025, 1, 1, tzinfo=UTC)
+
+
+class Connection:
+    """Records what a write sends; executemany and COPY rows end up in `rows`."""
+
+    def __init__(self):
+        self.rows = []
+        self.statements = []
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+    async def execute(self, query, *args):
+        self.statements.append(query)
+        return f"INSERT 0 {len(self.rows)}"
+
+    async def executemany(self, query, records):
+        self.statements.append(query)
+        if query.startswith("INSERT"):
+            self.rows.extend(records)
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.rows.extend(records)
+
+
+def _write(monkeypatch, records, update_columns, threshold):
+    conn = Connection()
+
+    @asynccontextmanager
+    async def acquire():
+        yield conn
+
+    monkeypatch.setattr(bulk_writer, "acquire", acquire)
+    monkeypatch.setattr(bulk_writer, "NOTIFY_ENABLED", False)
+    monkeypatch.setattr(bulk_writer, "BULK_THRESHOLD", threshold)
+    latest = bulk_writer._latest_times(COLUMNS, records)
+    committed = asyncio.run(bulk_writer._write("prices", COLUMNS, records, ("time", "instrument"),
+                                               update_columns, latest))
+    return conn, committed
+
+
+def _batch():
+    # Two versions of (T0, btc), interleaved with other keys
+    return [(T0, "btc", 1.0), (T0, "eth", 5.0), (T0 + timedelta(minutes=1), "btc", 2.0), (T0, "btc", 3.0)]
+
+
+@pytest.mark.parametrize("update_columns, kept", [(("price",), 3.0), (None, 1.0)])
+def test_staged_batches_keep_the_row_executemany_would(monkeypatch, update_columns, kept):
+    conn, committed = _write(monkeypatch, _batch(), update_columns, threshold=1)
+    assert conn.rows == [(T0, "btc", kept), (T0, "eth", 5.0), (T0 + timedelta(minutes=1), "btc", 2.0)]
+    assert committed == 3
+    assert any("SELECT time, instrument, price FROM _staging_prices ON CONFLICT" in query
+               for query in conn.statements)
+
+
+def test_small_batches_go_row_by_row(monkeypatch):
+    conn, committed = _write(monkeypatch, _batch(), ("price",), threshold=100)
+    assert conn.rows == _batch()
+    assert committed == 4
+
+
+@pytest.mark.parametrize("status, committed", [
+    ("INSERT 0 42", 42),
+    ("INSERT 0 0", 0),
+    ("INSERT", 7),
+    ("", 7),
+    (None, 7),
+    ("INSERT 0 many", 7),
+])
+def test_the_merge_count_comes_from_the_command_status(status, committed):
+    assert bulk_writer._inserted_rows(status, 7) == committed
+
+
+def test_a_merge_without_a_row_count_counts_every_staged_row(monkeypatch):
+    async def execute(self, query, *args):
+        return "INSERT"
+
+    monkeypatch.setattr(Connection, "execute", execute)
+    _, committed = _write(monkeypatch, _batch(), ("price",), threshold=1)
+    assert committed == 3
+
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+TABLE = "bulk_writer_test"
+
+
+@pytest.mark.skipif(not DATABASE_URL, reason="needs a PostgreSQL server in DATABASE_URL")
+def test_staged_merges_against_a_real_server(monkeypatch):
+    monkeypatch.setattr(db_connection, "DB_URL", DATABASE_URL)
+    # A single connection, so the session-scoped staging table is the one the writes used
+    monkeypatch.setattr(db_connection, "POOL_MIN_SIZE", 1)
+    monkeypatch.setattr(db_connection, "POOL_MAX_SIZE", 1)
+    monkeypatch.setattr(bulk_writer, "BULK_THRESHOLD", 1)
+    monkeypatch.setattr(bulk_writer, "_queries", {})
+    minute = timedelta(minutes=1)
+
+    async def write(records, update_columns):
+        latest = bulk_writer._latest_times(COLUMNS, records)
+        return await bulk_writer._write(TABLE, COLUMNS, records, ("time", "instrument"), update_columns, latest)
+
+    async def main():
+        async with db_connection.acquire() as conn:
+            await conn.execute(f"DROP TABLE IF EXISTS {TABLE};")
+            await conn.execute(f"CREATE TABLE {TABLE} (time TIMESTAMPTZ NOT NULL, instrument TEXT NOT NULL, "
+                               f"price DOUBLE PRECISION, PRIMARY KEY (time, instrument));")
+        try:
+            results = [
+                await write(_batch(), ("price",)),
+                # Two new keys and one stored one, which DO NOTHING leaves alone
+                await write([(T0, "btc", 9.0), (T0 + 2 * minute, "btc", 4.0), (T0 + 2 * minute, "eth", 6.0)], None),
+                # Every key stored already, so DO UPDATE reports all of them
+                await write([(T0, "btc", 10.0), (T0, "eth", 11.0)], ("price",)),
+            ]
+            async with db_connection.acquire() as conn:
+                rows = await conn.fetch(f"SELECT time, instrument, price FROM {TABLE} ORDER BY time, instrument;")
+                # ON COMMIT DELETE ROWS: the staging table outlives the transactions but not their rows
+                staged = await conn.fetchval(f"SELECT count(*) FROM _staging_{TABLE};")
+                await conn.execute(f"DROP TABLE _staging_{TABLE};")
+            return results, [tuple(row) for row in rows], staged
+        finally:
+            async with db_connection.acquire() as conn:
+                await conn.execute(f"DROP TABLE IF EXISTS {TABLE};")
+            await db_connection.close_pool()
+
+    results, rows, staged = asyncio.run(main())
+    assert results == [3, 2, 2]
+    assert rows == [(T0, "btc", 10.0), (T0, "eth", 11.0), (T0 + minute, "btc", 2.0),
+                    (T0 + 2 * minute, "btc", 4.0), (T0 + 2 * minute, "eth", 6.0)]
+    assert staged == 0
@@ -0,0 +1,116 @@
+"""Record construction: ColumnSpec and the parsers' converters against the per-entry loops they replaced."""
+import random
+from datetime import datetime, UTC
+
+import pytest
+
+from core import columns_benchmark
+from core.columns import Column, ColumnSpec
+from parsers import alternative, amberdata, binance, deribit
+
+MS = 1_700_000_000_000
+WHEN = datetime.fromtimestamp(MS / 1000, UTC)
+
+
+def _convert(module, data):
+    if module is alternative:
+        return alternative.convert(data)
+    if hasattr(module, "convert"):
+        return module.convert(data, "btc")
+    return module.SPEC.convert(data, instrument="btc")
+
+
+@pytest.mark.parametrize("source", list(columns_benchmark.SOURCES))
+def test_converter_matches_the_per_entry_loop(source):
+    module, make, legacy = columns_benchmark.SOURCES[source]
+    random.seed(source)
+    data = [make(i) for i in range(2000)]
+    malformed = random.sample(range(len(data)), 40)
+    for i in malformed:
+        data[i] = columns_benchmark._malform(data[i])
+
+    converted = _convert(module, data)
+    expected = legacy(data, "btc")
+    columns_benchmark._same(expected, converted.records, source)
+    assert converted.skipped == len(data) - len(expected)
+    assert converted.sample == data[min(malformed)]
+
+
+@pytest.mark.parametrize("epoch", [1e20, -1e20, "nan", "inf", float("-inf")])
+def test_unrepresentable_timestamps_are_skipped(epoch):
+    keyed = [{"timestamp": MS, "index_price": 1.0}, {"timestamp": epoch, "index_price": 2.0}]
+    converted = deribit.SPEC.convert(keyed, instrument="btc")
+    assert converted.records == [(WHEN, "btc", 1.0, None)]
+    assert (converted.skipped, converted.reason) == (1, "bad or missing time")
+
+    candle = [MS, "1", "2", "0.5", "1.5", "10"]
+    converted = binance.convert([candle, [epoch, *candle[1:]]], "btc")
+    assert converted.records == [(WHEN, "btc", 1.0, 2.0, 0.5, 1.5, 10.0)]
+    assert converted.skipped == 1
+
+    daily = {"value": "50", "value_classification": "Neutral"}
+    converted = alternative.convert([{"timestamp": str(MS // 1000), **daily}, {"timestamp": epoch, **daily}])
+    assert converted.records == [(WHEN, 50, "Neutral")]
+    assert converted.skipped == 1
+
+
+def test_optional_floats_pass_through_and_required_values_are_checked():
+    spec = ColumnSpec(
+        Column("time", "t", "ms"),
+        Column("instrument"),
+        Column("count", "n", "int", required=True),
+        Column("label", "l", "str"),
+        Column("a", "a"),
+        Column("b", "b"),
+    )
+    entries = [
+        {"t": MS, "n": "3", "l": 7, "a": 1.5},
+        {"t": MS, "n": None, "l": "x", "a": 2.0, "b": 3.0},
+        {"t": MS, "n": "4", "l": None, "a": None, "b": "raw"},
+        ["not", "a", "dict"],
+    ]
+    converted = spec.convert(entries, instrument="eth")
+    assert converted.records == [(WHEN, "eth", 3, "7", 1.5, None), (WHEN, "eth", 4, None, None, "raw")]
+    assert converted.skipped == 2
+    assert (converted.sample, converted.reason) == (["not", "a", "dict"], "expected a dict")
+
+
+def test_repeated_and_unsorted_timestamps():
+    spec = ColumnSpec(Column("time", "t", "s"), Column("v", "v"))
+    times = [30, 10, 10, 20, 30]
+    records = spec.convert([{"t": t, "v": i} for i, t in enumerate(times)]).records
+    assert [record[0] for record in records] == [datetime.fromtimestamp(t, UTC) for t in times]
+    assert [record[1] for record in records] == list(range(5))
+
+
+def test_amberdata_days_to_expiration_is_nullable():
+    surface = {column.key: 0.1 for column in amberdata.SPEC.columns[3:]}
+    entries = [
+        {"date": MS, "daysToExpiration": 7, **surface},
+        {"date": MS, "daysToExpiration": None, **surface},
+        {"date": MS, **surface},
+    ]
+    converted = amberdata.SPEC.convert(entries, instrument="btc")
+    assert converted.skipped == 0
+    assert [record[2] for record in converted.records] == [7, None, None]
+    assert all(record[3:] == (0.1,) * len(surface) for record in converted.records)
+
+
+def test_alternative_skips_missing_classification():
+    converted = alternative.convert([
+        {"timestamp": "1700000000", "value": "10", "value_classification": None},
+        {"timestamp": "1700000000", "value": "x", "value_classification": "Fear"},
+        {"timestamp": "1700000000", "value": "20", "value_classification": "Fear"},
+    ])
+    assert converted.records == [(WHEN, 20, "Fear")]
+    assert converted.skipped == 2
+
+
+def test_unknown_column_type():
+    with pytest.raises(ValueError):
+        Column("x", "x", "decimal")
+
+
+def test_empty_batch():
+    converted = deribit.SPEC.convert([], instrument="btc")
+    assert (converted.records, converted.skipped) == ([], 0)
@@ -0,0 +1,125 @@
+"""DeribitClient against a local WebSocket stub speaking Deribit's JSON-RPC."""
+import asyncio
+import json
+
+import pytest
+import websockets
+
+from clients import deribit_ws
+
+CHANNEL = "ticker.BTC-PERPETUAL.100ms"
+
+
+class StubDeribit:
+    """Answers every request, records them, and lets a test push notifications or drop the connection."""
+
+    def __init__(self):
+        self.requests = asyncio.Queue()  # (connection number, method, params)
+        self.connections = []
+        self.server = None
+
+    async def __aenter__(self):
+        self.server = await websockets.serve(self._handle, "127.0.0.1", 0)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.server.close()
+        await self.server.wait_closed()
+
+    @property
+    def url(self):
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"ws://{host}:{port}"
+
+    async def _handle(self, ws):
+        self.connections.append(ws)
+        number = len(self.connections)
+        async for message in ws:
+            request = json.loads(message)
+            method, params = request["method"], request["params"]
+            await self.requests.put((number, method, params))
+            if method == "public/fail":
+                await ws.send(json.dumps({"id": request["id"], "error": {"code": 10009, "message": "not_allowed"}}))
+            else:
+                await ws.send(json.dumps({"id": request["id"], "result": {"method": method}}))
+
+    async def next_request(self, method):
+        """The next recorded request for method, skipping others."""
+        while True:
+            number, received, params = await asyncio.wait_for(self.requests.get(), 5)
+            if received == method:
+                return number, params
+
+    async def notify(self, method, params):
+        await self.connections[-1].send(json.dumps({"jsonrpc": "2.0", "method": method, "params": params}))
+
+
+def _run(scenario):
+    async def main():
+        async with StubDeribit() as stub:
+            client = deribit_ws.DeribitClient(stub.url)
+            try:
+                await scenario(stub, client)
+            finally:
+                await client.close()
+    asyncio.run(main())
+
+
+def test_call_matches_responses_and_errors():
+    async def scenario(stub, client):
+        results = await asyncio.gather(*(client.call(f"public/m{index}") for index in range(5)))
+        assert [result["method"] for result in results] == [f"public/m{index}" for index in range(5)]
+        with pytest.raises(deribit_ws.DeribitError) as error:
+            await client.call("public/fail")
+        assert error.value.code == 10009
+
+    _run(scenario)
+
+
+def test_heartbeat_test_request_is_answered():
+    async def scenario(stub, client):
+        await client.call("public/get_time")
+        _, params = await stub.next_request("public/set_heartbeat")
+        assert params == {"interval": deribit_ws.HEARTBEAT_INTERVAL}
+        await stub.notify("heartbeat", {"type": "test_request"})
+        await stub.next_request("public/test")
+
+    _run(scenario)
+
+
+def test_failing_callback_does_not_end_the_session():
+    async def scenario(stub, client):
+        received = []
+
+        def callback(channel, data):
+            if data["bad"]:
+                raise KeyError("mark_price")
+            received.append((channel, data))
+
+        await client.subscribe([CHANNEL], callback)
+        await stub.next_request("public/subscribe")
+        await stub.notify("subscription", {"channel": CHANNEL, "data": {"bad": True}})
+        await stub.notify("subscription", {"channel": CHANNEL, "data": {"bad": False}})
+        # Still answering on the first connection
+        assert (await client.call("public/get_time"))["method"] == "public/get_time"
+        assert received == [(CHANNEL, {"bad": False})]
+        assert len(stub.connections) == 1
+
+    _run(scenario)
+
+
+def test_reconnect_restores_subscriptions(monkeypatch):
+    monkeypatch.setattr(deribit_ws, "RECONNECT_MIN_DELAY", 0.01)
+
+    async def scenario(stub, client):
+        await client.subscribe([CHANNEL], lambda channel, data: None)
+        number, _ = await stub.next_request("public/subscribe")
+        assert number == 1
+        await stub.connections[0].close()
+
+        number, params = await stub.next_request("public/subscribe")
+        assert number == 2
+        assert params == {"channels": [CHANNEL]}
+        assert (await client.call("public/get_time"))["method"] == "public/get_time"
+
+    _run(scenario)
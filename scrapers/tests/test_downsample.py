@@ -0,0 +1,129 @@
+"""Vectorised downsampling against straightforward per-row reference implementations."""
+import math
+
+import numpy as np
+
+from core import downsample
+
+
+def _candles(count, seed=0):
+    """1m candles with gaps and occasional missing high/low/volume."""
+    rng = np.random.default_rng(seed)
+    times = 1_700_000_000 + np.cumsum(rng.choice([60, 60, 60, 120, 3600], count))
+    close = 35000 + np.cumsum(rng.normal(0, 20, count))
+    open_ = close + rng.normal(0, 5, count)
+    high = np.maximum(open_, close) + rng.uniform(0, 10, count)
+    low = np.minimum(open_, close) - rng.uniform(0, 10, count)
+    volume = rng.uniform(0, 50, count)
+    for column in (high, low, volume):
+        column[rng.random(count) < 0.05] = np.nan
+    return times, open_, high, low, close, volume
+
+
+def _naive_buckets(times, open_, high, low, close, volume, resolution):
+    buckets = {}
+    for row in zip(times.tolist(), open_, high, low, close, volume):
+        buckets.setdefault(math.floor(row[0] / resolution) * resolution, []).append(row)
+    result = []
+    for start, rows in buckets.items():
+        highs = [row[2] for row in rows if not math.isnan(row[2])]
+        lows = [row[3] for row in rows if not math.isnan(row[3])]
+        result.append((
+            start,
+            rows[0][1],
+            max(highs) if highs else math.nan,
+            min(lows) if lows else math.nan,
+            rows[-1][4],
+            sum(row[5] for row in rows if not math.isnan(row[5])),
+        ))
+    return result
+
+
+def _naive_lttb(x, y, threshold):
+    """Textbook LTTB over the series' rows, each series scaled to [0, 1] and their triangle areas summed."""
+    n = len(x)
+    columns = []
+    for column in y.T.tolist():
+        present = [value for value in column if not math.isnan(value)]
+        low, high = (min(present), max(present)) if present else (math.nan, math.nan)
+        span = high - low if high - low > 0 else 1
+        columns.append([(value - low) / span for value in column])
+
+    def mean(values):
+        present = [value for value in values if not math.isnan(value)]
+        return sum(present) / len(present) if present else math.nan
+
+    every = (n - 2) / (threshold - 2)
+    edges = [int(k * every) + 1 for k in range(threshold - 1)]
+    edges[-1] = n - 1
+    selected = [0]
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = sum(x[end:edges[i + 2]]) / (edges[i + 2] - end)
+            next_ys = [mean(column[end:edges[i + 2]]) for column in columns]
+        else:
+            next_x, next_ys = x[n - 1], [column[n - 1] for column in columns]
+        best, best_area = start, -1.0
+        for b in range(start, end):
+            area = 0.0
+            for column, next_y in zip(columns, next_ys):
+                triangle = abs((x[a] - next_x) * (column[b] - column[a]) - (x[a] - x[b]) * (next_y - column[a]))
+                if not math.isnan(triangle):
+                    area += triangle
+            if area > best_area:
+                best, best_area = b, area
+        a = best
+        selected.append(a)
+    selected.append(n - 1)
+    return selected
+
+
+def test_bucket_ohlcv_matches_naive_aggregation():
+    candles = _candles(5000)
+    for resolution in (300, 3600, 86400):
+        actual = list(zip(*(column.tolist() for column in downsample.bucket_ohlcv(*candles, resolution))))
+        expected = _naive_buckets(*candles, resolution)
+        assert len(actual) == len(expected)
+        for got, want in zip(actual, expected):
+            assert got[:2] == want[:2] and got[4] == want[4]
+            for got_value, want_value in zip(got[2:4], want[2:4]):
+                assert got_value == want_value or (math.isnan(got_value) and math.isnan(want_value))
+            assert math.isclose(got[5], want[5], rel_tol=1e-12, abs_tol=1e-9)
+
+
+def test_bucket_ohlcv_empty():
+    assert all(column.size == 0 for column in downsample.bucket_ohlcv([], [], [], [], [], [], 300))
+
+
+def test_lttb_matches_naive_single_series():
+    rng = np.random.default_rng(1)
+    x = np.sort(rng.uniform(0, 1e6, 3000))
+    y = np.cumsum(rng.normal(0, 1, 3000))
+    for threshold in (3, 10, 500, 2999):
+        assert downsample.lttb_indices(x, y, threshold).tolist() == _naive_lttb(x.tolist(), y[:, None], threshold)
+
+
+def test_lttb_matches_naive_multi_series_with_gaps():
+    rng = np.random.default_rng(2)
+    x = np.arange(2000, dtype=np.float64) * 60
+    y = np.cumsum(rng.normal(0, 1, (2000, 3)), axis=0) * [1, 100, 0.01]
+    y[rng.random(2000) < 0.1, 1] = np.nan
+    # A series without any data contributes nothing
+    y = np.column_stack([y, np.full(2000, np.nan)])
+    assert downsample.lttb_indices(x, y, 400).tolist() == _naive_lttb(x.tolist(), y, 400)
+
+
+def test_lttb_keeps_everything_below_the_threshold():
+    x = np.arange(10.0)
+    assert downsample.lttb_indices(x, x, 10).tolist() == list(range(10))
+    assert downsample.lttb_indices(x, x, 2).tolist() == list(range(10))
+
+
+def test_choose_resolution_is_the_finest_that_fits():
+    week = 7 * 86400
+    assert downsample.choose_resolution(week, 1000) == 900
+    assert downsample.choose_resolution(week, 20000) == 60
+    assert downsample.choose_resolution(week, 20000, base=300) == 300
+    assert downsample.choose_resolution(365 * 86400, 10) == downsample.RESOLUTIONS[-1]
@@ -0,0 +1,118 @@
+"""Conditional GETs: validators are sent once a payload is stored, and unchanged payloads are skipped."""
+import asyncio
+from datetime import datetime, timedelta, UTC
+
+import httpx
+import pytest
+
+from clients import breaker, http_cache, http_client
+from parsers import laevitas
+
+URL = "https://upstream.test/skew?start=2025-01-01"
+
+
+class Upstream:
+    """Serves `body` with an ETag and Last-Modified, answering 304 when asked with the current ETag."""
+
+    def __init__(self, conditional=True):
+        self.conditional = conditional
+        self.body = b'{"points": [1]}'
+        self.etag = '"v1"'
+        self.requests = []
+
+    async def __call__(self, request):
+        self.requests.append(request)
+        if self.conditional and request.headers.get("If-None-Match") == self.etag:
+            return httpx.Response(304)
+        headers = {"ETag": self.etag, "Last-Modified": "Wed, 01 Jan 2025 00:00:00 GMT"} if self.conditional else {}
+        return httpx.Response(200, content=self.body, headers=headers)
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    upstream = Upstream()
+    monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(upstream)))
+    monkeypatch.setattr(http_client, "_host_semaphores", {})
+    monkeypatch.setattr(breaker, "_breakers", {})
+    monkeypatch.setattr(http_cache, "_entries", type(http_cache._entries)())
+    monkeypatch.setattr(http_cache, "ENABLED", True)
+    return upstream
+
+
+def _get(url=URL):
+    return asyncio.run(http_cache.get(url, "laevitas", "btc", headers={"Accept": "application/json"}))
+
+
+def test_validators_are_only_sent_after_the_payload_was_stored(upstream):
+    assert _get().status_code == 200
+    assert _get().status_code == 200  # not remembered: the store failed, so parse it again
+    assert all("If-None-Match" not in request.headers for request in upstream.requests)
+
+    http_cache.remember(URL, _get())
+    assert _get() is None
+    request = upstream.requests[-1]
+    assert request.headers["If-None-Match"] == '"v1"'
+    assert request.headers["If-Modified-Since"] == "Wed, 01 Jan 2025 00:00:00 GMT"
+    assert request.headers["Accept"] == "application/json"
+
+
+def test_a_changed_payload_is_returned_and_replaces_the_entry(upstream):
+    http_cache.remember(URL, _get())
+    upstream.body, upstream.etag = b'{"points": [1, 2]}', '"v2"'
+    response = _get()
+    assert response.content == b'{"points": [1, 2]}'
+    http_cache.remember(URL, response)
+    assert _get() is None
+
+
+def test_an_identical_body_is_skipped_without_validators(upstream):
+    upstream.conditional = False
+    http_cache.remember(URL, _get())
+    assert _get() is None
+    upstream.body = b'{"points": [3]}'
+    assert _get().content == b'{"points": [3]}'
+
+
+def test_failed_responses_are_not_remembered(upstream):
+    http_cache.remember(URL, httpx.Response(503, content=upstream.body))
+    assert URL not in http_cache._entries
+
+
+def test_least_recently_used_entries_are_evicted(upstream, monkeypatch):
+    monkeypatch.setattr(http_cache, "MAX_ENTRIES", 2)
+    urls = [f"{URL}&page={page}" for page in range(3)]
+    for url in urls[:2]:
+        http_cache.remember(url, _get(url))
+    assert _get(urls[0]) is None  # touching it makes urls[1] the oldest
+    http_cache.remember(urls[2], _get(urls[2]))
+    assert list(http_cache._entries) == [urls[0], urls[2]]
+
+
+def test_disabled_cache_always_fetches(upstream, monkeypatch):
+    monkeypatch.setattr(http_cache, "ENABLED", False)
+    http_cache.remember(URL, _get())
+    assert _get().status_code == 200
+    assert "If-None-Match" not in upstream.requests[-1].headers
+
+
+def test_laevitas_skips_a_payload_only_once_it_was_stored(upstream, monkeypatch):
+    upstream.body = b'[{"date": 1735689600000, "7": 1.5}]'
+    stores = iter([False, True])
+    parsed = []
+
+    async def latest_timestamp(table, instrument):
+        return datetime.now(UTC) - timedelta(days=1)
+
+    async def store_data(data, instrument, since=None):
+        parsed.append(data)
+        return next(stores)
+
+    monkeypatch.setattr(laevitas.watermarks, "latest_timestamp", latest_timestamp)
+    monkeypatch.setattr(laevitas, "BASE_URL", "https://upstream.test/skew")
+    monkeypatch.setattr(laevitas, "store_data", store_data)
+
+    for _ in range(3):
+        asyncio.run(laevitas.fetch_data("btc"))
+    # The failed store is parsed again; after the successful one the upstream answers 304
+    assert len(parsed) == 2
+    assert len(upstream.requests) == 3
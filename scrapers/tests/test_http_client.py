@@ -0,0 +1,221 @@
+"""The shared client: concurrent fetches overlap, and failing hosts trip breakers and spend retry budgets."""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+import pytest
+from aiohttp import web
+
+from clients import breaker, http_client
+
+LATENCY = 0.3
+
+
+class Upstream:
+    """Counts the requests the local stub is answering at once."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.peak = 0
+
+
+@asynccontextmanager
+async def _stub_server(upstream):
+    """A local upstream whose every endpoint answers after LATENCY seconds; yields its base URL."""
+    async def slow(request):
+        upstream.in_flight += 1
+        upstream.peak = max(upstream.peak, upstream.in_flight)
+        try:
+            await asyncio.sleep(LATENCY)
+        finally:
+            upstream.in_flight -= 1
+        return web.json_response({"path": request.path})
+
+    app = web.Application()
+    app.router.add_get("/slow/{name}", slow)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    try:
+        yield f"http://{host}:{port}"
+    finally:
+        await http_client.close_client()
+        await runner.cleanup()
+
+
+async def _fetch_all(count):
+    """Fetch count slow endpoints at once; returns the most the stub answered concurrently."""
+    upstream = Upstream()
+    async with _stub_server(upstream) as base:
+        responses = await asyncio.gather(*(http_client.get(f"{base}/slow/{index}") for index in range(count)))
+    assert [response.json()["path"] for response in responses] == [f"/slow/{index}" for index in range(count)]
+    return upstream.peak
+
+
+def test_slow_endpoints_are_fetched_side_by_side():
+    assert asyncio.run(_fetch_all(http_client.PER_HOST_LIMIT)) == http_client.PER_HOST_LIMIT
+
+
+def test_requests_beyond_the_per_host_limit_wait_for_a_slot():
+    assert asyncio.run(_fetch_all(2 * http_client.PER_HOST_LIMIT)) == http_client.PER_HOST_LIMIT
+
+
+URL = "https://upstream.test/data"
+HOST = "upstream.test"
+
+
+class MockUpstream:
+    """Answers the shared client's requests with whatever handler the test installs."""
+
+    def __init__(self):
+        self.requests = []
+        self.handler = None
+
+    async def __call__(self, request):
+        self.requests.append(request)
+        return await self.handler(request)
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Route the shared client to a MockUpstream, with fresh breakers and host state."""
+    mock = MockUpstream()
+    monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(mock)))
+    monkeypatch.setattr(http_client, "_host_semaphores", {})
+    monkeypatch.setattr(http_client, "_host_failures", {})
+    monkeypatch.setattr(http_client, "_host_retry_after", {})
+    monkeypatch.setattr(breaker, "_breakers", {})
+    monkeypatch.setattr(http_client, "RETRY_BASE_DELAY", 0)
+    return mock
+
+
+def _status(code, headers=None):
+    async def handler(request):
+        return httpx.Response(code, headers=headers, json={})
+    return handler
+
+
+def test_breaker_opens_after_the_failure_threshold_and_fails_fast(upstream, monkeypatch):
+    monkeypatch.setattr(breaker, "FAILURES", 2)
+    monkeypatch.setattr(http_client, "RETRY_ATTEMPTS", 1)
+    upstream.handler = _status(503)
+
+    async def main():
+        for _ in range(2):
+            assert (await http_client.get(URL)).status_code == 503
+        assert breaker.get(HOST).state == breaker.OPEN
+        assert http_client.circuit_open(HOST) is not None
+        with pytest.raises(http_client.CircuitOpenError):
+            await http_client.get(URL)
+
+    asyncio.run(main())
+    assert len(upstream.requests) == 2
+
+
+def test_half_open_breaker_lets_one_probe_through_and_closes_on_success(upstream, monkeypatch):
+    monkeypatch.setattr(breaker, "FAILURES", 1)
+    monkeypatch.setattr(http_client, "RETRY_ATTEMPTS", 1)
+    release = None
+
+    async def slow_ok(request):
+        await release.wait()
+        return httpx.Response(200, json={})
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        upstream.handler = _status(503)
+        await http_client.get(URL)
+        host_breaker = breaker.get(HOST)
+        assert host_breaker.state == breaker.OPEN
+
+        # Cooldown over: the next request is the probe, and nothing else goes out while it is in flight
+        host_breaker.open_until = 0
+        upstream.handler = slow_ok
+        probe = asyncio.create_task(http_client.get(URL))
+        await asyncio.sleep(0.01)
+        assert host_breaker.state == breaker.HALF_OPEN
+        with pytest.raises(http_client.CircuitOpenError):
+            await http_client.get(URL)
+        release.set()
+        assert (await probe).status_code == 200
+        assert host_breaker.state == breaker.CLOSED
+        assert (await http_client.get(URL)).status_code == 200
+
+    asyncio.run(main())
+    assert len(upstream.requests) == 3
+
+
+def test_failed_probe_reopens_the_breaker_with_a_longer_cooldown(upstream, monkeypatch):
+    monkeypatch.setattr(breaker, "FAILURES", 1)
+    monkeypatch.setattr(http_client, "RETRY_ATTEMPTS", 1)
+    upstream.handler = _status(503)
+
+    async def main():
+        await http_client.get(URL)
+        host_breaker = breaker.get(HOST)
+        cooldown = host_breaker.cooldown
+        host_breaker.open_until = 0
+        await http_client.get(URL)
+        assert host_breaker.state == breaker.OPEN
+        assert host_breaker.cooldown == 2 * cooldown
+
+    asyncio.run(main())
+
+
+def test_retries_stop_once_the_retry_budget_is_spent(upstream):
+    upstream.handler = _status(503)
+
+    async def main():
+        host_breaker = breaker.get(HOST)
+        host_breaker.retry_tokens = 1
+        # Allowed: 1.2 tokens, one retry spends 1; the second retry finds 0.4 and is denied
+        assert (await http_client.get(URL)).status_code == 503
+        return host_breaker
+
+    host_breaker = asyncio.run(main())
+    assert len(upstream.requests) == 2 < http_client.RETRY_ATTEMPTS
+    assert (host_breaker.retries, host_breaker.retries_denied) == (1, 1)
+
+
+def test_retries_within_the_budget_recover_from_a_failure(upstream):
+    responses = iter([503, 200])
+
+    async def flaky(request):
+        return httpx.Response(next(responses), json={})
+
+    upstream.handler = flaky
+    response = asyncio.run(http_client.get(URL))
+    assert response.status_code == 200
+    assert len(upstream.requests) == 2
+    assert http_client.host_status(HOST) == (0, None)
+
+
+def test_retry_after_is_waited_out_before_retrying(upstream):
+    responses = iter([(429, {"Retry-After": "1"}), (200, None)])
+
+    async def limited(request):
+        code, headers = next(responses)
+        return httpx.Response(code, headers=headers, json={})
+
+    upstream.handler = limited
+    started = time.perf_counter()
+    response = asyncio.run(http_client.get(URL))
+    assert response.status_code == 200
+    assert time.perf_counter() - started >= 1
+
+
+def test_retry_after_beyond_the_max_delay_gives_up_and_defers_the_host(upstream):
+    retry_after = int(http_client.RETRY_MAX_DELAY) + 60
+    upstream.handler = _status(429, {"Retry-After": str(retry_after)})
+    started = time.time()
+    response = asyncio.run(http_client.get(URL))
+    assert response.status_code == 429
+    assert len(upstream.requests) == 1
+    failures, retry_at = http_client.host_status(HOST)
+    assert failures == 1
+    # The scheduler reads this to push the job's next run past the host's window
+    assert retry_at >= started + retry_after
@@ -0,0 +1,168 @@
+"""AdaptiveScheduler: fan-out jitter and when a job is armed to run next."""
+import asyncio
+import time
+from datetime import datetime, timedelta, UTC
+
+import pytest
+
+from clients import breaker, http_client
+from core import scheduler
+
+
+class FakeAPScheduler:
+    def __init__(self):
+        self.jobs = {}
+
+    def add_job(self, func, trigger, run_date, args, id, **kwargs):
+        self.jobs[id] = run_date
+
+
+def _adaptive(monkeypatch, jitter=0.0):
+    monkeypatch.setattr(scheduler, "JITTER_SECONDS", jitter)
+    monkeypatch.setattr(scheduler, "STARTUP_STAGGER_SECONDS", 0)
+    return scheduler.AdaptiveScheduler(FakeAPScheduler())
+
+
+def test_instruments_of_one_job_are_jittered_apart(monkeypatch):
+    adaptive = _adaptive(monkeypatch, jitter=1)
+    calls = []
+
+    async def fetch(instrument):
+        calls.append((instrument, asyncio.get_running_loop().time()))
+
+    delays = iter([0.2, 0.0, 0.1])
+    job = adaptive.add("source", fetch, poll_interval=timedelta(minutes=1), instruments=["a", "b", "c"])
+    monkeypatch.setattr(scheduler.random, "uniform", lambda low, high: next(delays))
+    asyncio.run(adaptive._execute(job))
+
+    assert [instrument for instrument, _ in calls] == ["b", "c", "a"]
+    times = [at for _, at in calls]
+    assert times[1] - times[0] >= 0.09 and times[2] - times[1] >= 0.09
+
+
+def test_a_single_instrument_is_not_delayed_again(monkeypatch):
+    adaptive = _adaptive(monkeypatch, jitter=60)
+    called = []
+
+    async def fetch(instrument):
+        called.append(instrument)
+
+    job = adaptive.add("source", fetch, poll_interval=timedelta(minutes=1), instruments=["a"])
+    asyncio.run(asyncio.wait_for(adaptive._execute(job), 1))
+    assert called == ["a"]
+
+
+URL = "https://upstream.test/data"
+HOST = "upstream.test"
+POLL = timedelta(minutes=1)
+NOW = datetime(2025, 1, 1, tzinfo=UTC)
+
+
+class FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return NOW
+
+
+def _next_run(adaptive, job):
+    """How long after NOW the job is armed; jitter is 0, so the delay is exact."""
+    return asyncio.run(adaptive._next_run(job)) - NOW
+
+
+@pytest.fixture
+def hosts(monkeypatch):
+    monkeypatch.setattr(http_client, "_host_failures", {})
+    monkeypatch.setattr(http_client, "_host_retry_after", {})
+    monkeypatch.setattr(breaker, "_breakers", {})
+
+
+@pytest.fixture
+def frozen(monkeypatch):
+    """Stop the clock at NOW for the scheduler, the breakers and Retry-After deadlines."""
+    monkeypatch.setattr(scheduler, "datetime", FrozenDatetime)
+    monkeypatch.setattr(time, "time", NOW.timestamp)
+
+
+def test_a_healthy_job_runs_again_after_its_poll_interval(monkeypatch, hosts, frozen):
+    adaptive = _adaptive(monkeypatch)
+    job = adaptive.add("source", None, poll_interval=POLL, url=URL)
+    assert _next_run(adaptive, job) == POLL
+    assert job.reason == "poll"
+
+
+def test_failures_back_off_exponentially_up_to_the_cap(monkeypatch, hosts, frozen):
+    adaptive = _adaptive(monkeypatch)
+    job = adaptive.add("source", None, poll_interval=POLL, url=URL)
+    job.errors_in_row = 3
+    assert _next_run(adaptive, job) == 8 * POLL
+    assert job.reason == "backoff x3"
+
+    job.errors_in_row = 20
+    assert _next_run(adaptive, job) == scheduler.MAX_BACKOFF
+
+
+def test_a_failing_host_backs_off_jobs_that_have_not_failed_themselves(monkeypatch, hosts, frozen):
+    adaptive = _adaptive(monkeypatch)
+    job = adaptive.add("source", None, poll_interval=POLL, url=URL)
+    http_client._host_failures[HOST] = 2
+    assert _next_run(adaptive, job) == 4 * POLL
+    assert job.reason == "backoff x2"
+
+
+def test_retry_after_wins_when_it_is_later_than_the_backoff(monkeypatch, hosts, frozen):
+    adaptive = _adaptive(monkeypatch)
+    job = adaptive.add("source", None, poll_interval=POLL, url=URL)
+    http_client._host_failures[HOST] = 1
+    http_client._host_retry_after[HOST] = NOW.timestamp() + 600
+    assert _next_run(adaptive, job) == timedelta(seconds=600)
+    assert job.reason == "retry-after"
+
+    # An earlier Retry-After doesn't shorten the backoff
+    http_client._host_retry_after[HOST] = NOW.timestamp() + 10
+    assert _next_run(adaptive, job) == 2 * POLL
+    assert job.reason == "backoff x1"
+
+
+def test_an_open_circuit_defers_the_job_until_the_probe(monkeypatch, hosts, frozen):
+    adaptive = _adaptive(monkeypatch)
+    job = adaptive.add("source", None, poll_interval=POLL, url=URL)
+    host_breaker = breaker.get(HOST)
+    host_breaker.state, host_breaker.open_until = breaker.OPEN, NOW.timestamp() + 3600
+    assert _next_run(adaptive, job) == timedelta(hours=1)
+    assert job.reason == "circuit open"
+
+
+def test_a_job_waits_for_the_next_expected_data(monkeypatch, hosts, frozen):
+    adaptive = _adaptive(monkeypatch)
+    latest = {"btc": NOW - timedelta(minutes=10), "eth": NOW}
+
+    async def latest_timestamp(table, instrument):
+        return latest[instrument]
+
+    monkeypatch.setattr(scheduler.watermarks, "latest_timestamp", latest_timestamp)
+    job = adaptive.add("source", None, poll_interval=POLL, cadence=timedelta(hours=1), table="prices",
+                       instruments=["btc", "eth"], url=URL)
+    # Due as soon as the instrument furthest behind can have new data
+    assert _next_run(adaptive, job) == timedelta(minutes=50)
+    assert job.reason == "waiting for data"
+
+    # While failing, the backoff applies instead of the cadence
+    job.errors_in_row = 1
+    assert _next_run(adaptive, job) == 2 * POLL
+
+
+def test_run_counts_failures_and_resets_after_a_success(monkeypatch, hosts):
+    adaptive = _adaptive(monkeypatch)
+    outcomes = iter([RuntimeError("upstream changed its schema"), None])
+
+    async def fetch():
+        error = next(outcomes)
+        if error is not None:
+            raise error
+
+    job = adaptive.add("source", fetch, poll_interval=POLL)
+    asyncio.run(adaptive._run(job))
+    assert (job.errors_in_row, job.last_error, job.reason) == (1, "upstream changed its schema", "backoff x1")
+    assert adaptive.scheduler.jobs["source"] == job.next_run
+    asyncio.run(adaptive._run(job))
+    assert (job.errors_in_row, job.runs, job.reason) == (0, 2, "poll")
@@ -0,0 +1,209 @@
+"""The write-ahead spool on disk: frames, torn writes, segments, limits, replay and draining."""
+import asyncio
+from datetime import datetime, timedelta, UTC
+
+import asyncpg
+import pytest
+
+from db import bulk_writer, spool
+
+TARGET = spool.Target("prices", ("time", "instrument", "price"), ("time", "instrument"), ("price",))
+T0 = datetime(2025, 1, 1, tzinfo=UTC)
+
+
+@pytest.fixture(autouse=True)
+def spool_dir(tmp_path, monkeypatch):
+    """A fresh spool module state under tmp_path; the spool is closed again after the test."""
+    monkeypatch.setattr(spool, "ENABLED", True)
+    monkeypatch.setattr(spool, "DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(spool, "_segments", [])
+    monkeypatch.setattr(spool, "_next_sequence", 0)
+    monkeypatch.setattr(spool, "_pending", {"frames": 0, "rows": 0, "bytes": 0})
+    monkeypatch.setattr(spool, "_latest", {})
+    monkeypatch.setattr(spool, "_appended", asyncio.Event())
+    yield tmp_path
+    spool.close_spool()
+
+
+def _records(first, count, instrument="btc"):
+    return [(T0 + timedelta(minutes=minute), instrument, float(minute)) for minute in range(first, first + count)]
+
+
+def _append(records):
+    spool.append(TARGET, records, {records[0][1]: max(record[0] for record in records)})
+
+
+def _reopen(name="shard-0"):
+    spool.close_spool()
+    for state in ("frames", "rows", "bytes"):
+        spool._pending[state] = 0
+    spool._latest.clear()
+    spool.open_spool(name)
+
+
+def _drain_all():
+    """Every undrained record, committing as it goes."""
+    records = []
+    while (batch := spool.peek(10**6)) is not None:
+        records.extend(batch.records)
+        spool.commit(batch)
+    return records
+
+
+def test_shards_beyond_the_worker_count_are_adopted(spool_dir):
+    for index in range(3):
+        spool.open_spool(f"shard-{index}")
+        _append(_records(10 * index, 2, instrument=f"i{index}"))
+        spool.close_spool()
+
+    assert spool.adopt_shards(2) == ["shard-2"]
+    assert sorted(path.name for path in spool_dir.iterdir()) == ["shard-0", "shard-1"]
+
+    _reopen("shard-0")
+    assert _drain_all() == _records(0, 2, instrument="i0") + _records(20, 2, instrument="i2")
+    _reopen("shard-1")
+    assert _drain_all() == _records(10, 2, instrument="i1")
+
+
+def test_a_single_process_adopts_every_other_shard(spool_dir):
+    for index in (0, 3):
+        spool.open_spool(f"shard-{index}")
+        _append(_records(index, 1))
+        spool.close_spool()
+
+    assert spool.adopt_shards(1) == ["shard-3"]
+    assert spool.adopt_shards(1) == []
+    _reopen()
+    assert _drain_all() == _records(0, 1) + _records(3, 1)
+
+
+def test_appended_frames_are_replayed_after_reopening():
+    spool.open_spool("shard-0")
+    _append(_records(0, 3))
+    _append(_records(3, 2))
+    _reopen()
+
+    assert spool.backlog()["rows"] == 5
+    assert spool.pending_latest() == {("prices", "btc"): T0 + timedelta(minutes=4)}
+    batch = spool.peek(10**6)
+    assert (batch.target, batch.records, batch.frames) == (TARGET, _records(0, 5), 2)
+    spool.commit(batch)
+    assert spool.backlog() == {"frames": 0, "rows": 0, "bytes": 0}
+
+    # Drained frames stay drained
+    _reopen()
+    assert spool.peek(10**6) is None
+
+
+def test_peek_stops_at_max_rows_and_at_a_new_target():
+    other = spool.Target("other", TARGET.columns, TARGET.conflict_columns, None)
+    spool.open_spool("shard-0")
+    _append(_records(0, 3))
+    _append(_records(3, 3))
+    spool.append(other, _records(6, 1), {"btc": T0})
+
+    first = spool.peek(4)
+    assert (first.records, first.frames) == (_records(0, 3), 1)
+    spool.commit(first)
+    second = spool.peek(10**6)
+    assert (second.target, second.records) == (TARGET, _records(3, 3))
+    spool.commit(second)
+    assert spool.peek(10**6).target == other
+
+
+def test_a_torn_trailing_frame_is_dropped_and_earlier_frames_survive(spool_dir):
+    spool.open_spool("shard-0")
+    _append(_records(0, 2))
+    _append(_records(2, 2))
+    segment = spool._segments[-1]
+    _append(_records(4, 2))
+    # The crash hit while the last payload was being copied in: its checksum no longer matches
+    segment.map[segment.write - 1] ^= 0xFF
+    _reopen()
+
+    assert spool.backlog()["rows"] == 4
+    # Appends continue over the torn frame
+    _append(_records(10, 1))
+    _reopen()
+    assert _drain_all() == _records(0, 4) + _records(10, 1)
+
+
+def test_a_frame_whose_length_was_never_written_ends_the_segment():
+    spool.open_spool("shard-0")
+    _append(_records(0, 2))
+    segment = spool._segments[-1]
+    torn_at = segment.write
+    _append(_records(2, 2))
+    segment.map[torn_at:torn_at + spool._FRAME.size] = bytes(spool._FRAME.size)
+    _reopen()
+    assert _drain_all() == _records(0, 2)
+
+
+def test_segments_roll_over_and_drained_ones_are_deleted(spool_dir, monkeypatch):
+    monkeypatch.setattr(spool, "SEGMENT_BYTES", 4096)
+    spool.open_spool("shard-0")
+    for first in range(0, 200, 20):
+        _append(_records(first, 20))
+    # A batch larger than a segment gets a segment of its own size
+    _append(_records(200, 300))
+    directory = spool_dir / "shard-0"
+    assert len(spool._segments) > 2
+    assert len(list(directory.iterdir())) == len(spool._segments)
+
+    _reopen()
+    assert _drain_all() == _records(0, 500)
+    # Only the segment taking appends is left
+    assert len(list(directory.iterdir())) == len(spool._segments) == 1
+
+
+def test_appends_beyond_max_bytes_raise_spool_full(monkeypatch):
+    monkeypatch.setattr(spool, "SEGMENT_BYTES", 4096)
+    monkeypatch.setattr(spool, "MAX_BYTES", 3 * 4096)
+    spool.open_spool("shard-0")
+    appended = 0
+    with pytest.raises(spool.SpoolFull):
+        while True:
+            _append(_records(appended, 20))
+            appended += 20
+    assert 0 < appended and spool.backlog()["rows"] == appended
+
+    # Draining frees the space again
+    assert _drain_all() == _records(0, appended)
+    _append(_records(appended, 20))
+    assert spool.backlog()["rows"] == 20
+
+
+def test_a_poison_batch_is_isolated_and_rejected_without_blocking_later_ones(monkeypatch):
+    written, invalidated = [], []
+    poison = (T0 + timedelta(minutes=3), "btc", -1.0)  # the database refuses it
+
+    async def write(table, columns, records, conflict_columns, update_columns, latest):
+        if poison in records:
+            raise asyncpg.DataError("value out of range")
+        written.append(list(records))
+        return len(records)
+
+    monkeypatch.setattr(bulk_writer, "_write", write)
+    monkeypatch.setattr(bulk_writer.watermarks, "advance", lambda table, instrument, timestamp: None)
+    monkeypatch.setattr(bulk_writer.watermarks, "invalidate",
+                        lambda table, instrument=None: invalidated.append((table, instrument)))
+
+    async def main():
+        spool.open_spool("shard-0")
+        _append(_records(0, 3))
+        _append([poison])
+        _append(_records(4, 2))
+        _append(_records(6, 2))
+        drainer = asyncio.create_task(bulk_writer.drain_spool())
+        try:
+            async with asyncio.timeout(5):
+                while spool.backlog()["frames"]:
+                    await asyncio.sleep(0.01)
+        finally:
+            drainer.cancel()
+
+    asyncio.run(main())
+    # The merged batch is retried frame by frame until the bad frame is found, then merging resumes
+    assert written == [_records(0, 3), _records(4, 4)]
+    assert invalidated == [("prices", "btc")]
+    assert spool.peek(10**6) is None
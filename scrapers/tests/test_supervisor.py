@@ -0,0 +1,155 @@
+"""Process-pool mode: sharding jobs across workers and restarting workers that exit."""
+import os
+import subprocess
+import sys
+
+import pytest
+
+from core import supervisor
+
+KEYS = [(source, f"instrument{index}") for source in ("binance", "deribit", "laevitas") for index in range(50)]
+SCRAPERS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 8])
+def test_every_job_belongs_to_exactly_one_shard(count):
+    shards = [supervisor.Shard(index, count) for index in range(count)]
+    for key in KEYS:
+        assert sum(shard.owns(*key) for shard in shards) == 1
+
+
+def test_jobs_spread_over_every_shard():
+    shards = [supervisor.Shard(index, 4) for index in range(4)]
+    assert all(any(shard.owns(*key) for key in KEYS) for shard in shards)
+
+
+def test_shard_assignment_is_the_same_in_every_process():
+    def owners(seed):
+        # A fresh interpreter with its own string hash seed, as a restarted worker would have
+        script = ("from core.supervisor import Shard\n"
+                  f"print([next(i for i in range(4) if Shard(i, 4).owns(*key)) for key in {KEYS!r}])")
+        environment = {**os.environ, "PYTHONHASHSEED": str(seed), "SCRAPER_WORKERS": "1"}
+        return subprocess.run([sys.executable, "-c", script], cwd=SCRAPERS_DIR, env=environment,
+                              capture_output=True, text=True, check=True).stdout
+
+    assert owners(1) == owners(2)
+
+
+@pytest.mark.parametrize("environment, expected", [
+    ({"SCRAPER_WORKERS": "1"}, None),
+    ({"SCRAPER_WORKERS": "4"}, "2"),
+    ({"SCRAPER_WORKERS": "32"}, "2"),
+    ({"SCRAPER_WORKERS": "4", "DB_POOL_MAX_SIZE": "7"}, "7"),
+])
+def test_the_default_pool_size_is_split_between_workers(tmp_path, environment, expected):
+    base = {name: value for name, value in os.environ.items() if name != "DB_POOL_MAX_SIZE"}
+    script = "import os\nfrom core import workers\nprint(os.getenv('DB_POOL_MAX_SIZE'))"
+    result = subprocess.run([sys.executable, "-c", script], cwd=SCRAPERS_DIR, capture_output=True, text=True,
+                            env={**base, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path), **environment}, check=True)
+    assert result.stdout.strip() == str(expected)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.reports = []
+        self.closed = False
+
+    def poll(self):
+        return bool(self.reports)
+
+    def recv(self):
+        return self.reports.pop(0)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeProcess:
+    def __init__(self, pid):
+        self.pid = pid
+        self.exitcode = None
+
+    def start(self):
+        pass
+
+    def is_alive(self):
+        return self.exitcode is None
+
+
+class FakeContext:
+    """Stands in for the spawn context: records every process started instead of starting one."""
+
+    def __init__(self):
+        self.processes = []
+
+    def Pipe(self, duplex):
+        return FakeConnection(), FakeConnection()
+
+    def Process(self, target, args, name):
+        process = FakeProcess(pid=1000 + len(self.processes))
+        self.processes.append(process)
+        return process
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    context = FakeContext()
+    clock = [1000.0]
+    monkeypatch.setattr(supervisor, "_context", context)
+    monkeypatch.setattr(supervisor.time, "time", lambda: clock[0])
+    pool = supervisor.Supervisor(target=None, count=2)
+    pool.start()
+    return pool, context, clock
+
+
+def test_a_worker_that_exits_is_restarted_with_backoff(pool):
+    pool, context, clock = pool
+    crashed, healthy = pool.workers
+    first, first_conn = crashed.process, crashed.conn
+    first.exitcode = 1
+
+    pool.check()
+    assert crashed.restart_at == clock[0] + 1 and len(context.processes) == 2
+    clock[0] += 1
+    pool.check()
+    assert crashed.process is not first and crashed.pid == 1002 and crashed.restarts == 1
+    assert first_conn.closed
+    assert healthy.process is context.processes[1] and healthy.restarts == 0
+
+    # Crashing again before reporting doubles the delay
+    crashed.process.exitcode = 1
+    pool.check()
+    assert crashed.restart_at == clock[0] + 2
+
+
+def test_a_report_resets_the_backoff(pool):
+    pool, context, clock = pool
+    worker = pool.workers[0]
+    worker.crashes = 5
+    worker.conn.reports.append({"plan": [], "breakers": []})
+    pool.check()
+    assert worker.crashes == 0 and worker.last_seen == clock[0]
+
+    worker.process.exitcode = 1
+    pool.check()
+    assert worker.restart_at == clock[0] + 1
+
+
+def test_the_backoff_is_capped(pool, monkeypatch):
+    pool, context, clock = pool
+    monkeypatch.setattr(supervisor, "RESTART_MAX_BACKOFF", 60)
+    worker = pool.workers[0]
+    worker.crashes = 10
+    worker.process.exitcode = 1
+    pool.check()
+    assert worker.restart_at == clock[0] + 60
+
+
+def test_workers_are_not_restarted_while_stopping(pool):
+    pool, context, clock = pool
+    pool.stopping = True
+    pool.workers[0].process.exitcode = 0
+    clock[0] += 100
+    pool.check()
+    pool.check()
+    assert len(context.processes) == 2 and pool.workers[0].restart_at is None
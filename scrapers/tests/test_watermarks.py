@@ -0,0 +1,114 @@
+"""The in-memory high-water marks: seeding, advancing, spooled rows and invalidation."""
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, UTC
+
+import pytest
+
+from db import watermarks
+
+TABLE = "binance_ohlcv"
+NOW = datetime.now(UTC)
+RECENT = NOW - timedelta(hours=1)
+
+
+class Connection:
+    """Answers the seed query with `rows` and single lookups from `stored`, counting both."""
+
+    def __init__(self, rows=(), stored=None):
+        self.rows = list(rows)
+        self.stored = stored or {}
+        self.queries = []
+
+    async def fetch(self, query):
+        self.queries.append(query)
+        return self.rows
+
+    async def fetchval(self, query, *args):
+        self.queries.append(query)
+        table = query.split(" FROM ")[1].split()[0].rstrip(";")
+        return self.stored.get((table, args[0] if args else None))
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    conn = Connection()
+
+    @asynccontextmanager
+    async def acquire():
+        yield conn
+
+    monkeypatch.setattr(watermarks, "acquire", acquire)
+    monkeypatch.setattr(watermarks, "_watermarks", {})
+    monkeypatch.setattr(watermarks, "_seeded_tables", set())
+    monkeypatch.setattr(watermarks, "_stale", set())
+    return conn
+
+
+def _latest(table=TABLE, instrument="btc"):
+    return asyncio.run(watermarks.latest_timestamp(table, instrument))
+
+
+def test_seed_loads_every_table_in_one_query_and_later_reads_stay_in_memory(conn):
+    conn.rows = [
+        {"tbl": TABLE, "instrument": "btc", "latest": RECENT},
+        {"tbl": TABLE, "instrument": "eth", "latest": None},
+        {"tbl": "fear_greed_index", "instrument": None, "latest": RECENT - timedelta(days=1)},
+    ]
+    asyncio.run(watermarks.seed())
+    (query,) = conn.queries
+    assert all(table in query for table in watermarks.INSTRUMENT_TABLES + watermarks.GLOBAL_TABLES)
+
+    assert _latest() == RECENT
+    assert _latest("fear_greed_index", None) == RECENT - timedelta(days=1)
+    # Seeded tables without rows for an instrument start at the default window, without asking again
+    assert abs(_latest(instrument="eth") - watermarks.default_start(TABLE)) < timedelta(seconds=5)
+    assert len(conn.queries) == 1
+
+
+def test_an_old_watermark_is_clamped_to_the_default_window(conn):
+    conn.rows = [{"tbl": TABLE, "instrument": "btc", "latest": NOW - timedelta(days=30)}]
+    asyncio.run(watermarks.seed())
+    assert abs(_latest() - watermarks.default_start(TABLE)) < timedelta(seconds=5)
+    window = watermarks.WINDOWS["fear_greed_index"]
+    assert abs(_latest("fear_greed_index", None) - (datetime.now(UTC) - window)) < timedelta(seconds=5)
+
+
+def test_advance_only_moves_forward(conn):
+    asyncio.run(watermarks.seed())
+    watermarks.advance(TABLE, "btc", RECENT)
+    watermarks.advance(TABLE, "btc", RECENT - timedelta(minutes=5))
+    assert _latest() == RECENT
+    watermarks.advance(TABLE, "btc", RECENT + timedelta(minutes=1))
+    assert _latest() == RECENT + timedelta(minutes=1)
+    assert len(conn.queries) == 1
+
+
+def test_unseeded_tables_are_looked_up_once_and_then_advanced(conn):
+    conn.stored[(TABLE, "btc")] = RECENT
+    # Before the first lookup the cache doesn't know the stored maximum, so a write can't move it
+    watermarks.advance(TABLE, "btc", RECENT - timedelta(days=1))
+    assert _latest() == RECENT
+    watermarks.advance(TABLE, "btc", RECENT + timedelta(minutes=1))
+    assert _latest() == RECENT + timedelta(minutes=1)
+    assert len(conn.queries) == 1
+
+
+def test_invalidate_sends_the_next_read_back_to_the_database(conn):
+    asyncio.run(watermarks.seed())
+    watermarks.advance(TABLE, "btc", RECENT)
+    conn.stored[(TABLE, "btc")] = RECENT - timedelta(minutes=10)
+    watermarks.invalidate(TABLE, "btc")
+    # A write landing while the watermark is stale doesn't hide the gap
+    watermarks.advance(TABLE, "btc", RECENT + timedelta(minutes=1))
+    watermarks.spooled(TABLE, "btc", RECENT + timedelta(minutes=2))
+    assert _latest() == RECENT - timedelta(minutes=10)
+    assert _latest() == RECENT - timedelta(minutes=10)
+    assert len(conn.queries) == 2
+
+
+def test_spooled_rows_move_the_watermark_before_the_table_has_them(conn):
+    conn.stored[(TABLE, "btc")] = RECENT - timedelta(minutes=10)
+    watermarks.spooled(TABLE, "btc", RECENT)
+    assert _latest() == RECENT
+    assert conn.queries == []
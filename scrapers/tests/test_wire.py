@@ -0,0 +1,79 @@
+"""CDW wire format: round trips, the byte layout and malformed input."""
+import struct
+import zlib
+from datetime import datetime, UTC
+
+import pytest
+
+from core import wire, wire_benchmark
+
+CODECS = [wire.CODEC_NONE, wire.CODEC_DEFLATE] + ([wire.CODEC_ZSTD] if wire.zstandard is not None else [])
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_subscription_payload_round_trips(codec):
+    message = wire_benchmark.sample_message()
+    wire_benchmark._same(message, wire.decode(wire.encode(message, codec)))
+
+
+def test_nulls_missing_columns_and_empty_series():
+    when = datetime(2025, 1, 1, tzinfo=UTC)
+    message = {
+        "instrument": "eth",
+        "funding": [
+            {"time": when, "rate": 0.5, "label": "a"},
+            {"time": "2025-01-01T00:01:00+00:00", "rate": None},
+            {"time": 1735689540000, "rate": -1.25, "label": None, "late": "x"},
+        ],
+        "empty": [],
+    }
+    decoded = wire.decode(wire.encode(message))
+    assert decoded == {
+        "instrument": "eth",
+        "funding": [
+            {"time": 1735689600000, "rate": 0.5, "label": "a", "late": None},
+            {"time": 1735689660000, "rate": None, "label": None, "late": None},
+            {"time": 1735689540000, "rate": -1.25, "label": None, "late": "x"},
+        ],
+        "empty": [],
+    }
+
+
+def test_byte_layout():
+    message = {"instrument": "btc", "s": [{"time": 1000, "v": 1.5, "k": "a"}, {"time": 1060, "v": None, "k": None}]}
+    body = b"".join([
+        struct.pack("<H", 3), b"btc", struct.pack("<H", 1),
+        struct.pack("<H", 1), b"s", struct.pack("<IH", 2, 2),
+        struct.pack("<q", 1000), struct.pack("<i", 60),
+        struct.pack("<H", 1), b"v", struct.pack("<B", wire.TYPE_FLOAT64), struct.pack("<2d", 1.5, float("nan")),
+        struct.pack("<H", 1), b"k", struct.pack("<B", wire.TYPE_STRING),
+        struct.pack("<H", 1), struct.pack("<H", 1), b"a", struct.pack("<2H", 0, wire.NULL_CODE),
+    ])
+    header = wire.MAGIC + struct.pack("<BB", wire.VERSION, wire.CODEC_NONE)
+    assert wire.encode(message, wire.CODEC_NONE) == header + body
+    deflated = wire.encode(message, wire.CODEC_DEFLATE)
+    assert deflated[:5] == wire.MAGIC + struct.pack("<BB", wire.VERSION, wire.CODEC_DEFLATE)
+    assert zlib.decompress(deflated[5:]) == body
+
+
+def test_time_deltas_must_fit_in_32_bits():
+    with pytest.raises(wire.WireError):
+        wire.encode({"s": [{"time": 0}, {"time": 2**31}]})
+    # A delta just inside the range (and a negative one) is fine
+    rows = [{"time": 0}, {"time": 2**31 - 1}, {"time": 0}]
+    assert wire.decode(wire.encode({"s": rows}))["s"] == rows
+
+
+@pytest.mark.parametrize("data", [
+    b"XYZ\x01\x00",
+    wire.MAGIC + struct.pack("<BB", wire.VERSION + 1, wire.CODEC_NONE),
+    wire.MAGIC + struct.pack("<BB", wire.VERSION, 9),
+])
+def test_malformed_headers_are_rejected(data):
+    with pytest.raises(wire.WireError):
+        wire.decode(data)
+
+
+def test_unknown_codec_is_rejected_when_encoding():
+    with pytest.raises(wire.WireError):
+        wire.encode({"s": []}, codec=9)